@@ -1,44 +1,92 @@
-from flask import Flask
-from flask_cors import CORS
-from .config import config
-import os
-
-def create_app(config_name=None):
-    if config_name is None:
-        config_name = os.environ.get('FLASK_ENV', 'development')
-    
-    app = Flask(__name__)
-    
-    # 允许跨域请求
-    CORS(app)
-    
-    # 加载配置
-    app.config.from_object(config[config_name])
-    config[config_name].init_app(app)
-    
-    # 确保数据文件存在
-    data_file = os.path.join(app.root_path, '..', 'ai_data.json')
-    prompt_file = os.path.join(app.root_path, '..', 'prompt.txt')
-    
-    if not os.path.exists(data_file):
-        with open(data_file, 'w', encoding='utf-8') as f:
-            f.write('[]')
-    
-    if not os.path.exists(prompt_file):
-        with open(prompt_file, 'w', encoding='utf-8') as f:
-            f.write('')
-    
-    # 注册蓝图
-    from .api import api_bp
-    app.register_blueprint(api_bp)
-    
-    # 错误处理
-    @app.errorhandler(404)
-    def page_not_found(e):
-        return {"error": "页面未找到"}, 404
-
-    @app.errorhandler(500)
-    def internal_server_error(e):
-        return {"error": "服务器内部错误"}, 500
-        
+from flask import Flask
+from flask_cors import CORS
+from .config import config, Config
+from .models import get_db
+import logging
+import os
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s %(message)s'
+
+_fork_hook_registered = False
+
+def configure_logging(level=None, log_file=None):
+    """配置 app 包的日志：输出到终端，并可写入日志文件；level 为 OFF 时关闭"""
+    level = (level or Config.LOG_LEVEL).upper()
+    logger = logging.getLogger('app')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.propagate = False
+    if level == 'OFF':
+        logger.setLevel(logging.CRITICAL + 1)
+        return logger
+    logger.setLevel(getattr(logging, level, logging.INFO))
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+def reset_after_fork():
+    """在 fork 出的子进程中执行（如 gunicorn --preload 的工作进程、锦标赛的子进程）
+
+    父进程的数据库连接、HTTP 连接池与线程不能在子进程里继续使用：全部丢弃，之后按需重建；
+    进行中的游戏改为从磁盘加载（见 app.sessions）。
+    """
+    from . import metrics, models, prefetch, resilience
+    from .api import job_manager, session_manager
+    from .services import client_pool, scheduler
+    models.reset_after_fork()
+    metrics.reset_after_fork()
+    client_pool.reset_after_fork()
+    scheduler.reset_after_fork()
+    resilience.reset_after_fork()
+    prefetch.reset_after_fork()
+    session_manager.reset_after_fork()
+    job_manager.reset_after_fork()
+
+def create_app(config_name=None):
+    if config_name is None:
+        config_name = os.environ.get('FLASK_ENV', 'development')
+    
+    app = Flask(__name__)
+    
+    # 允许跨域请求
+    CORS(app)
+    
+    # 加载配置
+    app.config.from_object(config[config_name])
+    config[config_name].init_app(app)
+    configure_logging(app.config.get('LOG_LEVEL'), app.config.get('LOG_FILE'))
+    
+    # 确保数据文件存在（AI 数据存放在 SQLite 中，首次启动时自动从 ai_data.json 迁移）
+    prompt_file = os.path.join(app.root_path, '..', 'prompt.txt')
+    get_db()
+    
+    if not os.path.exists(prompt_file):
+        with open(prompt_file, 'w', encoding='utf-8') as f:
+            f.write('')
+    
+    # 注册蓝图
+    from .api import api_bp
+    app.register_blueprint(api_bp)
+
+    # 预派生的服务器在创建应用后才 fork 出工作进程时，子进程需要丢弃继承来的连接和线程池
+    global _fork_hook_registered
+    if not _fork_hook_registered and hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=reset_after_fork)
+        _fork_hook_registered = True
+    
+    # 错误处理
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return {"error": "页面未找到"}, 404
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        return {"error": "服务器内部错误"}, 500
+        
     return app
\ No newline at end of file
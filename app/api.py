@@ -1,527 +1,1106 @@
-from flask import Blueprint, request, jsonify, render_template
-from app.models import load_data, save_data, load_prompt, save_prompt
-from app.services import get_client, call_api, call_vote_api
-import os
-import uuid
-import json
-import random
-import logging
-api_bp = Blueprint('api', __name__)
-
-DATA_FILE = os.path.join(os.path.dirname(__file__), '..', 'ai_data.json')
-PROMPT_FILE = os.path.join(os.path.dirname(__file__), '..', 'prompt.txt')
-GAME_STATE_FILE = os.path.join(os.path.dirname(__file__), '..', 'game_state.json')
-
-# game_state 读写
-
-def load_game_state():
-    if os.path.exists(GAME_STATE_FILE):
-        with open(GAME_STATE_FILE, 'r', encoding='utf-8') as f:
-            try:
-                return json.load(f)
-            except Exception:
-                return None
-    return None
-
-def save_game_state(state):
-    with open(GAME_STATE_FILE, 'w', encoding='utf-8') as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
-
-# 日志记录
-logging.basicConfig(filename='cyber_cricket.log', level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
-
-@api_bp.route('/')
-def index():
-    prompt = load_prompt()
-    return render_template('index.html', prompt=prompt)
-
-@api_bp.route('/get_data', methods=['GET'])
-def get_data():
-    data = load_data()
-    return jsonify(data)
-
-@api_bp.route('/add_ai', methods=['POST','GET'])
-def add_ai():
-    data = load_data()
-    name = request.json.get('name')
-    apikey = request.json.get('apikey')
-    apibase = request.json.get('apibase')
-    # 唯一性校验
-    if not name or not apikey or not apibase:
-        return jsonify({"error": "名称和 API 均不能为空！"}), 400
-    if any(ai['name'] == name for ai in data):
-        return jsonify({"error": "AI 名称已存在！"}), 400
-    if any(ai['apikey'] == apikey for ai in data):
-        return jsonify({"error": "API Key 已存在！"}), 400
-    if any(ai['apibase'] == apibase for ai in data):
-        return jsonify({"error": "API Base 已存在！"}), 400
-    new_ai = {
-        "id": str(uuid.uuid4()),
-        "name": name,
-        "apikey": apikey,
-        "apibase": apibase,
-        "score": 0,
-        "messages": []
-    }
-    data.append(new_ai)
-    save_data(data)
-    return jsonify(new_ai)
-
-@api_bp.route('/edit_ai/<ai_id>', methods=['PUT'])
-def edit_ai(ai_id):
-    data = load_data()
-    name = request.json.get('name')
-    apikey = request.json.get('apikey')
-    apibase = request.json.get('apibase')
-    if not name or not apikey or not apibase:
-        return jsonify({"error": "名称和 API 均不能为空！"}), 400
-    ai = next((item for item in data if item["id"] == ai_id), None)
-    if not ai:
-        return jsonify({"error": "AI 未找到"}), 404
-    ai["name"] = name
-    ai["apikey"] = apikey
-    ai["apibase"] = apibase
-    save_data(data)
-    return jsonify(ai)
-
-@api_bp.route('/delete_ai/<ai_id>', methods=['DELETE'])
-def delete_ai(ai_id):
-    data = load_data()
-    data = [ai for ai in data if ai["id"] != ai_id]
-    save_data(data)
-    return jsonify({"message": "AI 已删除"})
-
-@api_bp.route('/get_prompt', methods=['GET'])
-def get_prompt():
-    prompt = load_prompt()
-    return jsonify({"prompt": prompt})
-
-@api_bp.route('/set_prompt', methods=['POST','GET'])
-def set_prompt():
-    text = request.json.get('text')
-    save_prompt(text)
-    return jsonify({"message": "提示词已保存"})
-
-@api_bp.route('/call_ai/<ai_id>', methods=['POST','GET'])
-def call_ai(ai_id):
-    data = load_data()
-    ai = next((item for item in data if item["id"] == ai_id), None)
-    if not ai:
-        return jsonify({"error": "AI 未找到"}), 404
-    message = request.json.get('message')
-    if not message:
-        return jsonify({"error": "消息不能为空"}), 400
-    response = call_api(ai, message, is_your_turn=True)
-    return jsonify({"response": response})
-
-@api_bp.route('/start_game', methods=['POST','GET'])
-def start_game():
-    print("[阶段提示] 游戏初始化，准备分配玩家编号和清空历史消息。")
-    data = load_data()
-    if len(data) < 2:
-        return jsonify({"error": "需要至少2个AI才能开始游戏"}), 400
-    # 只清空 messages，不清零 score
-    for ai in data:
-        ai["messages"] = []
-    save_data(data)
-    # 分配玩家序号
-    player_map = {}
-    for idx, ai in enumerate(data):
-        player_map[ai['id']] = f"玩家{idx+1}"
-    print(f"[详细] 玩家编号分配完成：{player_map}")
-    # 初始化 game_state
-    state = {
-        "round": 0,  # 预检阶段为第0轮
-        "activeAIs": [ai['id'] for ai in data],
-        "player_map": player_map,  # id->玩家序号
-        "history": [],  # 每轮发言
-        "votes": [],    # 每轮投票
-        "eliminated": [],
-        "last_vote": {},
-        "winner": None
-    }
-    save_game_state(state)
-    print("[阶段提示] 进入预检阶段，每个AI进行自我介绍。")
-    prompt = load_prompt()
-    responses = []
-    for ai in data:
-        try:
-            ai_name = player_map[ai['id']]
-            print(f"[详细] 预检自我介绍，AI：{ai_name} (ID: {ai['id']})")
-            response = call_api(ai, prompt, is_your_turn=True, all_messages=[], ai_name=ai_name)
-            responses.append({
-                "ai_id": ai["id"],
-                "name": ai_name,
-                "response": response
-            })
-            # 查重写入messages
-            if not ai["messages"] or ai["messages"][-1]["content"] != response:
-                ai["messages"].append({
-                    "role": "assistant",
-                    "ai_name": ai_name,
-                    "content": response
-                })
-        except Exception as e:
-            logging.error(f"AI {ai['name']} 响应错误: {str(e)}")
-            print(f"[错误] AI {ai['name']} 预检自我介绍出错: {str(e)}")
-            return jsonify({"error": f"AI {ai['name']} 响应错误: {str(e)}"}), 500
-    save_data(data)
-    # 预检阶段 history 只写 round=0
-    state['history'] = [{"round": 0, "responses": responses}]
-    save_game_state(state)
-    print("[阶段提示] 预检阶段结束，进入第1轮正式发言。")
-    # 新增：自动推进到第一轮
-    try:
-        # 初始化第一轮数据结构
-        new_round = {
-            "round": 1,
-            "responses": []
-        }
-        state['history'].append(new_round)
-        state['round'] = 1
-        save_game_state(state)
-        return jsonify({"responses": responses, "round": 0, "player_map": player_map})
-    except Exception as e:
-        logging.error(f"推进到第一轮失败: {str(e)}")
-        return jsonify({"error": f"初始化第一轮失败: {str(e)}"}), 500
-
-@api_bp.route('/next_round', methods=['POST','GET'])
-def next_round():
-    print("[DEBUG] 开始执行next_round")
-    data = load_data()
-    state = load_game_state()
-    
-    if not state or not state.get('activeAIs'):
-        print("[错误] 游戏未开始或未找到活跃AI")
-        return jsonify({"error": "请先开始游戏"}), 400
-
-    # 当前轮次
-    current_round = state['round']
-    print(f"[DEBUG] 当前轮次：{current_round}")
-    
-    # 确保当前轮次状态正确
-    if not state['history']:
-        print("[错误] 未找到历史记录")
-        return jsonify({"error": "游戏状态异常"}), 400
-    
-    # 获取当前轮次的历史记录
-    current_round_history = next((h for h in state['history'] if h['round'] == current_round), None)
-    if not current_round_history:
-        print(f"[错误] 未找到当前轮次 {current_round} 的历史记录")
-        return jsonify({"error": "游戏状态异常"}), 400
-
-    # 发言阶段
-    if not current_round_history.get('responses'):
-        print(f"[DEBUG] 第{current_round}轮发言阶段开始")
-        # 组装历史消息
-        all_history = []
-        for round_obj in state['history']:
-            if round_obj['round'] < current_round:
-                all_history.extend([
-                    {"role": "assistant", "ai_name": resp['name'], "content": resp['response']} 
-                    for resp in round_obj.get('responses', [])
-                ])
-
-        # 收集本轮所有AI的回复
-        responses = []
-        for ai in data:
-            if ai['id'] not in state['activeAIs']:
-                continue
-            ai_name = state['player_map'][ai['id']]
-            print(f"[阶段提示] AI {ai_name} (ID: {ai['id']}) 开始发言")
-            try:
-                response = call_api(
-                    ai, 
-                    f"现在是第{current_round}轮发言，请继续发言，记住要回应其他人的话题。", 
-                    is_your_turn=True,
-                    all_messages=all_history,
-                    ai_name=ai_name,
-                )
-                responses.append({
-                    "ai_id": ai["id"],
-                    "name": ai_name,
-                    "response": response
-                })
-                print(f"[阶段提示] AI {ai_name} 发言完成")
-                
-                # 记录AI消息
-                if not ai.get('messages'):
-                    ai['messages'] = []
-                if not ai['messages'] or ai['messages'][-1]['content'] != response:
-                    ai['messages'].append({
-                        "role": "assistant",
-                        "ai_name": ai_name,
-                        "content": response
-                    })
-            except Exception as e:
-                print(f"[错误] AI {ai_name} 发言失败: {str(e)}")
-                return jsonify({"error": f"AI {ai_name} 响应错误: {str(e)}"}), 500
-
-        # 更新游戏状态
-        current_round_history['responses'] = responses
-        save_data(data)
-        save_game_state(state)
-        print(f"[阶段提示] 第{current_round}轮发言阶段结束，等待进入投票阶段")
-
-        return jsonify({
-            "responses": responses,
-            "round": current_round,
-            "player_map": state['player_map'],
-            "votes": [],
-            "eliminated": None,
-            "winner": None,
-            "is_vote_stage": False,
-            "has_next_round": True
-        })
-
-@api_bp.route('/get_game_state', methods=['GET'])
-def get_game_state():
-    state = load_game_state()
-    return jsonify(state or {})
-
-@api_bp.route('/step_round', methods=['POST','GET'])
-def step_round():
-    """
-    分步推进接口：每次只推进一个AI的发言或投票。
-    前端需传递参数：
-      - stage: 'speak' 或 'vote'
-      - ai_index: 当前activeAIs中的索引（int）
-    返回：
-      - 当前AI发言/投票内容
-      - 阶段、AI名、AI编号、轮次、是否阶段结束、是否游戏结束等
-    """
-    data = load_data()
-    state = load_game_state()
-    if not state or not state.get('activeAIs'):
-        print("[分步推进] 未找到活跃AI或未开始游戏")
-        return jsonify({"error": "请先开始游戏"}), 400
-    if state.get('winner'):
-        print(f"[分步推进] 游戏已结束，胜者: {state['winner']}")
-        return jsonify({"error": "游戏已结束，胜者: " + state['winner'], "is_game_over": True}), 400
-    req = request.get_json(force=True)
-    stage = req.get('stage', 'speak')  # 'speak' or 'vote'
-    ai_index = int(req.get('ai_index', 0))
-    activeAIs = state['activeAIs']
-    player_map = state['player_map']
-    round_num = state['round']
-    # 修正：只要进入发言阶段且还在预检，自动推进到第1轮
-    if round_num == 0 and stage == 'speak':
-        round_num = 1
-        state['round'] = 1
-        save_game_state(state)
-    # 组装历史
-    all_history = []
-    for round_obj in state['history']:
-        if round_obj['round'] < round_num:
-            all_history.extend([
-                {"role": "assistant", "ai_name": resp['name'], "content": resp['response']} for resp in round_obj['responses']
-            ])
-    # 阶段推进
-    if stage == 'speak':
-        if ai_index >= len(activeAIs):
-            print(f"[分步推进] 发言阶段结束，轮次：{round_num}")
-            return jsonify({"error": "发言阶段已全部完成", "is_stage_end": True, "stage": "speak", "round": round_num})
-        ai_id = activeAIs[ai_index]
-        ai = next((a for a in data if a['id'] == ai_id), None)
-        ai_name = player_map[ai_id]
-        print(f"[分步推进] 发言开始，AI：{ai_name} (ID: {ai_id})，轮次：{round_num}")
-        response = call_api(
-            ai, 
-            f"第{round_num}轮发言，请继续本轮发言。", 
-            is_your_turn=True, 
-            all_messages=all_history, 
-            ai_name=ai_name
-        )
-        print(f"[分步推进] 发言结束，AI：{ai_name} (ID: {ai_id})，内容：{response}")
-        # 查重写入messages
-        if not ai['messages'] or ai['messages'][-1]['content'] != response:
-            ai['messages'].append({
-                "role": "assistant",
-                "ai_name": ai_name,
-                "content": response
-            })
-        save_data(data)
-        # 查重写入history
-        if not state['history'] or state['history'][-1]['round'] != round_num:
-            state['history'].append({"round": round_num, "responses": []})
-        if not any(r['ai_id'] == ai_id for r in state['history'][-1]['responses']):
-            state['history'][-1]['responses'].append({
-                "ai_id": ai_id,
-                "name": ai_name,
-                "response": response
-            })
-        save_game_state(state)
-        is_stage_end = (ai_index == len(activeAIs) - 1)
-        if is_stage_end:
-            print(f"[分步推进] 发言阶段全部完成，轮次：{round_num}")
-        return jsonify({
-            "stage": "speak",
-            "ai_index": ai_index,
-            "ai_id": ai_id,
-            "ai_name": ai_name,
-            "round": round_num,
-            "response": response,
-            "is_stage_end": is_stage_end,
-            "is_game_over": False
-        })
-    elif stage == 'vote':
-        # 新增：从state中获取当前投票记录（修复未定义错误）
-        votes_step = state.get('votes_step', [])
-        
-        # 统计有效投票
-        valid_votes = [v for v in votes_step if v.get('target_id') != '0']
-        
-        # 处理同票情况
-        from collections import Counter
-        # 修正：使用target_id作为计数键（防止字典不可哈希问题）
-        vote_targets = [v['target_id'] for v in valid_votes]
-        vote_counts = Counter(vote_targets)
-        
-        # 获取最大票数
-        max_votes = max(vote_counts.values(), default=0)
-        
-        # 找出最高票者
-        top_candidates = [k for k,v in vote_counts.items() if v == max_votes]
-        
-        # 同票或无投票时处理
-        if len(top_candidates) > 1 or max_votes == 0:
-            # 设置空淘汰者并记录日志
-            state['eliminated'].append({
-                'round': round_num,
-                'ai_id': None,
-                'reason': '同票或无人投票' if len(top_candidates) > 1 else '全体弃权'
-            })
-            # 返回特殊状态码提示前端
-            return jsonify({
-                **state,
-                'skip_elimination': True,
-                'message': '本轮投票平局，无人被淘汰'
-            })
-
-        # 正常淘汰最高票者
-        eliminated = top_candidates[0]
-        state['eliminated'].append({
-            'round': round_num,
-            'ai_id': eliminated
-        })
-        
-        # 修正：每轮投票阶段开始时初始化votes_step
-        if ai_index == 0 or 'votes_step' not in state or not isinstance(state['votes_step'], list):
-            state['votes_step'] = []
-            save_game_state(state)
-        if ai_index >= len(activeAIs):
-            print(f"[分步推进] 投票阶段结束，轮次：{round_num}")
-            # 统计得票
-            vote_count = {}
-            for v in state['votes_step']:
-                if v['target_id'] != '0':
-                    vote_count[v['target_id']] = vote_count.get(v['target_id'], 0) + 1
-            eliminated = None
-            winner = None
-            if len(vote_count) > 0:
-                max_votes = max(vote_count.values())
-                eliminated_ids = [k for k, v in vote_count.items() if v == max_votes]
-                eliminated = random.choice(eliminated_ids)
-                if eliminated in state['activeAIs']:
-                    state['activeAIs'].remove(eliminated)
-                    state['eliminated'].append({"round": round_num, "ai_id": eliminated})
-                    print(f"[淘汰信息] 本轮淘汰：{player_map.get(eliminated, eliminated)} (AI真实ID: {eliminated})")
-            else:
-                print("[详细] 本轮无人被淘汰。")
-            # 判断胜者或只剩2人提前结束
-            if len(state['activeAIs']) == 2:
-                for ai_item in data:
-                    if ai_item['id'] in state['activeAIs']:
-                        ai_item['score'] += 1
-                eliminated_ids = [e['ai_id'] for e in state.get('eliminated', [])]
-                for ai_item in data:
-                    if ai_item['id'] in eliminated_ids:
-                        ai_item['score'] -= 1
-                state['winner'] = '|'.join(state['activeAIs'])
-                winner = state['winner']
-                save_data(data)
-            elif len(state['activeAIs']) == 1:
-                winner = state['activeAIs'][0]
-                state['winner'] = winner
-                for ai_item in data:
-                    if ai_item['id'] == winner:
-                        ai_item['score'] += 1
-                save_data(data)
-            print(f"[胜负信息] 游戏结束，胜者：{player_map.get(winner, winner) if winner else ''} (AI真实ID: {winner if winner else ''})")
-            for v in state['votes_step']:
-                state['votes'].append(v)
-                state['last_vote'][v['voter_id']] = v['target_id']
-            state['votes_step'] = []
-            save_game_state(state)
-            return jsonify({
-                "stage": "vote",
-                "ai_index": ai_index,
-                "ai_id": None,
-                "ai_name": None,
-                "round": round_num,
-                "vote": None,
-                "is_stage_end": True,
-                "eliminated": eliminated,
-                "winner": state.get('winner'),
-                "is_game_over": state.get('winner') is not None,
-                "player_map": player_map
-            })
-        ai_id = activeAIs[ai_index]
-        ai = next((a for a in data if a['id'] == ai_id), None)
-        ai_name = player_map[ai_id]
-        print(f"[分步推进] 投票开始，AI：{ai_name} (ID: {ai_id})，轮次：{round_num}")
-        # 本轮responses
-        if not state['history'] or state['history'][-1]['round'] != round_num:
-            print("[分步推进] 投票阶段未找到本轮发言历史")
-            return jsonify({"error": "请先完成发言阶段"}), 400
-        responses = state['history'][-1]['responses']
-        eliminated_ids = [e['ai_id'] for e in state['eliminated']]
-        vote_id = call_vote_api(
-            ai,
-            responses,
-            round_num,
-            player_map,
-            activeAIs,
-            eliminated_ids
-        )
-        if vote_id == str(player_map[ai['id']])[-1]:
-            vote_id = '0'
-        vote_obj = {
-            "round": round_num,
-            "voter_id": ai['id'],
-            "target_id": get_ai_id_by_player_num(player_map, vote_id, activeAIs) if vote_id != '0' else '0'
-        }
-        print(f"[分步推进] 投票结束，AI：{ai_name} (ID: {ai_id})，投票对象：{vote_obj['target_id'] if vote_obj['target_id'] != '0' else '弃权'}")
-        # 初始化 votes_step
-        if 'votes_step' not in state or not isinstance(state['votes_step'], list):
-            state['votes_step'] = []
-        state['votes_step'].append(vote_obj)
-        save_game_state(state)
-        is_stage_end = (ai_index == len(activeAIs) - 1)
-        eliminated = None
-        winner = None
-        # 结算逻辑已在ai_index>=len(activeAIs)时处理
-        if is_stage_end:
-            print(f"[分步推进] 投票阶段全部完成，轮次：{round_num}")
-        return jsonify({
-            "stage": "vote",
-            "ai_index": ai_index,
-            "ai_id": ai_id,
-            "ai_name": ai_name,
-            "round": round_num,
-            "vote": vote_obj,
-            "is_stage_end": is_stage_end,
-            "eliminated": eliminated,
-            "winner": state.get('winner'),
-            "is_game_over": state.get('winner') is not None,
-            "player_map": player_map
-        })
-    else:
-        print(f"[分步推进] 未知阶段: {stage}")
-        return jsonify({"error": "未知阶段"}), 400
-
-def get_ai_id_by_player_num(player_map, num, activeAIs):
-    for k, v in player_map.items():
-        if v.endswith(str(num)) and k in activeAIs:
-            return k
-    return '0'
\ No newline at end of file
+from flask import Blueprint, Response, request, jsonify, render_template, current_app, stream_with_context
+from app.models import (
+    load_data, save_data, load_prompt, save_prompt, get_ai, ai_exists, insert_ai, update_ai,
+    delete_ai_record, update_score, append_message, data_version, list_ais, count_ais, get_messages,
+    LISTABLE_FIELDS
+)
+from app.services import (
+    get_client, invalidate_client, call_api, call_api_stream, call_vote_api, get_usage_stats, client_pool,
+    build_speak_messages, scheduler
+)
+from app.scheduler import set_game
+from app.jobs import JobManager, JobCancelled, JobFailed, JobQueueFull, GameBusy, FINISHED_STATES
+from app.prefetch import SpeechPrefetcher
+from app import metrics
+from app.engine import (
+    new_game_state, run_intro, run_speeches, run_turns, collect_votes, sync_transcript, speak_message, make_vote,
+    GAME_MODES, MODE_CLASSIC, MODE_FUSED
+)
+from app import engine
+from app.tournament import run_tournament
+import os
+import uuid
+import json
+import time
+import zlib
+import logging
+from functools import wraps
+from app.config import Config
+from app.sessions import SessionManager
+api_bp = Blueprint('api', __name__)
+logger = logging.getLogger(__name__)
+
+DATA_FILE = os.path.join(os.path.dirname(__file__), '..', 'ai_data.json')
+PROMPT_FILE = os.path.join(os.path.dirname(__file__), '..', 'prompt.txt')
+GAMES_DIR = os.path.join(Config.DATA_DIR, 'games')
+
+# 多局游戏：每局的快照和事件日志存放在 games/<game_id>/，进行中的游戏常驻内存
+session_manager = SessionManager(
+    GAMES_DIR,
+    snapshot_every=Config.GAME_SNAPSHOT_EVERY,
+    persist_interval=Config.GAME_PERSIST_INTERVAL,
+    finished_ttl=Config.GAME_FINISHED_TTL,
+    idle_ttl=Config.GAME_IDLE_TTL,
+    recent_events=Config.GAME_EVENT_BUFFER
+)
+
+# 开局、整轮和锦标赛可以作为后台任务执行（见 app.jobs）
+job_manager = JobManager(Config.JOB_WORKERS, Config.JOB_MAX_PENDING, Config.JOB_TTL, Config.GAME_SYNC_INTERVAL)
+
+def request_game_id():
+    """从请求体或查询参数中取 game_id，未传时使用最近开始的一局"""
+    req = request.get_json(silent=True) or {}
+    return req.get('game_id') or request.args.get('game_id')
+
+def load_game_state(game_id=None):
+    session = session_manager.get(game_id)
+    return session.read_state() if session else None
+
+def save_game_state(state):
+    """为新游戏分配 game_id 并写入初始快照，游戏过程中的变化请用 record_event"""
+    return session_manager.create(state)
+
+def record_event(state, event_type, **payload):
+    """追加一个游戏事件（发言、投票、淘汰、胜者、新一轮）并同步更新 state"""
+    return session_manager.record(state, event_type, **payload)
+
+def with_game_session(view):
+    """按请求中的 game_id 取出游戏并持有该局的锁，把 state 传给视图（没有游戏时为 None）"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        session = session_manager.get(request_game_id())
+        if session is None:
+            return view(*args, state=None, **kwargs)
+        busy = game_busy_response(session.game_id)
+        if busy is not None:
+            return busy
+        set_game(session.game_id)
+        with session.lock:
+            return view(*args, state=session.state, **kwargs)
+    return wrapper
+
+def game_busy_response(game_id):
+    """该局有后台任务在进行时返回 409，避免请求线程排队等待本局的锁"""
+    job = job_manager.active_for(game_id)
+    if job is None:
+        return None
+    return jsonify({"error": "本局游戏有后台任务正在进行，请等待任务结束", "job_id": job.id}), 409
+
+def parse_ai_index(value):
+    """请求中的 ai_index：非负整数，不合法时返回 None"""
+    try:
+        ai_index = int(value)
+    except (TypeError, ValueError):
+        return None
+    return ai_index if ai_index >= 0 else None
+
+def request_async():
+    req = request.get_json(silent=True) or {}
+    value = req.get('async', request.args.get('async'))
+    return str(value).lower() in ('1', 'true', 'yes') if value is not None else False
+
+def submit_job(kind, fn, game_id=None):
+    """提交后台任务 fn(job) 并返回 202 和任务信息
+
+    fn 在应用上下文中执行，可以直接复用视图函数的代码：返回的响应会被转换成任务结果，
+    错误响应（状态码 >= 400）记为任务失败。
+    """
+    app = current_app._get_current_object()
+
+    def run(job):
+        set_game(game_id)
+        with app.app_context():
+            return job_payload(fn(job))
+
+    try:
+        job = job_manager.submit(kind, run, game_id)
+    except GameBusy as e:
+        return jsonify({"error": str(e), "job_id": e.job.id}), 409
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify(job.to_dict()), 202, {"Location": f"/jobs/{job.id}"}
+
+def job_payload(rv):
+    """把视图返回值（响应或 (响应, 状态码)）转换为任务结果"""
+    status = None
+    if isinstance(rv, tuple):
+        rv, status = rv[0], rv[1]
+    if isinstance(rv, Response):
+        status = status or rv.status_code
+        rv = rv.get_json()
+    if status is not None and status >= 400:
+        raise JobFailed((rv or {}).get('error') or f"任务失败（{status}）")
+    return rv
+
+@api_bp.before_request
+def reset_request_game():
+    # 请求线程会被复用，先清掉上一个请求所属的游戏（见 app.scheduler 的公平排队）
+    set_game(None)
+
+def _speak_max_workers():
+    """发言阶段的并发数，关闭并发发言时退化为逐个调用"""
+    if not current_app.config.get('CONCURRENT_SPEAK', True):
+        return 1
+    return max(1, int(current_app.config.get('SPEAK_CONCURRENCY', 4)))
+
+@api_bp.route('/')
+def index():
+    prompt = load_prompt()
+    return render_template('index.html', prompt=prompt)
+
+# 分页接口每页的最大条数
+MAX_PAGE_SIZE = 200
+
+@api_bp.route('/get_data', methods=['GET'])
+def get_data():
+    """
+    AI 列表。查询参数（均可选，不传时返回全部AI的全部字段，含 messages）：
+      - fields: 逗号分隔的字段，可选 id、name、apikey、apibase、score、messages、message_count
+      - limit / offset: 分页；响应头 X-Total-Count 为AI总数，还有下一页时 X-Next-Offset 为下一页的 offset
+    """
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or None
+    try:
+        limit = page_arg('limit')
+        offset = page_arg('offset') or 0
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if limit is not None:
+        limit = min(limit, MAX_PAGE_SIZE)
+    unknown = [f for f in fields or () if f not in LISTABLE_FIELDS]
+    if unknown:
+        return jsonify({"error": f"不支持的字段: {', '.join(unknown)}"}), 400
+    etag = f'data-{data_version()}'
+    if request.query_string:
+        etag += f'-{zlib.crc32(request.query_string):08x}'
+    response = conditional_json(etag, lambda: list_ais(fields, limit, offset))
+    if limit is not None:
+        total = count_ais()
+        response.headers['X-Total-Count'] = str(total)
+        if offset + limit < total:
+            response.headers['X-Next-Offset'] = str(offset + limit)
+    return response
+
+@api_bp.route('/ai_messages/<ai_id>', methods=['GET'])
+def ai_messages(ai_id):
+    """
+    按游标分页读取一个AI的消息历史。查询参数：
+      - limit: 每页条数（默认 50）
+      - before: 取该序号之前的消息（默认从最新开始往前翻）
+      - after: 取该序号之后的消息（从旧往新翻，与 before 二选一；after=-1 从第一条开始）
+    返回 messages（每页内从旧到新，带 seq）以及 next_cursor：继续同方向翻页时作为 before/after 传入，没有更多时为 null。
+    较早的消息已归档到压缩段（见 app.archive），翻到那里时按需读取，游标不变。
+    """
+    try:
+        limit = min(page_arg('limit') or 50, MAX_PAGE_SIZE)
+        before = page_arg('before')
+        after = page_arg('after', minimum=-1)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if before is not None and after is not None:
+        return jsonify({"error": "before 与 after 只能指定一个"}), 400
+    if get_ai(ai_id, with_messages=False) is None:
+        return jsonify({"error": "AI 未找到"}), 404
+
+    def build():
+        messages, has_more = get_messages(ai_id, limit, before=before, after=after)
+        next_cursor = None
+        if has_more and messages:
+            next_cursor = messages[-1]['seq'] if after is not None else messages[0]['seq']
+        return {"ai_id": ai_id, "messages": messages, "next_cursor": next_cursor}
+
+    return conditional_json(f'msgs-{data_version()}-{zlib.crc32(request.full_path.encode()):08x}', build)
+
+def page_arg(name, minimum=0):
+    """读取整数分页参数（不小于 minimum），未传时返回 None"""
+    value = request.args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        value = None
+    if value is None or value < minimum:
+        raise ValueError(f"{name} 必须是不小于 {minimum} 的整数")
+    return value
+
+def conditional_json(etag, build):
+    """带 ETag 的 JSON 响应：客户端的 If-None-Match 与 etag 一致时直接返回 304，不调用 build()"""
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # 浏览器每次都带 If-None-Match 重新验证，未变化时使用缓存
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@api_bp.route('/add_ai', methods=['POST','GET'])
+def add_ai():
+    name = request.json.get('name')
+    apikey = request.json.get('apikey')
+    apibase = request.json.get('apibase')
+    # 唯一性校验
+    if not name or not apikey or not apibase:
+        return jsonify({"error": "名称和 API 均不能为空！"}), 400
+    if ai_exists('name', name):
+        return jsonify({"error": "AI 名称已存在！"}), 400
+    if ai_exists('apikey', apikey):
+        return jsonify({"error": "API Key 已存在！"}), 400
+    if ai_exists('apibase', apibase):
+        return jsonify({"error": "API Base 已存在！"}), 400
+    new_ai = {
+        "id": str(uuid.uuid4()),
+        "name": name,
+        "apikey": apikey,
+        "apibase": apibase,
+        "score": 0,
+        "messages": []
+    }
+    insert_ai(new_ai)
+    return jsonify(new_ai)
+
+@api_bp.route('/edit_ai/<ai_id>', methods=['PUT'])
+def edit_ai(ai_id):
+    name = request.json.get('name')
+    apikey = request.json.get('apikey')
+    apibase = request.json.get('apibase')
+    if not name or not apikey or not apibase:
+        return jsonify({"error": "名称和 API 均不能为空！"}), 400
+    ai = get_ai(ai_id)
+    if not ai:
+        return jsonify({"error": "AI 未找到"}), 404
+    # 旧配置对应的客户端失效
+    invalidate_client(ai)
+    ai["name"] = name
+    ai["apikey"] = apikey
+    ai["apibase"] = apibase
+    update_ai(ai_id, name=name, apikey=apikey, apibase=apibase)
+    return jsonify(ai)
+
+@api_bp.route('/delete_ai/<ai_id>', methods=['DELETE'])
+def delete_ai(ai_id):
+    ai = get_ai(ai_id, with_messages=False)
+    if ai:
+        invalidate_client(ai)
+        delete_ai_record(ai_id)
+    return jsonify({"message": "AI 已删除"})
+
+@api_bp.route('/get_prompt', methods=['GET'])
+def get_prompt():
+    prompt = load_prompt()
+    return jsonify({"prompt": prompt})
+
+@api_bp.route('/set_prompt', methods=['POST','GET'])
+def set_prompt():
+    text = request.json.get('text')
+    save_prompt(text)
+    return jsonify({"message": "提示词已保存"})
+
+@api_bp.route('/call_ai/<ai_id>', methods=['POST','GET'])
+def call_ai(ai_id):
+    ai = get_ai(ai_id)
+    if not ai:
+        return jsonify({"error": "AI 未找到"}), 404
+    message = request.json.get('message')
+    if not message:
+        return jsonify({"error": "消息不能为空"}), 400
+    response = call_api(ai, message, is_your_turn=True)
+    return jsonify({"response": response})
+
+@api_bp.route('/start_game', methods=['POST','GET'])
+def start_game():
+    logger.info("[阶段提示] 游戏初始化，准备分配玩家编号和清空历史消息。")
+    data = load_data()
+    if len(data) < 2:
+        return jsonify({"error": "需要至少2个AI才能开始游戏"}), 400
+    mode = (request.get_json(silent=True) or {}).get('mode') or current_app.config.get('GAME_MODE', MODE_CLASSIC)
+    if mode not in GAME_MODES:
+        return jsonify({"error": f"未知的游戏模式: {mode}"}), 400
+    # 只清空 messages，不清零 score
+    for ai in data:
+        ai["messages"] = []
+    save_data(data)
+    # 初始化 game_state 并分配玩家序号
+    state = new_game_state(data, mode=mode)
+    player_map = state['player_map']
+    logger.debug("玩家编号分配完成：%s", player_map)
+    session = save_game_state(state)
+    if request_async():
+        # 自我介绍在后台进行，立即返回任务编号；任务结果与同步调用的返回相同
+        def intro(job):
+            with session.lock:
+                job.check_cancelled()
+                job.update(stage='intro', total=len(data))
+                return _run_intro(data, state, player_map)
+        return submit_job('start_game', intro, state['game_id'])
+    set_game(state['game_id'])
+    with session.lock:
+        return _run_intro(data, state, player_map)
+
+def _run_intro(data, state, player_map):
+    """预检阶段：所有AI自我介绍，然后进入第1轮"""
+    logger.info("[阶段提示] 进入预检阶段，每个AI进行自我介绍。")
+    logger.debug("预检自我介绍，%d个AI同时发言", len(data))
+    try:
+        responses = run_intro(state, data, record_event, max_workers=_speak_max_workers())
+    except Exception as e:
+        logger.error("推进到第一轮失败: %s", e)
+        return jsonify({"error": f"初始化第一轮失败: {str(e)}"}), 500
+    # call_api 已把回复写入各AI的 messages
+    save_data(data)
+    logger.info("[阶段提示] 预检阶段结束，进入第1轮正式发言。")
+    return jsonify({"game_id": state['game_id'], "mode": state['mode'], "responses": responses, "round": 0, "player_map": player_map})
+
+@api_bp.route('/next_round', methods=['POST','GET'])
+@with_game_session
+def next_round(state=None):
+    logger.debug("开始执行next_round")
+    data = load_data()
+    
+    if not state or not state.get('activeAIs'):
+        logger.error("游戏未开始或未找到活跃AI")
+        return jsonify({"error": "请先开始游戏"}), 400
+
+    # 当前轮次
+    current_round = state['round']
+    logger.debug("当前轮次：%s", current_round)
+    
+    # 确保当前轮次状态正确
+    if not state['history']:
+        logger.error("未找到历史记录")
+        return jsonify({"error": "游戏状态异常"}), 400
+    
+    # 获取当前轮次的历史记录
+    current_round_history = next((h for h in state['history'] if h['round'] == current_round), None)
+    if not current_round_history:
+        logger.error("未找到当前轮次 %s 的历史记录", current_round)
+        return jsonify({"error": "游戏状态异常"}), 400
+
+    # 发言阶段
+    if not current_round_history.get('responses'):
+        logger.debug("第%s轮发言阶段开始", current_round)
+        discard_prefetches(state)
+        # 组装历史消息
+        speakers = [ai for ai in data if ai['id'] in state['activeAIs']]
+        transcript = get_transcript(state, current_round, speakers)
+
+        # 收集本轮所有AI的回复（并发调用，结果按 player_map 顺序排列），call_api 会把回复写入各AI的 messages
+        logger.info("[阶段提示] 第%s轮 %d 个AI同时开始发言", current_round, len(speakers))
+        responses = run_speeches(
+            state, speakers, current_round,
+            f"现在是第{current_round}轮发言，请继续发言，记住要回应其他人的话题。",
+            record_event, transcript=transcript, max_workers=_speak_max_workers()
+        )
+        save_data(data)
+        logger.info("[阶段提示] 第%s轮发言阶段结束，等待进入投票阶段", current_round)
+
+        return jsonify({
+            "responses": responses,
+            "round": current_round,
+            "player_map": state['player_map'],
+            "votes": [],
+            "eliminated": None,
+            "winner": None,
+            "is_vote_stage": False,
+            "has_next_round": True
+        })
+
+@api_bp.route('/usage_stats', methods=['GET'])
+def usage_stats():
+    """各AI累计的 token 用量与前缀缓存命中情况（多进程时合并所有进程）"""
+    return jsonify(get_usage_stats())
+
+@metrics.registry.register_collector
+def update_gauges():
+    """刷新按需计算的仪表盘（输出 /metrics 和多进程写入指标文件前调用）"""
+    stats = session_manager.stats()
+    metrics.ACTIVE_GAMES.set(stats['active_games'] - stats['finished_games'], state='running')
+    metrics.ACTIVE_GAMES.set(stats['finished_games'], state='finished')
+    metrics.POOLED_CLIENTS.set(client_pool.stats()['clients'])
+    for provider, queue in scheduler.stats().items():
+        metrics.SCHEDULER_QUEUE.set(queue['queue_depth'], provider=provider)
+    job_counts = job_manager.stats()['counts']
+    for status in ('queued', 'running'):
+        metrics.JOB_QUEUE.set(job_counts.get(status, 0), status=status)
+
+@api_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 文本格式的指标：每次 LLM 调用的耗时、首 token 延迟、排队时间、token 用量与重试（多进程时合并所有进程）"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@api_bp.route('/get_game_state', methods=['GET'])
+def get_game_state():
+    """当前状态；ETag 为 game_id 与事件序号，状态未变化时返回 304"""
+    session = session_manager.get(request.args.get('game_id'))
+    if session is None:
+        return jsonify({})
+    return conditional_json(session.etag, session.read_state)
+
+@api_bp.route('/game_events', methods=['GET'])
+def game_events():
+    """
+    订阅游戏状态的增量（Server-Sent Events）。
+    查询参数：
+      - game_id: 游戏编号（可选，默认最近开始的一局）
+      - since: 客户端已有状态的事件序号（可选；断线重连时浏览器会带上 Last-Event-ID）
+    事件：
+      - state: 完整状态（未传 since，或 since 之后的事件已不在内存中时发送一次）
+      - event: 一个游戏事件（type 为 round/speech/vote/pending_votes_cleared/elimination/winner/summary，
+        内容同事件日志），id 为事件序号
+    游戏结束后推送完本轮剩余的事件即结束；长时间没有事件时发送注释行保持连接。
+    """
+    session = session_manager.get(request_game_id())
+    if session is None:
+        return jsonify({"error": "请先开始游戏"}), 400
+    since = request.args.get('since', request.headers.get('Last-Event-ID'))
+    try:
+        since = int(since) if since not in (None, '') else None
+    except ValueError:
+        return jsonify({"error": "since 必须是整数"}), 400
+
+    def generate():
+        seq = since
+        events = session.log.events_since(seq) if seq is not None else None
+        last_sent = time.monotonic()
+        while True:
+            if events is None:
+                # 客户端缺失的事件已不在内存中，改为发送完整状态
+                state = session.read_state()
+                seq = state.get('seq', 0)
+                yield sse_event('state', state, event_id=seq)
+                events = session.log.events_since(seq)
+                continue
+            for event in events:
+                seq = event['seq']
+                yield sse_event('event', event, event_id=seq)
+                last_sent = time.monotonic()
+            if session.finished:
+                # 胜者之后还有本轮的投票事件，等写入它们的请求释放本局的锁后推送完再结束
+                with session.lock:
+                    events = session.log.events_since(seq)
+                if not events:
+                    return
+                continue
+            # 有人订阅时保持本局在内存中
+            session.touch()
+            events = session.log.wait_for_events(seq, timeout=Config.GAME_SYNC_INTERVAL)
+            if events == []:
+                # 其他工作进程写入的事件不会唤醒本进程，超时后检查磁盘
+                session_manager.refresh(session)
+                events = session.log.events_since(seq)
+            if events == [] and time.monotonic() - last_sent >= 15:
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+
+    return sse_response(generate())
+
+@api_bp.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    """各服务商的限额、排队深度（含按游戏划分）、剩余额度与平均等待时间"""
+    return jsonify(scheduler.stats())
+
+@api_bp.route('/game_sessions', methods=['GET'])
+def game_sessions():
+    """会话管理器状态：内存中的游戏数量等"""
+    return jsonify(session_manager.stats())
+
+@api_bp.route('/step_round', methods=['POST','GET'])
+@with_game_session
+def step_round(state=None):
+    """
+    分步推进接口：每次只推进一个AI的发言或投票。
+    前端需传递参数：
+      - stage: 'speak'、'vote'、'vote_all'（所有AI并发投票并一次性结算）
+        或 'turn_all'（合并模式：所有AI并发发言，每次调用同时投票，一次性结算）
+      - ai_index: 当前activeAIs中的索引（int）
+      - game_id: 游戏编号（可选，默认最近开始的一局）
+    返回：
+      - 当前AI发言/投票内容
+      - 阶段、AI名、AI编号、轮次、是否阶段结束、是否游戏结束等
+    """
+    # 分步推进只追加单条消息，无需加载全部历史
+    data = load_data(with_messages=False)
+    if not state or not state.get('activeAIs'):
+        logger.info("[分步推进] 未找到活跃AI或未开始游戏")
+        return jsonify({"error": "请先开始游戏"}), 400
+    if state.get('winner'):
+        logger.info("[分步推进] 游戏已结束，胜者: %s", state['winner'])
+        return jsonify({"error": "游戏已结束，胜者: " + state['winner'], "is_game_over": True}), 400
+    req = request.get_json(force=True)
+    stage = req.get('stage', 'speak')  # 'speak' or 'vote'
+    ai_index = parse_ai_index(req.get('ai_index', 0))
+    if ai_index is None:
+        return jsonify({"error": "ai_index 必须是非负整数"}), 400
+    activeAIs = state['activeAIs']
+    player_map = state['player_map']
+    round_num = state['round']
+    # 修正：只要进入发言阶段且还在预检，自动推进到第1轮
+    if round_num == 0 and stage == 'speak':
+        round_num = 1
+        record_event(state, 'round', round=1)
+    # 阶段推进
+    if stage == 'speak':
+        if ai_index >= len(activeAIs):
+            logger.info("[分步推进] 发言阶段结束，轮次：%s", round_num)
+            return jsonify({"error": "发言阶段已全部完成", "is_stage_end": True, "stage": "speak", "round": round_num})
+        ai_id = activeAIs[ai_index]
+        ai = next((a for a in data if a['id'] == ai_id), None)
+        ai_name = player_map[ai_id]
+        logger.info("[分步推进] 发言开始，AI：%s (ID: %s)，轮次：%s", ai_name, ai_id, round_num)
+        transcript = get_transcript(state, round_num, [ai])
+        prefetched = claim_speech(state, data, ai_index, round_num, transcript)
+        response = SpeechPrefetcher.resolve(prefetched, ai_name)
+        if response is None:
+            response = call_api(
+                ai, 
+                speak_message(round_num), 
+                is_your_turn=True, 
+                transcript=transcript, 
+                ai_name=ai_name,
+                round_num=round_num
+            )
+        logger.info("[分步推进] 发言结束，AI：%s (ID: %s)，内容：%s", ai_name, ai_id, response)
+        record_speech(state, data, ai, round_num, ai_name, response)
+        is_stage_end = (ai_index == len(activeAIs) - 1)
+        if is_stage_end:
+            logger.info("[分步推进] 发言阶段全部完成，轮次：%s", round_num)
+        return jsonify(speak_result(state, ai_index, round_num, response, is_stage_end))
+    elif stage == 'vote_all':
+        # 批量投票：所有存活AI并发投票，统一计票后一次性写入状态
+        if not state['history'] or state['history'][-1]['round'] != round_num:
+            logger.info("[批量投票] 投票阶段未找到本轮发言历史")
+            return jsonify({"error": "请先完成发言阶段"}), 400
+        ai_by_id = {a['id']: a for a in data}
+        voters = [ai_by_id[ai_id] for ai_id in activeAIs if ai_id in ai_by_id]
+        logger.info("[批量投票] 第%s轮 %d 个AI同时投票", round_num, len(voters))
+        votes = collect_votes(state, voters, round_num, max_workers=_speak_max_workers())
+        eliminated, winner = settle_votes(state, data, votes, round_num)
+        if state.get('votes_step'):
+            record_event(state, 'pending_votes_cleared')
+        discard_prefetches(state)
+        if not state.get('winner'):
+            # 本轮结束，下一次发言进入新的一轮；前端展示投票结果期间预取新一轮第一位的发言
+            record_event(state, 'round', round=round_num + 1)
+            prefetch_speaker(state, data, 0, round_num + 1, get_transcript(state, round_num + 1))
+        return jsonify({
+            "stage": "vote_all",
+            "round": round_num,
+            "votes": [
+                {
+                    **v,
+                    "voter_name": player_map.get(v['voter_id']),
+                    "target_name": player_map.get(v['target_id']) if v['target_id'] != '0' else None
+                }
+                for v in votes
+            ],
+            "is_stage_end": True,
+            "eliminated": eliminated,
+            "winner": state.get('winner'),
+            "is_game_over": state.get('winner') is not None,
+            "player_map": player_map
+        })
+    elif stage == 'turn_all':
+        return _turn_all(state, data, round_num)
+    elif stage == 'vote':
+        # 新增：从state中获取当前投票记录（修复未定义错误）
+        votes_step = state.get('votes_step', [])
+        
+        # 统计有效投票
+        valid_votes = [v for v in votes_step if v.get('target_id') != '0']
+        
+        # 处理同票情况
+        from collections import Counter
+        # 修正：使用target_id作为计数键（防止字典不可哈希问题）
+        vote_targets = [v['target_id'] for v in valid_votes]
+        vote_counts = Counter(vote_targets)
+        
+        # 获取最大票数
+        max_votes = max(vote_counts.values(), default=0)
+        
+        # 找出最高票者
+        top_candidates = [k for k,v in vote_counts.items() if v == max_votes]
+        
+        # 同票或无投票时处理
+        if len(top_candidates) > 1 or max_votes == 0:
+            # 设置空淘汰者（只体现在返回中，不写入游戏日志）
+            skipped = {
+                'round': round_num,
+                'ai_id': None,
+                'reason': '同票或无人投票' if len(top_candidates) > 1 else '全体弃权'
+            }
+            # 返回特殊状态码提示前端
+            return jsonify({
+                **state,
+                'eliminated': state['eliminated'] + [skipped],
+                'skip_elimination': True,
+                'message': '本轮投票平局，无人被淘汰'
+            })
+
+        # 正常淘汰最高票者（实际淘汰在结算时以事件写入）
+        eliminated = top_candidates[0]
+        
+        # 修正：每轮投票阶段开始时初始化votes_step
+        if ai_index == 0 or 'votes_step' not in state or not isinstance(state['votes_step'], list):
+            record_event(state, 'pending_votes_cleared')
+        if ai_index >= len(activeAIs):
+            logger.info("[分步推进] 投票阶段结束，轮次：%s", round_num)
+            eliminated, winner = settle_votes(state, data, list(state['votes_step']), round_num)
+            record_event(state, 'pending_votes_cleared')
+            discard_prefetches(state)
+            return jsonify({
+                "stage": "vote",
+                "ai_index": ai_index,
+                "ai_id": None,
+                "ai_name": None,
+                "round": round_num,
+                "vote": None,
+                "is_stage_end": True,
+                "eliminated": eliminated,
+                "winner": state.get('winner'),
+                "is_game_over": state.get('winner') is not None,
+                "player_map": player_map
+            })
+        ai_id = activeAIs[ai_index]
+        ai = next((a for a in data if a['id'] == ai_id), None)
+        ai_name = player_map[ai_id]
+        logger.info("[分步推进] 投票开始，AI：%s (ID: %s)，轮次：%s", ai_name, ai_id, round_num)
+        # 本轮responses
+        if not state['history'] or state['history'][-1]['round'] != round_num:
+            logger.info("[分步推进] 投票阶段未找到本轮发言历史")
+            return jsonify({"error": "请先完成发言阶段"}), 400
+        responses = state['history'][-1]['responses']
+        eliminated_ids = [e['ai_id'] for e in state['eliminated']]
+        vote_id = call_vote_api(
+            ai,
+            responses,
+            round_num,
+            player_map,
+            activeAIs,
+            eliminated_ids
+        )
+        vote_obj = make_vote(ai, vote_id, round_num, player_map, activeAIs)
+        logger.info("[分步推进] 投票结束，AI：%s (ID: %s)，投票对象：%s", ai_name, ai_id, vote_obj['target_id'] if vote_obj['target_id'] != '0' else '弃权')
+        record_event(state, 'vote', vote=vote_obj, pending=True)
+        is_stage_end = (ai_index == len(activeAIs) - 1)
+        eliminated = None
+        winner = None
+        # 结算逻辑已在ai_index>=len(activeAIs)时处理
+        if is_stage_end:
+            logger.info("[分步推进] 投票阶段全部完成，轮次：%s", round_num)
+        return jsonify({
+            "stage": "vote",
+            "ai_index": ai_index,
+            "ai_id": ai_id,
+            "ai_name": ai_name,
+            "round": round_num,
+            "vote": vote_obj,
+            "is_stage_end": is_stage_end,
+            "eliminated": eliminated,
+            "winner": state.get('winner'),
+            "is_game_over": state.get('winner') is not None,
+            "player_map": player_map
+        })
+    else:
+        logger.info("[分步推进] 未知阶段: %s", stage)
+        return jsonify({"error": "未知阶段"}), 400
+
+def _turn_all(state, data, round_num):
+    """合并模式的一轮：所有存活AI并发调用一次，同时得到发言和投票，写入后统一结算"""
+    if state.get('mode') != MODE_FUSED:
+        return jsonify({"error": "当前游戏不是合并模式，请分别推进发言和投票"}), 400
+    if state['history'] and state['history'][-1]['round'] == round_num and state['history'][-1]['responses']:
+        return jsonify({"error": "本轮已经发言，请推进到下一轮"}), 400
+    discard_prefetches(state)
+    player_map = state['player_map']
+    ai_by_id = {a['id']: a for a in data}
+    speakers = [ai_by_id[ai_id] for ai_id in state['activeAIs'] if ai_id in ai_by_id]
+    transcript = get_transcript(state, round_num, speakers)
+    logger.info("[合并模式] 第%s轮 %d 个AI同时发言并投票", round_num, len(speakers))
+    responses, votes = run_turns(state, speakers, round_num, record_event, transcript=transcript,
+                                 max_workers=_speak_max_workers())
+    for resp in responses:
+        append_message(resp['ai_id'], {"role": "assistant", "ai_name": resp['name'], "content": resp['response']})
+    eliminated, winner = settle_votes(state, data, votes, round_num)
+    if not state.get('winner'):
+        record_event(state, 'round', round=round_num + 1)
+    return jsonify({
+        "stage": "turn_all",
+        "round": round_num,
+        "responses": responses,
+        "votes": [
+            {
+                **v,
+                "voter_name": player_map.get(v['voter_id']),
+                "target_name": player_map.get(v['target_id']) if v['target_id'] != '0' else None
+            }
+            for v in votes
+        ],
+        "is_stage_end": True,
+        "eliminated": eliminated,
+        "winner": state.get('winner'),
+        "is_game_over": state.get('winner') is not None,
+        "player_map": player_map
+    })
+
+@api_bp.route('/play_round', methods=['POST'])
+def play_round():
+    """
+    后台进行当前一轮的全部流程：尚未发言的AI并发发言，所有存活AI并发投票，结算后进入下一轮。
+    合并模式等同于 step_round 的 turn_all。立即返回任务编号，任务结果为本轮的发言、投票与结算。
+    """
+    session = session_manager.get(request_game_id())
+    if session is None:
+        return jsonify({"error": "请先开始游戏"}), 400
+    if session.finished:
+        return jsonify({"error": "游戏已结束，胜者: " + session.state['winner'], "is_game_over": True}), 400
+
+    def run(job):
+        with session.lock:
+            return _play_round(session.state, job)
+
+    return submit_job('round', run, session.game_id)
+
+def _play_round(state, job):
+    data = load_data(with_messages=False)
+    if not state.get('activeAIs'):
+        return jsonify({"error": "请先开始游戏"}), 400
+    if state.get('winner'):
+        return jsonify({"error": "游戏已结束，胜者: " + state['winner'], "is_game_over": True}), 400
+    # 整轮推进不使用分步发言的预取
+    discard_prefetches(state)
+    round_num = state['round'] or 1
+    if not state['history'] or state['history'][-1]['round'] != round_num:
+        record_event(state, 'round', round=round_num)
+    player_map = state['player_map']
+    ai_by_id = {a['id']: a for a in data}
+    speakers = [ai_by_id[ai_id] for ai_id in state['activeAIs'] if ai_id in ai_by_id]
+    if state.get('mode') == MODE_FUSED:
+        job.update(stage='turn', round=round_num, total=len(speakers))
+        return _turn_all(state, data, round_num)
+
+    # 分步推进中途改为整轮推进时，已发言的AI不再重复发言
+    spoken = {r['ai_id'] for r in state['history'][-1]['responses']}
+    pending = [ai for ai in speakers if ai['id'] not in spoken]
+    job.update(stage='speak', round=round_num, total=len(speakers), done=len(speakers) - len(pending))
+    if pending:
+        logger.info("[整轮推进] 第%s轮 %d 个AI同时发言", round_num, len(pending))
+        transcript = get_transcript(state, round_num, pending)
+        responses = run_speeches(
+            state, pending, round_num, speak_message(round_num),
+            record_event, transcript=transcript, max_workers=_speak_max_workers()
+        )
+        for resp in responses:
+            append_message(resp['ai_id'], {"role": "assistant", "ai_name": resp['name'], "content": resp['response']})
+    job.check_cancelled()
+    job.update(stage='vote', done=len(speakers))
+    logger.info("[整轮推进] 第%s轮 %d 个AI同时投票", round_num, len(speakers))
+    responses = state['history'][-1]['responses']
+    votes = collect_votes(state, speakers, round_num, max_workers=_speak_max_workers())
+    # 结算前最后一次检查，取消后本轮停在投票前，可以重新推进
+    job.check_cancelled()
+    eliminated, winner = settle_votes(state, data, votes, round_num)
+    if state.get('votes_step'):
+        record_event(state, 'pending_votes_cleared')
+    if not state.get('winner'):
+        record_event(state, 'round', round=round_num + 1)
+    return jsonify({
+        "stage": "round",
+        "round": round_num,
+        "responses": responses,
+        "votes": [
+            {
+                **v,
+                "voter_name": player_map.get(v['voter_id']),
+                "target_name": player_map.get(v['target_id']) if v['target_id'] != '0' else None
+            }
+            for v in votes
+        ],
+        "is_stage_end": True,
+        "eliminated": eliminated,
+        "winner": state.get('winner'),
+        "is_game_over": state.get('winner') is not None,
+        "player_map": player_map
+    })
+
+@api_bp.route('/tournament', methods=['POST'])
+def tournament():
+    """
+    后台进行锦标赛（见 app.tournament），立即返回任务编号。
+    请求参数：games、players、workers、max_rounds、mode、seed、ai（只使用这些名称的AI）、apply_scores
+    任务结果为各AI的胜率、Elo 与积分变化汇总；取消后不再开始新的对局，任务结果为已完成对局的汇总（不写回积分）。
+    """
+    req = request.get_json(silent=True) or {}
+    try:
+        games = int(req.get('games', 10))
+        players = int(req.get('players', 4))
+        workers = int(req.get('workers', current_app.config.get('TOURNAMENT_WORKERS', 2)))
+        max_rounds = int(req.get('max_rounds', 20))
+        seed = req.get('seed')
+        seed = int(seed) if seed is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"error": "参数必须是整数"}), 400
+    mode = req.get('mode') or current_app.config.get('GAME_MODE', MODE_CLASSIC)
+    if mode not in GAME_MODES:
+        return jsonify({"error": f"未知的游戏模式: {mode}"}), 400
+    ais = load_data(with_messages=False)
+    if req.get('ai'):
+        ais = [ai for ai in ais if ai['name'] in req['ai']]
+    if games < 1 or workers < 1 or len(ais) < max(2, players):
+        return jsonify({"error": f"每局需要 {max(2, players)} 个AI，可用的只有 {len(ais)} 个"}), 400
+    apply_scores = bool(req.get('apply_scores'))
+
+    def run(job):
+        job.update(stage='games', done=0, total=games)
+
+        def progress(done, total, result):
+            job.update(done=done, errors=job.progress.get('errors', 0) + (1 if result.get('error') else 0))
+
+        summary, results = run_tournament(
+            ais, games, players,
+            workers=workers,
+            max_rounds=max_rounds,
+            speak_workers=_speak_max_workers(),
+            seed=seed,
+            mode=mode,
+            progress=progress,
+            cancelled=job.poll_cancel
+        )
+        result = {
+            "summary": summary,
+            "games": len(results),
+            "errors": sum(1 for r in results if r.get('error')),
+        }
+        if job.poll_cancel():
+            # 取消时（包括其他进程的请求）保留已完成对局的汇总，但不写回积分
+            raise JobCancelled(result)
+        if apply_scores:
+            for e in summary:
+                if e['score_delta']:
+                    update_score(e['id'], e['score_delta'])
+        return {**result, "scores_applied": apply_scores}
+
+    return submit_job('tournament', run)
+
+@api_bp.route('/jobs', methods=['GET'])
+def list_jobs():
+    """后台任务列表，可按 game_id 过滤"""
+    return jsonify({"jobs": job_manager.list(request.args.get('game_id')), **job_manager.stats()})
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务未找到"}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/jobs/<job_id>', methods=['DELETE'])
+@api_bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消任务：排队中的立即取消，运行中的在下一个检查点停止"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "任务未找到"}), 404
+    return jsonify(job.to_dict())
+
+@api_bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    订阅任务进度（Server-Sent Events）。
+    事件：progress（状态或进度变化，内容同 /jobs/<id>）、done（任务结束，内容同 /jobs/<id>）；
+    长时间没有变化时发送注释行保持连接。
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "任务未找到"}), 404
+
+    def generate():
+        version = None
+        while True:
+            current = job.wait_for_change(version, timeout=15)
+            if current == version and not job.finished:
+                yield ": keep-alive\n\n"
+                continue
+            version = current
+            payload = job.to_dict()
+            if payload['status'] in FINISHED_STATES:
+                yield sse_event('done', payload)
+                return
+            yield sse_event('progress', payload)
+
+    return sse_response(generate())
+
+@api_bp.route('/step_round_stream', methods=['GET'])
+def step_round_stream():
+    """
+    流式发言接口（Server-Sent Events）：推进一个AI的发言，边生成边推送。
+    查询参数：
+      - ai_index: 当前activeAIs中的索引（int）
+      - game_id: 游戏编号（可选，默认最近开始的一局）
+    事件：
+      - token: {"text": 新生成的片段}
+      - done: 与 step_round 发言阶段相同的返回内容（发言已写入 messages 与 history）
+      - error: 与 step_round 相同的错误内容
+    """
+    session = session_manager.get(request_game_id())
+    ai_index = parse_ai_index(request.args.get('ai_index', 0))
+    # 与 step_round 一样，有后台任务时直接返回错误，不排队等待本局的锁
+    busy = game_busy_response(session.game_id) if session is not None else None
+
+    def generate():
+        if session is None:
+            logger.info("[流式发言] 未找到活跃AI或未开始游戏")
+            yield sse_event('error', {"error": "请先开始游戏"})
+            return
+        if ai_index is None:
+            yield sse_event('error', {"error": "ai_index 必须是非负整数"})
+            return
+        if busy is not None:
+            yield sse_event('error', busy[0].get_json())
+            return
+        set_game(session.game_id)
+        # 整个发言过程持有本局的锁，与 step_round 一样串行推进
+        with session.lock:
+            yield from _stream_speak(session.state, ai_index)
+
+    return sse_response(stream_with_context(generate()))
+
+def _stream_speak(state, ai_index):
+    # 分步推进只追加单条消息，无需加载全部历史
+    data = load_data(with_messages=False)
+    if not state.get('activeAIs'):
+        yield sse_event('error', {"error": "请先开始游戏"})
+        return
+    if state.get('winner'):
+        yield sse_event('error', {"error": "游戏已结束，胜者: " + state['winner'], "is_game_over": True})
+        return
+    activeAIs = state['activeAIs']
+    round_num = state['round']
+    if round_num == 0:
+        round_num = 1
+        record_event(state, 'round', round=1)
+    if ai_index >= len(activeAIs):
+        yield sse_event('error', {"error": "发言阶段已全部完成", "is_stage_end": True, "stage": "speak", "round": round_num})
+        return
+    ai_id = activeAIs[ai_index]
+    ai = next((a for a in data if a['id'] == ai_id), None)
+    transcript = get_transcript(state, round_num, [ai])
+    ai_name = state['player_map'][ai_id]
+    logger.info("[流式发言] 发言开始，AI：%s (ID: %s)，轮次：%s", ai_name, ai_id, round_num)
+
+    prefetched = claim_speech(state, data, ai_index, round_num, transcript)
+    response = SpeechPrefetcher.resolve(prefetched, ai_name)
+    if response is not None:
+        # 预取的发言已经生成完毕，一次推送
+        yield sse_event('token', {"text": response})
+    else:
+        parts = []
+        for delta in call_api_stream(ai, speak_message(round_num), transcript=transcript, ai_name=ai_name, round_num=round_num):
+            parts.append(delta)
+            yield sse_event('token', {"text": delta})
+        response = "".join(parts)
+    record_speech(state, data, ai, round_num, ai_name, response)
+    is_stage_end = (ai_index == len(activeAIs) - 1)
+    logger.info("[流式发言] 发言结束，AI：%s (ID: %s)", ai_name, ai_id)
+    yield sse_event('done', speak_result(state, ai_index, round_num, response, is_stage_end))
+
+def sse_event(event, payload, event_id=None):
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    """events 可以是 (event, payload) 列表，也可以是已格式化的事件生成器"""
+    if isinstance(events, list):
+        events = [sse_event(event, payload) for event, payload in events]
+    return Response(events, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+def get_transcript(state, round_num, speakers=()):
+    """取本局的对话记录，并把 round_num 之前新完成的轮次追加进去（历史压缩见 engine.sync_transcript）"""
+    session = session_manager.get(state['game_id'])
+    budget = None
+    if current_app.config.get('HISTORY_COMPACTION'):
+        budget = current_app.config.get('HISTORY_TOKEN_BUDGET', 6000)
+    session.transcript = sync_transcript(
+        state, session.transcript, round_num, speakers, record_event,
+        budget=budget,
+        keep_rounds=current_app.config.get('HISTORY_KEEP_ROUNDS', 2),
+        max_workers=_speak_max_workers()
+    )
+    return session.transcript
+
+def prefetch_speaker(state, data, ai_index, round_num, transcript):
+    """在后台预取 activeAIs[ai_index] 在第 round_num 轮的发言（见 app.prefetch）"""
+    if not current_app.config.get('PREFETCH_SPEAKERS', True) or state.get('winner'):
+        return
+    activeAIs = state['activeAIs']
+    if ai_index >= len(activeAIs):
+        return
+    ai_id = activeAIs[ai_index]
+    ai = next((a for a in data if a['id'] == ai_id), None)
+    if ai is None:
+        return
+    session = session_manager.get(state['game_id'])
+    messages = build_speak_messages(ai, speak_message(round_num), transcript)
+    session.prefetcher.submit(ai, messages, state['player_map'][ai_id], round_num)
+
+def discard_prefetches(state):
+    """不经分步发言推进本轮（整轮、合并、批量投票）时调用：未取用的预取不会再用到，尽早取消，不再占用限额"""
+    session = session_manager.get(state['game_id'])
+    if session is not None:
+        session.prefetcher.discard()
+
+def claim_speech(state, data, ai_index, round_num, transcript):
+    """取走第 ai_index 位发言者的预取（请求内容不一致时为 None），并开始预取下一位
+
+    下一位的请求不依赖本位的发言，先提交再等待本位的结果，两次调用可以重叠进行。
+    """
+    if not current_app.config.get('PREFETCH_SPEAKERS', True):
+        return None
+    ai_id = state['activeAIs'][ai_index]
+    ai = next(a for a in data if a['id'] == ai_id)
+    session = session_manager.get(state['game_id'])
+    messages = build_speak_messages(ai, speak_message(round_num), transcript)
+    prefetched = session.prefetcher.claim(ai, messages, round_num)
+    prefetch_speaker(state, data, ai_index + 1, round_num, transcript)
+    return prefetched
+
+def record_speech(state, data, ai, round_num, ai_name, response):
+    """查重写入 ai['messages'] 与本轮 history 并保存"""
+    ai_id = ai['id']
+    message = {
+        "role": "assistant",
+        "ai_name": ai_name,
+        "content": response
+    }
+    if not ai['messages'] or ai['messages'][-1]['content'] != response:
+        ai['messages'].append(message)
+    append_message(ai_id, message)
+    if not state['history'] or state['history'][-1]['round'] != round_num:
+        record_event(state, 'round', round=round_num)
+    if not any(r['ai_id'] == ai_id for r in state['history'][-1]['responses']):
+        record_event(state, 'speech', round=round_num, ai_id=ai_id, name=ai_name, response=response)
+
+def speak_result(state, ai_index, round_num, response, is_stage_end):
+    ai_id = state['activeAIs'][ai_index]
+    return {
+        "stage": "speak",
+        "ai_index": ai_index,
+        "ai_id": ai_id,
+        "ai_name": state['player_map'][ai_id],
+        "round": round_num,
+        "response": response,
+        "is_stage_end": is_stage_end,
+        "is_game_over": False
+    }
+
+def settle_votes(state, data, votes, round_num):
+    """统计一轮投票并把积分变化写回 data 与数据库，返回 (eliminated, winner)"""
+    eliminated, winner, score_deltas = engine.settle_votes(state, votes, round_num, record_event)
+    for ai_item in data:
+        delta = score_deltas.get(ai_item['id'])
+        if delta:
+            ai_item['score'] += delta
+            update_score(ai_item['id'], delta)
+    return eliminated, winner
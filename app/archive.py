@@ -0,0 +1,71 @@
+"""AI 消息的冷归档
+
+热表（SQLite messages）只保留每个AI最近的若干条消息，更早的消息成批写入归档段：
+每个AI一个目录，段文件只追加，每批消息（JSON Lines）压缩成一个独立的 gzip 成员追加到当前段的末尾，
+段超过 segment_bytes 后换新段。每批的 (段号, 偏移, 长度, 序号范围) 记在 SQLite 的 message_archive 表中，
+按需读取时只需定位并解压覆盖目标序号的那几批。
+
+写入顺序为先追加段文件、再提交索引：中途崩溃只会在段末留下没有索引的字节，不影响已有数据。
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+_SEGMENT_NAME = re.compile(r'^segment-(\d+)\.jsonl\.gz$')
+_SAFE_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class MessageArchive:
+    def __init__(self, base_dir, segment_bytes=4 * 1024 * 1024, compresslevel=6):
+        self.base_dir = base_dir
+        self.segment_bytes = segment_bytes
+        self.compresslevel = compresslevel
+
+    def _ai_dir(self, ai_id):
+        # AI id 会拼进路径；从旧数据迁移来的 id 不一定是 uuid，不安全的改用哈希作为目录名
+        name = ai_id if _SAFE_ID.match(ai_id) else hashlib.sha1(ai_id.encode('utf-8')).hexdigest()
+        return os.path.join(self.base_dir, name)
+
+    def segment_path(self, ai_id, segment):
+        return os.path.join(self._ai_dir(ai_id), f"segment-{segment:06d}.jsonl.gz")
+
+    def _current_segment(self, ai_id):
+        ai_dir = self._ai_dir(ai_id)
+        segments = [
+            int(match.group(1)) for match in map(_SEGMENT_NAME.match, os.listdir(ai_dir)) if match
+        ] if os.path.isdir(ai_dir) else []
+        if not segments:
+            return 0
+        segment = max(segments)
+        if os.path.getsize(self.segment_path(ai_id, segment)) >= self.segment_bytes:
+            segment += 1
+        return segment
+
+    def append(self, ai_id, messages):
+        """把一批消息（带 seq）压缩后追加到当前段，返回 (段号, 偏移, 长度)"""
+        os.makedirs(self._ai_dir(ai_id), exist_ok=True)
+        payload = "".join(
+            json.dumps(message, ensure_ascii=False, separators=(',', ':')) + "\n" for message in messages
+        ).encode('utf-8')
+        member = gzip.compress(payload, compresslevel=self.compresslevel)
+        segment = self._current_segment(ai_id)
+        with open(self.segment_path(ai_id, segment), 'ab') as f:
+            offset = f.seek(0, os.SEEK_END)
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+        return segment, offset, len(member)
+
+    def read(self, ai_id, segment, offset, length):
+        """读取并解压一批消息"""
+        with open(self.segment_path(ai_id, segment), 'rb') as f:
+            f.seek(offset)
+            member = f.read(length)
+        return [json.loads(line) for line in gzip.decompress(member).decode('utf-8').splitlines() if line]
+
+    def drop(self, ai_id):
+        """删除AI的全部归档（删除AI时调用）"""
+        shutil.rmtree(self._ai_dir(ai_id), ignore_errors=True)
@@ -0,0 +1,103 @@
+"""OpenAI 客户端池
+
+按 (apibase, apikey) 缓存客户端，同一服务商主机的客户端共享一个 keep-alive 的 HTTP 连接池，
+避免每轮发言都重新进行 TLS 握手。条目按 LRU 和空闲 TTL 淘汰，AI 配置变更时可显式失效。
+并发调用方（发言、投票）在线程池中共用这些同步客户端，httpx 的连接池本身是线程安全的。
+"""
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from openai import OpenAI, DefaultHttpxClient
+
+DEFAULT_HOST = 'api.openai.com'
+
+
+def host_of(apibase):
+    if not apibase:
+        return DEFAULT_HOST
+    return urlparse(apibase).netloc or apibase
+
+
+class ClientPool:
+    def __init__(self, max_size=64, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        # (apibase, apikey) -> [client, last_used]
+        self._clients = OrderedDict()
+        # host -> 共享的 HTTP 连接池
+        self._http_clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, apibase, apikey):
+        key = (apibase, apikey)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                entry[1] = now
+                self._clients.move_to_end(key)
+                return entry[0]
+            client = self._create(apibase, apikey)
+            self._clients[key] = [client, now]
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+            return client
+
+    def _create(self, apibase, apikey):
+        host = host_of(apibase)
+        http_client = self._http_clients.get(host)
+        if http_client is None:
+            http_client = self._http_clients[host] = DefaultHttpxClient()
+        # 重试由 app.resilience 统一处理，关闭 SDK 自带的重试以免叠加
+        kwargs = {"api_key": apikey, "http_client": http_client, "max_retries": 0}
+        if apibase:
+            kwargs["base_url"] = apibase
+        return OpenAI(**kwargs)
+
+    def _evict_expired(self, now):
+        if not self.ttl:
+            return
+        expired = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.ttl]
+        for key in expired:
+            del self._clients[key]
+
+    def invalidate(self, apibase, apikey):
+        """使某个 (apibase, apikey) 对应的客户端失效"""
+        with self._lock:
+            self._clients.pop((apibase, apikey), None)
+
+    def warm(self, keys):
+        """预先创建 (apibase, apikey) 对应的客户端（含各服务商共享的连接池），返回新建的个数"""
+        created = 0
+        for apibase, apikey in keys:
+            with self._lock:
+                if (apibase, apikey) in self._clients:
+                    continue
+            self.get(apibase, apikey)
+            created += 1
+        return created
+
+    def reset_after_fork(self):
+        """fork 出的子进程中调用：丢弃继承来的客户端，但不关闭连接池（连接仍属于父进程）"""
+        self._clients = OrderedDict()
+        self._http_clients = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """清空所有客户端并关闭共享的连接池"""
+        with self._lock:
+            self._clients.clear()
+            http_clients = list(self._http_clients.values())
+            self._http_clients.clear()
+        for http_client in http_clients:
+            http_client.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "hosts": sorted(self._http_clients),
+            }
@@ -1,40 +1,111 @@
-import os
-from datetime import timedelta
-
-class Config:
-    # 基础配置
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change-in-production'
-    
-    # 安全配置
-    SESSION_COOKIE_SECURE = True
-    PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
-    
-    # 应用配置
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 限制上传文件大小为16MB
-    JSON_AS_ASCII = False  # 支持中文JSON响应
-    
-    # AI对话配置
-    MAX_ROUNDS = 5  # 最大对话轮数
-    MIN_AI_COUNT = 2  # 最小AI数量
-    MAX_AI_COUNT = 10  # 最大AI数量
-    
-    # 开发环境配置
-    DEBUG = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
-    
-    @staticmethod
-    def init_app(app):
-        pass
-
-class DevelopmentConfig(Config):
-    DEBUG = True
-    
-class ProductionConfig(Config):
-    DEBUG = False
-    SESSION_COOKIE_SECURE = True
-    PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
-
-config = {
-    'development': DevelopmentConfig,
-    'production': ProductionConfig,
-    'default': DevelopmentConfig
+import os
+from datetime import timedelta
+
+class Config:
+    # 基础配置
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change-in-production'
+    
+    # 安全配置
+    SESSION_COOKIE_SECURE = True
+    PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
+    
+    # 应用配置
+    DATA_DIR = os.environ.get('DATA_DIR') or os.path.join(os.path.dirname(__file__), '..')  # AI 注册表与游戏记录的存放目录
+    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 限制上传文件大小为16MB
+    JSON_AS_ASCII = False  # 支持中文JSON响应
+    
+    # AI对话配置
+    MAX_ROUNDS = 5  # 最大对话轮数
+    MIN_AI_COUNT = 2  # 最小AI数量
+    MAX_AI_COUNT = 10  # 最大AI数量
+
+    # 并发配置
+    CONCURRENT_SPEAK = os.environ.get('CONCURRENT_SPEAK', 'True').lower() == 'true'  # 发言阶段并发调用所有AI
+    SPEAK_CONCURRENCY = int(os.environ.get('SPEAK_CONCURRENCY', 4))  # 同时进行的LLM调用上限
+    PREFETCH_SPEAKERS = os.environ.get('PREFETCH_SPEAKERS', 'True').lower() == 'true'  # 分步发言时提前生成下一位AI的发言
+    PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))  # 预取线程数（所有游戏共用）
+
+    # 后台任务配置
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))  # 同时执行的后台任务数（开局、整轮、锦标赛）
+    JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', 32))  # 最多排队的后台任务数，超过时拒绝提交
+    JOB_TTL = int(os.environ.get('JOB_TTL', 3600))  # 已结束的任务保留多久供查询结果（秒）
+    TOURNAMENT_WORKERS = int(os.environ.get('TOURNAMENT_WORKERS', 2))  # 通过接口发起的锦标赛默认使用的进程数
+
+    # 多进程部署配置
+    WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))  # 工作进程数（与 gunicorn 读取同一个环境变量），出站限额按进程平分
+    GAME_SYNC_INTERVAL = float(os.environ.get('GAME_SYNC_INTERVAL', 1))  # 订阅方检查其他进程写入的间隔（秒）
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))  # 多进程时各进程把指标写入 DATA_DIR/metrics 的间隔（秒），供 /metrics 合并
+
+    # LLM请求录制与回放配置
+    LLM_RECORD_FILE = os.environ.get('LLM_RECORD_FILE') or None  # 把每次LLM请求的哈希与回复追加到该文件（JSON Lines）
+    LLM_REPLAY_FILE = os.environ.get('LLM_REPLAY_FILE') or None  # 不访问网络，从该录制文件回放回复（同时设置时优先于录制）
+    LLM_REPLAY_LATENCY = float(os.environ.get('LLM_REPLAY_LATENCY', 0))  # 回放时按原耗时的多少倍等待，0 为不等待，1 为原耗时
+
+    # LLM客户端池配置
+    CLIENT_POOL_SIZE = int(os.environ.get('CLIENT_POOL_SIZE', 64))  # 最多缓存的客户端数量（LRU淘汰）
+    CLIENT_POOL_TTL = int(os.environ.get('CLIENT_POOL_TTL', 1800))  # 客户端空闲多少秒后淘汰
+    API_BASE_OVERRIDE = os.environ.get('API_BASE_OVERRIDE') or None  # 设置后所有AI都请求该地址（如本地模拟后端 app.mock_backend）
+
+    # 出站请求限流配置（按服务商主机，0 表示不限）
+    RATE_LIMITS = os.environ.get('RATE_LIMITS', '')  # JSON，如 {"api.deepseek.com": {"rpm": 60, "tpm": 100000}}
+    DEFAULT_RPM = int(os.environ.get('DEFAULT_RPM', 0))  # 未单独配置的服务商的每分钟请求数上限
+    DEFAULT_TPM = int(os.environ.get('DEFAULT_TPM', 0))  # 未单独配置的服务商的每分钟 token 数上限
+    RATE_LIMIT_BURST_SECONDS = float(os.environ.get('RATE_LIMIT_BURST_SECONDS', 10))  # 令牌桶最多积攒多少秒的额度
+
+    # LLM调用容错配置
+    LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))  # 单次请求超时（秒）
+    LLM_MAX_ATTEMPTS = int(os.environ.get('LLM_MAX_ATTEMPTS', 3))  # 每次调用最多尝试次数（含首次）
+    LLM_BACKOFF_BASE = float(os.environ.get('LLM_BACKOFF_BASE', 0.5))  # 指数退避的基准等待（秒）
+    LLM_BACKOFF_MAX = float(os.environ.get('LLM_BACKOFF_MAX', 20))  # 单次退避等待上限（秒），Retry-After 不受此限
+    LLM_RETRY_DEADLINE = float(os.environ.get('LLM_RETRY_DEADLINE', 120))  # 一次调用含重试的总时限（秒）
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))  # 连续失败多少次后熔断，0 关闭熔断
+    BREAKER_RESET_TIMEOUT = float(os.environ.get('BREAKER_RESET_TIMEOUT', 30))  # 熔断后多久放行探测请求（秒）
+
+    # 游戏状态持久化配置
+    GAME_SNAPSHOT_EVERY = int(os.environ.get('GAME_SNAPSHOT_EVERY', 50))  # 每追加多少个游戏事件写一次完整快照
+    GAME_PERSIST_INTERVAL = float(os.environ.get('GAME_PERSIST_INTERVAL', 5))  # 后台写快照的间隔（秒）
+    GAME_FINISHED_TTL = int(os.environ.get('GAME_FINISHED_TTL', 300))  # 已结束的游戏空闲多久后移出内存（秒）
+    GAME_IDLE_TTL = int(os.environ.get('GAME_IDLE_TTL', 3600))  # 未结束的游戏空闲多久后移出内存（秒）
+    GAME_EVENT_BUFFER = int(os.environ.get('GAME_EVENT_BUFFER', 500))  # 每局在内存中保留的最近事件数，供订阅方补发增量
+
+    # AI消息归档配置
+    MESSAGE_HOT_LIMIT = int(os.environ.get('MESSAGE_HOT_LIMIT', 200))  # 每个AI在热表中保留的最近消息数，更早的归档到压缩段；0 表示不归档
+    MESSAGE_ARCHIVE_BATCH = int(os.environ.get('MESSAGE_ARCHIVE_BATCH', 100))  # 热表超出上限这么多条时才归档一批，减少小块写入
+    MESSAGE_SEGMENT_BYTES = int(os.environ.get('MESSAGE_SEGMENT_BYTES', 4 * 1024 * 1024))  # 单个归档段文件的大小上限（字节），超过后换新段
+
+    # 游戏模式配置
+    GAME_MODE = os.environ.get('GAME_MODE', 'classic').lower()  # classic：发言、投票分开调用；fused：每个AI每轮一次调用同时发言和投票
+
+    # 投票配置
+    VOTE_MODE = os.environ.get('VOTE_MODE', 'structured').lower()  # structured：按 JSON Schema 只返回玩家编号；text：旧的文本协议
+    VOTE_MAX_TOKENS = int(os.environ.get('VOTE_MAX_TOKENS', 20))  # 结构化投票的 max_tokens
+
+    # 对话历史压缩配置
+    HISTORY_COMPACTION = os.environ.get('HISTORY_COMPACTION', 'False').lower() == 'true'  # 超出预算时用摘要代替较早轮次
+    HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 6000))  # 对话历史的 token 预算
+    HISTORY_KEEP_ROUNDS = int(os.environ.get('HISTORY_KEEP_ROUNDS', 2))  # 始终保留原文的最近轮数
+    
+    # 日志配置
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()  # DEBUG/INFO/WARNING/ERROR，设为 OFF 关闭日志
+    LOG_FILE = os.environ.get('LOG_FILE', 'cyber_cricket.log')  # 日志文件，设为空时只输出到终端
+    
+    # 开发环境配置
+    DEBUG = os.environ.get('FLASK_DEBUG', 'True').lower() == 'true'
+    
+    @staticmethod
+    def init_app(app):
+        pass
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    
+class ProductionConfig(Config):
+    DEBUG = False
+    SESSION_COOKIE_SECURE = True
+    PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
+
+config = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'default': DevelopmentConfig
 }
\ No newline at end of file
@@ -0,0 +1,267 @@
+"""游戏流程引擎
+
+不依赖 Flask 的游戏逻辑：初始化对局、自我介绍、发言、投票、计票结算。
+Web 接口（app.api）与无界面的锦标赛（app.tournament）共用这里的规则。
+
+所有状态变化都通过 record(state, event_type, **payload) 写入：
+Web 端传入会话的事件日志，离线对局传入 record_in_memory（只应用事件、不落盘）。
+"""
+import logging
+import uuid
+
+from app import recording
+from app.game_log import apply_event
+from app.models import load_prompt
+from app.scheduler import set_game
+from app.services import call_api_batch, call_turn_api, call_vote_api, run_concurrently, summarize_round
+from app.transcript import Transcript
+from app.votes import find_player
+
+logger = logging.getLogger(__name__)
+
+# 游戏模式：classic 每轮先发言再单独投票；fused 每个AI一次调用同时给出发言和对之前各轮发言的投票
+MODE_CLASSIC = 'classic'
+MODE_FUSED = 'fused'
+GAME_MODES = (MODE_CLASSIC, MODE_FUSED)
+
+INTRO_MESSAGE = "现在是预检阶段（第0轮），请介绍你的名字和身世，只介绍自己，不评价他人。"
+
+
+def speak_message(round_num):
+    return f"第{round_num}轮发言，请继续本轮发言。"
+
+
+def turn_message(round_num):
+    return f"第{round_num}轮发言，请继续本轮发言，并在发言的同时完成投票。"
+
+
+def record_in_memory(state, event_type, **payload):
+    """只在内存中应用事件，用于不需要持久化的离线对局"""
+    event = {"type": event_type, "seq": state.get('seq', 0) + 1, **payload}
+    apply_event(state, event)
+    return event
+
+
+def new_game_state(ais, game_id=None, mode=MODE_CLASSIC):
+    """按 ais 的顺序分配玩家编号，返回第0轮的初始状态"""
+    player_map = {ai['id']: f"玩家{idx+1}" for idx, ai in enumerate(ais)}
+    return {
+        "game_id": game_id or str(uuid.uuid4()),
+        "mode": mode,
+        "round": 0,  # 预检阶段为第0轮
+        "activeAIs": [ai['id'] for ai in ais],
+        "player_map": player_map,  # id->玩家序号
+        "history": [],  # 每轮发言
+        "votes": [],    # 每轮投票
+        "eliminated": [],
+        "last_vote": {},
+        "summaries": {},
+        "winner": None,
+        # 开局时的游戏提示词，整局使用同一版本，请求前缀逐字节不变
+        "prompt": load_prompt()
+    }
+
+
+def run_speeches(state, speakers, round_num, message, record, transcript=None, max_workers=4):
+    """让 speakers 并发发言并把发言写入第 round_num 轮，返回按 speakers 顺序排列的发言记录"""
+    player_map = state['player_map']
+    jobs = [
+        {
+            "ai": ai, "message": message, "transcript": transcript, "ai_name": player_map[ai['id']],
+            "phase": 'intro' if round_num == 0 else 'speak', "round": round_num
+        }
+        for ai in speakers
+    ]
+    results = call_api_batch(jobs, max_workers=max_workers)
+    responses = [
+        {"ai_id": ai['id'], "name": player_map[ai['id']], "response": response}
+        for ai, response in zip(speakers, results)
+    ]
+    for resp in responses:
+        record(state, 'speech', round=round_num, ai_id=resp['ai_id'], name=resp['name'], response=resp['response'])
+    return responses
+
+
+def run_intro(state, ais, record, max_workers=4):
+    """预检阶段：所有AI自我介绍（第0轮），然后进入第1轮"""
+    transcript = Transcript(prompt=state.get('prompt'))
+    responses = run_speeches(state, ais, 0, INTRO_MESSAGE, record, transcript, max_workers)
+    record(state, 'round', round=1)
+    return responses
+
+
+def sync_transcript(state, transcript, round_num, speakers, record, budget=None, keep_rounds=2, max_workers=4):
+    """把 round_num 之前新完成的轮次并入对话记录，返回可用的 Transcript
+
+    transcript 为 None 或状态回退时重建。设置 budget 时开启历史压缩：若对任一发言AI的模型超出预算，
+    为缺少摘要的较早轮次各生成一次摘要，摘要以事件写入游戏状态，之后直接复用。
+    """
+    if transcript is None or transcript.synced_round >= round_num:
+        transcript = Transcript(prompt=state.get('prompt'))
+    transcript.sync(state['history'], round_num)
+    transcript.budget = budget
+    transcript.keep_rounds = keep_rounds
+    if budget is not None:
+        ensure_summaries(state, transcript, speakers, record, max_workers)
+    return transcript
+
+
+def ensure_summaries(state, transcript, speakers, record, max_workers=4):
+    summaries = state.setdefault('summaries', {})
+    transcript.summaries = summaries
+    if not speakers or not any(transcript.needs_compaction(ai['name']) for ai in speakers):
+        return
+    missing = [r for r in transcript.rounds_to_summarize() if str(r) not in summaries]
+    if not missing:
+        return
+    summarizer = speakers[0]
+    logger.info("[历史压缩] 对话历史超出预算，为第%s轮生成摘要", missing)
+    tasks = [
+        (lambda r=r: summarize_round(summarizer, r, transcript.round_text(r)))
+        for r in missing
+    ]
+    for round_num, summary in zip(missing, run_concurrently(tasks, max_workers)):
+        if isinstance(summary, str) and summary:
+            record(state, 'summary', round=round_num, text=summary)
+
+
+def collect_votes(state, voters, round_num, max_workers=4):
+    """所有 voters 并发投票，返回投票记录列表（出错按弃权处理）；调用方负责结算"""
+    player_map = state['player_map']
+    activeAIs = state['activeAIs']
+    responses = state['history'][-1]['responses']
+    eliminated_ids = [e['ai_id'] for e in state['eliminated']]
+    tasks = [
+        (lambda ai=ai: call_vote_api(ai, responses, round_num, player_map, activeAIs, eliminated_ids))
+        for ai in voters
+    ]
+    votes = []
+    for ai, vote_id in zip(voters, run_concurrently(tasks, max_workers)):
+        if isinstance(vote_id, Exception):
+            logger.info("[批量投票] AI %s 投票出错，按弃权处理: %s", player_map[ai['id']], vote_id)
+            vote_id = '0'
+        votes.append(make_vote(ai, vote_id, round_num, player_map, activeAIs))
+    return votes
+
+
+def run_turns(state, speakers, round_num, record, transcript=None, max_workers=4):
+    """合并模式的一轮：speakers 并发发言，每次调用同时给出对之前各轮发言的投票
+
+    发言写入第 round_num 轮，返回 (按 speakers 顺序的发言记录, 投票记录)；调用方负责结算投票。
+    """
+    player_map = state['player_map']
+    activeAIs = state['activeAIs']
+    eliminated_ids = [e['ai_id'] for e in state['eliminated']]
+    message = turn_message(round_num)
+    tasks = [
+        (lambda ai=ai: call_turn_api(ai, message, transcript, round_num, player_map, activeAIs, eliminated_ids))
+        for ai in speakers
+    ]
+    responses, votes = [], []
+    for ai, result in zip(speakers, run_concurrently(tasks, max_workers)):
+        if isinstance(result, Exception):
+            logger.info("[合并模式] AI %s 调用出错，按弃权处理: %s", player_map[ai['id']], result)
+            result = (f"[系统] AI {player_map[ai['id']]} 暂时无法回应，请稍后再试。", '0')
+        speech, vote_id = result
+        responses.append({"ai_id": ai['id'], "name": player_map[ai['id']], "response": speech})
+        votes.append(make_vote(ai, vote_id, round_num, player_map, activeAIs))
+    for resp in responses:
+        record(state, 'speech', round=round_num, ai_id=resp['ai_id'], name=resp['name'], response=resp['response'])
+    return responses, votes
+
+
+def make_vote(ai, vote_id, round_num, player_map, activeAIs):
+    """把 call_vote_api 返回的玩家编号转换为投票记录（投给自己按弃权处理）"""
+    target_id = get_ai_id_by_player_num(player_map, vote_id, activeAIs) if vote_id != '0' else '0'
+    if target_id == ai['id']:
+        target_id = '0'
+    return {
+        "round": round_num,
+        "voter_id": ai['id'],
+        "target_id": target_id
+    }
+
+
+def get_ai_id_by_player_num(player_map, num, activeAIs):
+    """按完整的玩家编号查找存活的AI，找不到返回 '0'"""
+    return find_player(player_map, num, activeAIs) or '0'
+
+
+def settle_votes(state, votes, round_num, record):
+    """统计一轮投票：淘汰最高票者、判定胜者，把投票写入 votes/last_vote
+
+    返回 (eliminated, winner, score_deltas)，score_deltas 为 AI id -> 积分变化，由调用方决定是否写回。
+    """
+    player_map = state['player_map']
+    vote_count = {}
+    for v in votes:
+        if v['target_id'] != '0':
+            vote_count[v['target_id']] = vote_count.get(v['target_id'], 0) + 1
+    eliminated = None
+    winner = None
+    score_deltas = {}
+    if len(vote_count) > 0:
+        max_votes = max(vote_count.values())
+        eliminated_ids = [k for k, v in vote_count.items() if v == max_votes]
+        # 平票时随机淘汰；经 recording 选择，回放录制的对局时结果与录制时一致
+        eliminated = recording.choice(
+            ('elimination', round_num, sorted(player_map.get(i, i) for i in eliminated_ids)),
+            eliminated_ids, labels=[player_map.get(i, i) for i in eliminated_ids]
+        )
+        if eliminated in state['activeAIs']:
+            record(state, 'elimination', round=round_num, ai_id=eliminated)
+            logger.info("[淘汰信息] 本轮淘汰：%s (AI真实ID: %s)", player_map.get(eliminated, eliminated), eliminated)
+    else:
+        logger.debug("本轮无人被淘汰。")
+    # 判断胜者或只剩2人提前结束
+    if len(state['activeAIs']) == 2:
+        for ai_id in state['activeAIs']:
+            score_deltas[ai_id] = score_deltas.get(ai_id, 0) + 1
+        for e in state.get('eliminated', []):
+            score_deltas[e['ai_id']] = score_deltas.get(e['ai_id'], 0) - 1
+        winner = '|'.join(state['activeAIs'])
+        record(state, 'winner', winner=winner)
+    elif len(state['activeAIs']) == 1:
+        winner = state['activeAIs'][0]
+        record(state, 'winner', winner=winner)
+        score_deltas[winner] = score_deltas.get(winner, 0) + 1
+    logger.info("[胜负信息] 游戏结束，胜者：%s (AI真实ID: %s)", player_map.get(winner, winner) if winner else '', winner or '')
+    for v in votes:
+        record(state, 'vote', vote=v)
+    return eliminated, winner, score_deltas
+
+
+def winners_of(state):
+    """胜者 id 列表（只剩两人时两人并列获胜）"""
+    return state['winner'].split('|') if state.get('winner') else []
+
+
+def play_game(ais, record=record_in_memory, max_rounds=20, max_workers=4, budget=None, keep_rounds=2, game_id=None,
+              mode=MODE_CLASSIC):
+    """无界面地完整进行一局：自我介绍，然后逐轮发言、投票直到产生胜者或达到 max_rounds
+
+    与 Web 端分步推进使用相同的提示词和结算规则。返回 (state, score_deltas)；
+    达到轮数上限仍未分出胜负时 state['winner'] 为 None。
+    """
+    ais = [{**ai, "messages": []} for ai in ais]
+    ai_by_id = {ai['id']: ai for ai in ais}
+    state = new_game_state(ais, game_id, mode)
+    set_game(state['game_id'])
+    run_intro(state, ais, record, max_workers)
+    transcript = None
+    score_deltas = {}
+    while not state.get('winner') and state['round'] <= max_rounds:
+        round_num = state['round']
+        speakers = [ai_by_id[ai_id] for ai_id in state['activeAIs']]
+        transcript = sync_transcript(state, transcript, round_num, speakers, record, budget, keep_rounds, max_workers)
+        if mode == MODE_FUSED:
+            _, votes = run_turns(state, speakers, round_num, record, transcript, max_workers)
+        else:
+            run_speeches(state, speakers, round_num, speak_message(round_num), record, transcript, max_workers)
+            votes = collect_votes(state, speakers, round_num, max_workers)
+        _, _, deltas = settle_votes(state, votes, round_num, record)
+        for ai_id, delta in deltas.items():
+            score_deltas[ai_id] = score_deltas.get(ai_id, 0) + delta
+        if not state.get('winner'):
+            record(state, 'round', round=round_num + 1)
+    return state, score_deltas
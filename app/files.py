@@ -0,0 +1,130 @@
+"""多个工作进程共享的数据文件：跨进程文件锁与原子写入
+
+预派生的 WSGI 服务器（如 gunicorn）会启动多个工作进程读写同一个数据目录。
+修改文件前持有对应的 FileLock（fcntl.flock），整体重写的文件先写临时文件再原子替换，
+读取方不会看到写了一半的内容。没有 fcntl 的平台（Windows）上 FileLock 只在进程内互斥，只支持单进程运行。
+"""
+import os
+import threading
+import weakref
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 所有 FileLock，fork 后在子进程中重置
+_locks = weakref.WeakSet()
+
+
+class FileLock:
+    """可重入的跨进程互斥锁：进程内的线程之间用 RLock，进程之间用锁文件上的 flock
+
+    on_acquire 在最外层加锁成功后调用（如检查其他进程是否改过数据）。
+    """
+
+    def __init__(self, path, on_acquire=None):
+        self.path = path
+        self.on_acquire = on_acquire
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+        _locks.add(self)
+
+    @property
+    def held(self):
+        """本进程是否有线程持有这把锁"""
+        return self._depth > 0
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        if self._depth == 0 and fcntl is not None:
+            try:
+                fcntl.flock(self._file(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                self._lock.release()
+                return False
+            except BaseException:
+                self._lock.release()
+                raise
+        self._depth += 1
+        if self._depth == 1 and self.on_acquire is not None:
+            try:
+                self.on_acquire()
+            except BaseException:
+                self.release()
+                raise
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _file(self):
+        if self._fd is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        return self._fd
+
+    def __del__(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+
+    def _reset_after_fork(self):
+        # 子进程不持有父进程的锁；继承来的文件描述符与父进程共用同一把 flock，必须重新打开
+        self._lock = threading.RLock()
+        self._depth = 0
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _reset_locks_after_fork():
+    for lock in list(_locks):
+        lock._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
+
+
+def pid_alive(pid):
+    """本机上进程 pid 是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def atomic_write(path, data, encoding='utf-8', durable=True):
+    """先写同目录下的临时文件，再原子替换 path；data 为 str 或 bytes
+
+    durable 为 True 时替换前先刷盘，掉电后也不会留下空文件；只作提示用的小文件可以关掉。
+    """
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    try:
+        with open(tmp_file, mode, **({} if mode == 'wb' else {"encoding": encoding})) as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
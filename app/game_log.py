@@ -0,0 +1,205 @@
+"""游戏事件日志
+
+游戏过程中的每个变化（发言、投票、淘汰、胜者、进入新一轮、历史摘要）作为一行事件追加到日志文件，
+每 snapshot_every 个事件写一次完整快照并截断日志（为 None 时由调用方自行决定何时写快照）。加载时读取最新快照，再重放日志尾部。
+最近的事件同时保留在内存中，订阅方（见 /game_events）可以按 seq 取增量或等待新事件，无需读盘。
+
+多个进程可以打开同一局的日志：写入与加载都持有日志目录下的 log.lock，
+refresh() 发现文件被其他进程改过时重新加载。
+"""
+import json
+import os
+import threading
+from collections import deque
+
+from app.files import FileLock, atomic_write
+
+EVENT_TYPES = ('round', 'speech', 'vote', 'pending_votes_cleared', 'elimination', 'winner', 'summary')
+
+
+def _round_entry(state, round_num):
+    for round_obj in reversed(state['history']):
+        if round_obj['round'] == round_num:
+            return round_obj
+    round_obj = {"round": round_num, "responses": []}
+    state['history'].append(round_obj)
+    return round_obj
+
+
+def apply_event(state, event):
+    """把一个事件应用到 state 上（写入时与重放时共用）"""
+    event_type = event['type']
+    if event_type == 'round':
+        state['round'] = event['round']
+        _round_entry(state, event['round'])
+    elif event_type == 'speech':
+        round_obj = _round_entry(state, event['round'])
+        if not any(r['ai_id'] == event['ai_id'] for r in round_obj['responses']):
+            round_obj['responses'].append({
+                "ai_id": event['ai_id'],
+                "name": event['name'],
+                "response": event['response']
+            })
+    elif event_type == 'vote':
+        vote = event['vote']
+        if event.get('pending'):
+            state.setdefault('votes_step', []).append(vote)
+        else:
+            state['votes'].append(vote)
+            state['last_vote'][vote['voter_id']] = vote['target_id']
+    elif event_type == 'pending_votes_cleared':
+        state['votes_step'] = []
+    elif event_type == 'elimination':
+        if event['ai_id'] in state['activeAIs']:
+            state['activeAIs'].remove(event['ai_id'])
+        record = {"round": event['round'], "ai_id": event['ai_id']}
+        if event.get('reason'):
+            record['reason'] = event['reason']
+        state['eliminated'].append(record)
+    elif event_type == 'winner':
+        state['winner'] = event['winner']
+    elif event_type == 'summary':
+        state.setdefault('summaries', {})[str(event['round'])] = event['text']
+    else:
+        raise ValueError(f"未知的游戏事件: {event_type}")
+    state['seq'] = event['seq']
+
+
+def _file_signature(st):
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class GameLog:
+    def __init__(self, snapshot_file, log_file, snapshot_every=50, recent_events=500):
+        self.snapshot_file = snapshot_file
+        self.log_file = log_file
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        # 跨进程的写锁，只在单次写入或加载期间持有
+        self.file_lock = FileLock(os.path.join(os.path.dirname(snapshot_file), 'log.lock'))
+        # 本进程最后一次读写后快照与日志文件的状态，用来发现其他进程的写入
+        self._signature = None
+        # 最近的事件，供订阅方取增量；新事件写入时通知等待中的订阅方
+        self.recent = deque(maxlen=recent_events)
+        self.seq = 0
+        self.changed = threading.Condition(self.lock)
+
+    def load(self):
+        """读取快照并重放日志尾部，没有游戏时返回 None"""
+        with self.lock, self.file_lock:
+            return self._load()
+
+    def _load(self):
+        state = self._read_snapshot()
+        if state is None:
+            return None
+        state.setdefault('seq', 0)
+        self.recent.clear()
+        for event in self._read_events():
+            if event['seq'] > state['seq']:
+                apply_event(state, event)
+                self.recent.append(event)
+        self.seq = state['seq']
+        self._signature = self._disk_signature()
+        self.changed.notify_all()
+        return state
+
+    def refresh(self, state):
+        """其他进程写过这局时重新加载，并原地更新 state（持有 state 引用的调用方随之看到新内容）；返回是否有更新"""
+        if self._disk_signature() == self._signature:
+            return False
+        with self.lock, self.file_lock:
+            if self._disk_signature() == self._signature:
+                return False
+            loaded = self._load()
+            if loaded is None:
+                return False
+            state.clear()
+            state.update(loaded)
+            return True
+
+    def _disk_signature(self):
+        signature = []
+        for path in (self.snapshot_file, self.log_file):
+            try:
+                signature.append(_file_signature(os.stat(path)))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def reset(self, state):
+        """新游戏开始：写入初始快照并清空日志"""
+        state['seq'] = 0
+        self.snapshot(state)
+        with self.lock:
+            self.recent.clear()
+            self.seq = 0
+
+    def append(self, state, event_type, **payload):
+        """应用并追加一个事件，必要时写快照"""
+        if event_type not in EVENT_TYPES:
+            raise ValueError(f"未知的游戏事件: {event_type}")
+        with self.lock, self.file_lock:
+            event = {"type": event_type, "seq": state.get('seq', 0) + 1, **payload}
+            apply_event(state, event)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n')
+                f.flush()
+                # 只有日志变了，快照部分沿用上次的记录
+                self._signature = (self._signature[0] if self._signature else None, _file_signature(os.fstat(f.fileno())))
+            events_since_snapshot = state['seq'] - state.get('snapshot_seq', 0)
+            self.recent.append(event)
+            self.seq = event['seq']
+            self.changed.notify_all()
+        if self.snapshot_every and events_since_snapshot >= self.snapshot_every:
+            self.snapshot(state)
+        return event
+
+    def events_since(self, seq):
+        """seq 之后的事件列表；其中一部分已不在内存中时返回 None（订阅方需要重新读取完整状态）"""
+        with self.lock:
+            return self._events_since(seq)
+
+    def wait_for_events(self, seq, timeout=None):
+        """等到有 seq 之后的事件（或超时）再返回 events_since(seq)"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.seq > seq, timeout)
+            return self._events_since(seq)
+
+    def _events_since(self, seq):
+        if seq >= self.seq:
+            return []
+        if not self.recent or self.recent[0]['seq'] > seq + 1:
+            return None
+        return [event for event in self.recent if event['seq'] > seq]
+
+    def snapshot(self, state):
+        """原子地写入完整快照，然后截断已包含在快照中的日志"""
+        with self.lock, self.file_lock:
+            state['snapshot_seq'] = state.get('seq', 0)
+            atomic_write(self.snapshot_file, json.dumps(state, ensure_ascii=False, separators=(',', ':')))
+            # 快照写入后再截断日志；若在两步之间崩溃，加载时会按 seq 跳过重复事件
+            open(self.log_file, 'w', encoding='utf-8').close()
+            self._signature = self._disk_signature()
+
+    def _read_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            return None
+        with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+            try:
+                return json.load(f)
+            except Exception:
+                return None
+
+    def _read_events(self):
+        if not os.path.exists(self.log_file):
+            return []
+        events = []
+        with open(self.log_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半，丢弃即可
+                    break
+        return events
@@ -0,0 +1,353 @@
+"""后台任务：耗时的游戏操作不占用请求线程
+
+开局（自我介绍）、完整一轮和锦标赛提交为后台任务后立即返回任务编号，客户端轮询 /jobs/<id>
+或订阅 /jobs/<id>/events 获取进度和结果。任务由固定数量的工作线程执行，排队数超过上限时拒绝提交。
+
+取消是协作式的：排队中的任务直接取消；运行中的任务在下一个检查点（如发言与投票之间、每局锦标赛结束后）停止。
+同一局游戏同时只能有一个未结束的任务。
+
+任务在提交它的进程中执行，状态、进度和结果同时写入共享的任务表（app.models 的 jobs），
+多进程部署时任何工作进程都能查询、订阅和取消任务：其他进程的取消请求在下一个检查点生效，
+执行任务的进程退出后，未结束的任务记为失败。
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.files import pid_alive
+from app.models import (
+    count_jobs, delete_finished_jobs, insert_job, job_cancel_requested, load_active_job, load_job, load_jobs,
+    request_job_cancel, update_job
+)
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务在检查点发现已被取消；result 为取消前已完成的部分结果"""
+
+    def __init__(self, result=None):
+        super().__init__("任务已取消")
+        self.result = result
+
+
+class JobFailed(Exception):
+    """任务因游戏状态等预期原因失败，只记录错误信息"""
+
+
+class JobQueueFull(Exception):
+    """排队的任务数已达上限"""
+
+
+class GameBusy(Exception):
+    """该局游戏已有未结束的任务"""
+
+    def __init__(self, job):
+        super().__init__(f"本局游戏已有后台任务 {job.id} 正在进行")
+        self.job = job
+
+
+class Job:
+    """本进程执行的任务：状态在内存中，每次变化同时写入任务表"""
+
+    def __init__(self, kind, game_id=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.game_id = game_id
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        # 每次状态或进度变化时递增，订阅方据此判断是否有更新
+        self.version = 0
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def poll_cancel(self):
+        """读取其他进程的取消请求，返回是否已请求取消"""
+        if not self._cancel.is_set() and job_cancel_requested(self.id):
+            self._cancel.set()
+            self.update()
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        """检查点：已请求取消（包括其他进程的请求）时抛出 JobCancelled"""
+        if self.poll_cancel():
+            raise JobCancelled()
+
+    def update(self, **progress):
+        """更新进度（如 stage、done、total），通知订阅方"""
+        with self._cond:
+            self.progress.update(progress)
+            self._changed()
+
+    def _set_status(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in FINISHED_STATES:
+                self.finished_at = time.time()
+                self.result = result
+                self.error = error
+            self._changed()
+
+    def _changed(self):
+        self.version += 1
+        update_job(
+            self.id, status=self.status, progress=self.progress, result=self.result, error=self.error,
+            started_at=self.started_at, finished_at=self.finished_at
+        )
+        self._cond.notify_all()
+
+    def record(self):
+        """写入任务表的初始记录"""
+        return {
+            "id": self.id, "kind": self.kind, "game_id": self.game_id, "status": self.status,
+            "progress": self.progress, "pid": os.getpid(), "created_at": self.created_at,
+        }
+
+    def wait_for_change(self, version, timeout=None):
+        """等到 version 之后有新的变化（或任务结束、超时），返回当前 version"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version != version or self.finished, timeout)
+            return self.version
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "kind": self.kind,
+                "game_id": self.game_id,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "result": self.result,
+                "error": self.error,
+                "cancel_requested": self.cancel_requested,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "version": self.version,
+            }
+
+
+class StoredJob:
+    """其他工作进程执行的任务：从任务表读取，订阅时按 poll_interval 轮询"""
+
+    def __init__(self, record, poll_interval=1.0):
+        self._record = record
+        self.poll_interval = poll_interval
+
+    @property
+    def id(self):
+        return self._record['id']
+
+    @property
+    def game_id(self):
+        return self._record['game_id']
+
+    @property
+    def version(self):
+        return self._record['version']
+
+    @property
+    def finished(self):
+        return self._record['finished_at'] is not None
+
+    def refresh(self):
+        record = load_job(self.id)
+        if record is not None:
+            self._record = record
+
+    def wait_for_change(self, version, timeout=None):
+        """同 Job.wait_for_change，轮询任务表"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            self.refresh()
+            if self.version != version or self.finished:
+                return self.version
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return self.version
+            time.sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+
+    def to_dict(self):
+        record = self._record
+        return {
+            "job_id": record['id'],
+            **{key: record[key] for key in (
+                "kind", "game_id", "status", "progress", "result", "error", "cancel_requested",
+                "created_at", "started_at", "finished_at", "version"
+            )},
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=4, max_pending=32, ttl=3600, poll_interval=1.0):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        # 本进程执行的任务
+        self._jobs = {}
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='game-job')
+        return self._executor
+
+    def submit(self, kind, fn, game_id=None):
+        """提交任务 fn(job)，返回值作为任务结果；队列已满抛出 JobQueueFull，该局已有任务（任一进程）抛出 GameBusy"""
+        with self._lock:
+            self._prune()
+            pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if self.max_pending and pending >= self.max_pending:
+                raise JobQueueFull(f"排队中的后台任务已达上限（{self.max_pending}）")
+            job = Job(kind, game_id)
+            while True:
+                busy = insert_job(job.record())
+                if busy is None:
+                    break
+                if not self._orphaned(busy):
+                    raise GameBusy(self._wrap(busy))
+                self._fail_orphan(busy)
+            self._jobs[job.id] = job
+            job.future = self._get_executor().submit(self._run, job, fn)
+        logger.info("[后台任务] 已提交 %s 任务 %s（游戏 %s）", kind, job.id, game_id)
+        return job
+
+    def _run(self, job, fn):
+        if job.poll_cancel():
+            self._finish(job, CANCELLED)
+            return
+        job._set_status(RUNNING)
+        try:
+            result = fn(job)
+        except JobCancelled as e:
+            logger.info("[后台任务] %s 任务 %s 已取消", job.kind, job.id)
+            self._finish(job, CANCELLED, result=e.result)
+        except JobFailed as e:
+            logger.warning("[后台任务] %s 任务 %s 失败: %s", job.kind, job.id, e)
+            self._finish(job, FAILED, error=str(e))
+        except Exception as e:
+            logger.error("[后台任务] %s 任务 %s 失败: %s", job.kind, job.id, e, exc_info=True)
+            self._finish(job, FAILED, error=str(e))
+        else:
+            self._finish(job, SUCCEEDED, result=result)
+
+    @staticmethod
+    def _finish(job, status, result=None, error=None):
+        job._set_status(status, result=result, error=error)
+        metrics.JOBS.inc(kind=job.kind, status=status)
+
+    def _local(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _orphaned(self, record):
+        """未结束、但执行它的进程已经退出的任务（本进程的记录不在内存中，说明是重启前的进程留下的）"""
+        if record['finished_at'] is not None:
+            return False
+        if record['pid'] == os.getpid():
+            return self._local(record['id']) is None
+        return not pid_alive(record['pid'])
+
+    def _fail_orphan(self, record):
+        logger.warning("[后台任务] %s 任务 %s 的工作进程 %s 已退出，记为失败", record['kind'], record['id'], record['pid'])
+        update_job(record['id'], status=FAILED, error="执行任务的工作进程已退出", finished_at=time.time())
+        metrics.JOBS.inc(kind=record['kind'], status=FAILED)
+        return load_job(record['id'])
+
+    def _wrap(self, record):
+        """把任务表中的记录转换为任务对象：本进程的任务返回 Job，其他进程的返回 StoredJob"""
+        job = self._local(record['id'])
+        if job is not None:
+            return job
+        if self._orphaned(record):
+            record = self._fail_orphan(record)
+        return StoredJob(record, self.poll_interval)
+
+    def get(self, job_id):
+        job = self._local(job_id)
+        if job is not None:
+            if not job.finished:
+                job.poll_cancel()
+            return job
+        record = load_job(job_id)
+        return self._wrap(record) if record is not None else None
+
+    def cancel(self, job_id):
+        """请求取消任务：排队中的立即取消，运行中的在下一个检查点停止；任务不存在时返回 None
+
+        其他进程的任务只写入取消标记，由执行它的进程在检查点读取。
+        """
+        job = self._local(job_id)
+        if job is None:
+            request_job_cancel(job_id)
+            return self.get(job_id)
+        if job.finished:
+            return job
+        job._cancel.set()
+        request_job_cancel(job_id)
+        if job.future is not None and job.future.cancel():
+            self._finish(job, CANCELLED)
+        else:
+            job.update()
+        return job
+
+    def active_for(self, game_id):
+        """该局游戏未结束的任务（任一进程），没有时返回 None"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.game_id == game_id and not job.finished:
+                    return job
+        record = load_active_job(game_id)
+        if record is None:
+            return None
+        job = self._wrap(record)
+        return None if job.finished else job
+
+    def list(self, game_id=None):
+        return [self._wrap(record).to_dict() for record in load_jobs(game_id)]
+
+    def stats(self):
+        return {"workers": self.max_workers, "max_pending": self.max_pending, "counts": count_jobs()}
+
+    def reset_after_fork(self):
+        """fork 出的子进程中调用：父进程的工作线程不会带到子进程，父进程的任务由父进程更新"""
+        self._jobs = {}
+        self._lock = threading.RLock()
+        self._executor = None
+
+    def _prune(self):
+        # 已结束的任务保留 ttl 秒供客户端取结果
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and now - job.finished_at > self.ttl:
+                del self._jobs[job_id]
+        delete_finished_jobs(now - self.ttl)
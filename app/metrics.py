@@ -0,0 +1,466 @@
+"""LLM 调用的指标采集
+
+每次调用记录 AI、服务商、阶段（intro/speak/vote/summary）和轮次，以及排队等待、首 token 延迟、总耗时、
+token 用量和重试次数：汇总为计数器和直方图，由 /metrics 以 Prometheus 文本格式输出；
+每次调用的明细以一行结构化日志写入 app.metrics 日志。
+
+多进程部署（WEB_CONCURRENCY > 1）时，各进程每隔 METRICS_FLUSH_INTERVAL 秒把自己的指标写入
+DATA_DIR/metrics/<pid>.json，/metrics 与 /usage_stats 合并所有进程的数据（其他进程的数据最多延迟一个间隔）：
+计数器和直方图累加，已退出进程的计数仍然计入；仪表盘按各指标的 multiprocess_mode 合并，只取仍在运行的进程。
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+from app.config import Config
+from app.files import atomic_write, pid_alive
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _restore_key(key):
+    return tuple(tuple(pair) for pair in key)
+
+
+class Counter:
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, labels.get(name, '')) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _changed()
+
+    def snapshot(self):
+        """本进程的数据，可以序列化为 JSON"""
+        with self._lock:
+            return [[key, value] for key, value in self._values.items()]
+
+    def merge(self, values, other, alive):
+        """把另一个进程的 snapshot 合并进 values"""
+        for key, value in other:
+            key = _restore_key(key)
+            values[key] = values.get(key, 0) + value
+
+    def collect(self, processes=None):
+        """本进程与其他进程（processes 为 read_processes() 的结果）合并后的 {labels: value}"""
+        with self._lock:
+            values = dict(self._values)
+        for alive, snapshot in (read_processes() if processes is None else processes):
+            if self.name in snapshot:
+                self.merge(values, snapshot[self.name], alive)
+        return values
+
+    def items(self):
+        """[(labels dict, value)]，多进程部署时为所有进程合并后的值"""
+        return [(dict(key), value) for key, value in self.collect().items()]
+
+    def render(self, processes=None):
+        for key, value in sorted(self.collect(processes).items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode='sum'):
+        """multiprocess_mode：sum 为各进程之和，max 取最大值，local 只取处理本次请求的进程（如来自共享数据库的值）"""
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+        _changed()
+
+    def merge(self, values, other, alive):
+        # 已退出进程的仪表盘值不再有意义
+        if not alive or self.multiprocess_mode == 'local':
+            return
+        for key, value in other:
+            key = _restore_key(key)
+            if key not in values:
+                values[key] = value
+            elif self.multiprocess_mode == 'max':
+                values[key] = max(values[key], value)
+            else:
+                values[key] += value
+
+
+class Histogram:
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [每个桶的计数, 总和, 总数]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+        _changed()
+
+    def snapshot(self):
+        with self._lock:
+            return [[key, [list(e[0]), e[1], e[2]]] for key, e in self._values.items()]
+
+    def collect(self, processes=None):
+        with self._lock:
+            values = {key: [list(e[0]), e[1], e[2]] for key, e in self._values.items()}
+        for _alive, snapshot in (read_processes() if processes is None else processes):
+            for key, (counts, total, count) in snapshot.get(self.name, ()):
+                key = _restore_key(key)
+                entry = values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+        return values
+
+    def render(self, processes=None):
+        for key, (counts, total, count) in sorted(self.collect(processes).items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(key + (('le', _format_value(float(bound))),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(key)} {count}"
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, fn):
+        """fn() 在输出或写入共享目录前调用，用来刷新按需计算的仪表盘（如内存中的游戏数）"""
+        self._collectors.append(fn)
+        return fn
+
+    def run_collectors(self):
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception as e:
+                logger.warning("刷新指标失败: %s", e)
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self._metrics}
+
+    def render(self):
+        self.run_collectors()
+        processes = read_processes()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+            lines.extend(metric.render(processes))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+
+registry = Registry()
+
+CALL_LABELS = ('ai', 'provider', 'phase')
+LLM_CALLS = registry.register(Counter(
+    'cyber_cricket_llm_calls_total', 'LLM 调用次数（status 为 ok 或 error）', CALL_LABELS + ('status',)))
+LLM_RETRIES = registry.register(Counter(
+    'cyber_cricket_llm_retries_total', 'LLM 调用的重试次数', CALL_LABELS))
+LLM_TOKENS = registry.register(Counter(
+    'cyber_cricket_llm_tokens_total', 'LLM 调用的 token 用量（kind 为 prompt、cached 或 completion）', CALL_LABELS + ('kind',)))
+LLM_LATENCY = registry.register(Histogram(
+    'cyber_cricket_llm_latency_seconds', 'LLM 调用总耗时（含重试）', CALL_LABELS))
+LLM_TTFT = registry.register(Histogram(
+    'cyber_cricket_llm_ttft_seconds', '流式调用的首 token 延迟', CALL_LABELS))
+LLM_QUEUE_WAIT = registry.register(Histogram(
+    'cyber_cricket_llm_queue_wait_seconds', '并发调用在线程池中排队等待的时间', CALL_LABELS))
+ACTIVE_GAMES = registry.register(Gauge(
+    'cyber_cricket_active_games', '内存中的游戏数量', ('state',)))
+POOLED_CLIENTS = registry.register(Gauge(
+    'cyber_cricket_pooled_clients', '客户端池中缓存的客户端数量'))
+SCHEDULER_WAIT = registry.register(Histogram(
+    'cyber_cricket_scheduler_wait_seconds', '请求在调度器中等待服务商限额的时间', ('provider',)))
+SCHEDULER_QUEUE = registry.register(Gauge(
+    'cyber_cricket_scheduler_queue_depth', '调度器中等待放行的请求数', ('provider',)))
+PREFETCH = registry.register(Counter(
+    'cyber_cricket_speech_prefetch_total', '分步发言预取结果（hit 命中，miss 未预取，failed 预取失败，discarded 过期丢弃）', ('result',)))
+CIRCUIT_STATE = registry.register(Gauge(
+    'cyber_cricket_circuit_state', '各服务商地址的熔断器状态（0 关闭，1 半开，2 打开）', ('endpoint',),
+    multiprocess_mode='max'))
+CIRCUIT_REJECTIONS = registry.register(Counter(
+    'cyber_cricket_circuit_rejections_total', '熔断器打开期间被直接拒绝的调用次数', ('endpoint',)))
+JOBS = registry.register(Counter(
+    'cyber_cricket_jobs_total', '已结束的后台任务数（按类型与结果）', ('kind', 'status')))
+JOB_QUEUE = registry.register(Gauge(
+    'cyber_cricket_jobs', '当前的后台任务数（queued 排队中，running 运行中）', ('status',), multiprocess_mode='local'))
+
+# 当前线程的排队等待时间，由 run_concurrently 在任务开始执行时写入
+_queue_wait = threading.local()
+
+
+def set_queue_wait(seconds):
+    _queue_wait.value = seconds
+
+
+def take_queue_wait():
+    """取出并清除当前线程的排队等待时间（同一任务中只计入第一次调用）"""
+    value = getattr(_queue_wait, 'value', None)
+    _queue_wait.value = None
+    return value
+
+
+def cached_tokens_of(usage):
+    """从 usage 中取命中前缀缓存的 token 数，兼容不同服务商的字段"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return cached or 0
+
+
+class CallTimer:
+    """记录一次 LLM 调用：创建时开始计时，流式输出首段时调用 first_token()，结束时调用 finish()"""
+
+    def __init__(self, ai, provider, phase, round_num=None):
+        self.ai = ai.get('name', 'AI')
+        self.provider = provider
+        self.phase = phase
+        self.round_num = round_num
+        self.queue_wait = take_queue_wait()
+        self.started = time.perf_counter()
+        self.ttft = None
+        self.retries = 0
+        self.usage = None
+        self.finished = False
+
+    def first_token(self):
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.started
+
+    def retry(self):
+        self.retries += 1
+
+    def set_usage(self, usage):
+        if usage is not None:
+            self.usage = usage
+
+    def finish(self, status='ok'):
+        if self.finished:
+            return
+        self.finished = True
+        latency = time.perf_counter() - self.started
+        labels = {"ai": self.ai, "provider": self.provider, "phase": self.phase}
+        prompt = getattr(self.usage, 'prompt_tokens', 0) or 0
+        completion = getattr(self.usage, 'completion_tokens', 0) or 0
+        cached = cached_tokens_of(self.usage) if self.usage is not None else 0
+
+        LLM_CALLS.inc(status=status, **labels)
+        LLM_LATENCY.observe(latency, **labels)
+        if self.retries:
+            LLM_RETRIES.inc(self.retries, **labels)
+        if self.ttft is not None:
+            LLM_TTFT.observe(self.ttft, **labels)
+        if self.queue_wait is not None:
+            LLM_QUEUE_WAIT.observe(self.queue_wait, **labels)
+        if self.usage is not None:
+            LLM_TOKENS.inc(prompt, kind='prompt', **labels)
+            LLM_TOKENS.inc(cached, kind='cached', **labels)
+            LLM_TOKENS.inc(completion, kind='completion', **labels)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "llm_call ai=%s provider=%s phase=%s round=%s status=%s queue_wait=%s ttft=%s latency=%.3f "
+                "prompt_tokens=%d cached_tokens=%d completion_tokens=%d retries=%d",
+                self.ai, self.provider, self.phase, self.round_num, status,
+                f"{self.queue_wait:.3f}" if self.queue_wait is not None else '-',
+                f"{self.ttft:.3f}" if self.ttft is not None else '-',
+                latency, prompt, cached, completion, self.retries
+            )
+
+
+def usage_summary():
+    """按AI汇总 token 用量与前缀缓存命中率（/usage_stats 使用）"""
+    stats = {}
+    for labels, value in LLM_CALLS.items():
+        if labels['status'] == 'ok':
+            entry = stats.setdefault(labels['ai'], {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+            entry['calls'] += value
+    for labels, value in LLM_TOKENS.items():
+        entry = stats.setdefault(labels['ai'], {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        entry[f"{labels['kind']}_tokens"] += value
+    for entry in stats.values():
+        entry['cache_hit_rate'] = round(entry['cached_tokens'] / entry['prompt_tokens'], 4) if entry['prompt_tokens'] else 0.0
+    return stats
+
+
+def render():
+    return registry.render()
+
+
+# 多进程部署时各进程写入指标的目录，单进程时为 None
+_process_dir = None
+_flush_interval = 5.0
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def configure(process_dir=None, flush_interval=5.0):
+    """开启（process_dir 为目录）或关闭多进程合并"""
+    global _process_dir, _flush_interval
+    if process_dir:
+        os.makedirs(process_dir, exist_ok=True)
+    _process_dir = process_dir or None
+    _flush_interval = flush_interval
+
+
+def _process_file(pid):
+    return os.path.join(_process_dir, f"{pid}.json")
+
+
+def _changed():
+    # 指标第一次变化时才启动写入线程，不记录指标的进程（如 gunicorn 主进程）不写文件
+    global _flusher
+    if _process_dir is None or _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True)
+            _flusher.start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_flush_interval)
+        flush()
+
+
+def flush():
+    """把本进程的指标写入共享目录（多进程部署时由后台线程定期调用，进程结束前也可以直接调用）"""
+    if _process_dir is None:
+        return
+    registry.run_collectors()
+    data = {"pid": os.getpid(), "metrics": registry.snapshot()}
+    try:
+        atomic_write(_process_file(os.getpid()), json.dumps(data, ensure_ascii=False), durable=False)
+    except OSError as e:
+        logger.warning("写入进程指标失败: %s", e)
+
+
+def read_processes():
+    """其他进程写入的指标：[(进程是否仍在运行, {指标名: snapshot})]，单进程时为空"""
+    if _process_dir is None:
+        return []
+    own = f"{os.getpid()}.json"
+    processes = []
+    try:
+        names = os.listdir(_process_dir)
+    except FileNotFoundError:
+        return []
+    for name in names:
+        if not name.endswith('.json') or name == own:
+            continue
+        try:
+            with open(os.path.join(_process_dir, name), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = not name.startswith('dead-') and pid_alive(data['pid'])
+        processes.append((alive, data['metrics']))
+    return processes
+
+
+def mark_process_dead(pid):
+    """工作进程退出后调用（gunicorn 的 child_exit）：保留它的计数，进程号被复用时不会被新进程覆盖"""
+    if _process_dir is None:
+        return
+    try:
+        os.replace(_process_file(pid), os.path.join(_process_dir, f"dead-{pid}-{time.time_ns()}.json"))
+    except FileNotFoundError:
+        pass
+
+
+def clear_processes():
+    """服务启动时调用（gunicorn 的 on_starting）：删除上次运行留下的进程指标"""
+    if _process_dir is None:
+        return
+    for name in os.listdir(_process_dir):
+        if name.endswith('.json'):
+            try:
+                os.remove(os.path.join(_process_dir, name))
+            except FileNotFoundError:
+                pass
+
+
+def reset_after_fork():
+    """fork 出的子进程中调用：继承来的数值已计入父进程，子进程从零开始并写入自己的文件"""
+    global _flusher, _flusher_lock
+    _flusher = None
+    _flusher_lock = threading.Lock()
+    for metric in registry._metrics:
+        metric._lock = threading.Lock()
+    registry.clear()
+
+
+if Config.WORKER_PROCESSES > 1:
+    configure(os.path.join(Config.DATA_DIR, 'metrics'), Config.METRICS_FLUSH_INTERVAL)
@@ -0,0 +1,428 @@
+"""本地的 OpenAI 兼容模拟后端
+
+实现 /v1/chat/completions（普通与流式）和 /v1/models，用于离线测量和压测游戏流程：
+  - 回复可以按脚本依次返回，也可以按随机种子生成（投票请求会返回合法的玩家编号）
+  - 首 token 延迟、逐 token 间隔、整体延迟按可配置的分布采样
+  - 可按概率注入 429（带 Retry-After）、500 和流式中途断开，也可以按每分钟请求数限流
+  - usage 字段包含 prompt/completion token 数，以及模拟前缀缓存得到的 cached_tokens
+
+路径前缀用来选择配置：apibase 设为 http://127.0.0.1:8001/<profile>/v1 时使用名为 <profile> 的配置，
+不存在时使用 default。由于注册表要求 apibase 唯一，多个AI可以用不同前缀指向同一个模拟后端。
+
+用法：
+    python -m app.mock_backend --port 8001 --seed 42 --latency lognormal:0.8,0.5 --rate-limit-rate 0.05
+    python -m app.mock_backend --config mock_profiles.json
+
+配置文件格式：{"seed": 42, "profiles": {"default": {...}, "slow": {"latency": "uniform:2,5"}}}，
+配置项与命令行参数同名（横线换成下划线）。
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from flask import Flask, Response, jsonify, request
+
+from app.tokenizer import count_tokens
+
+# 生成回复用的语料
+CORPUS = [
+    "哈哈，今天真是有点累了。",
+    "我刚才在想晚饭吃什么，结果一走神就轮到我了。",
+    "说实话我觉得大家都挺像真人的。",
+    "刚刚那位说的我不太同意，感觉有点太官方了。",
+    "我小时候在乡下长大，夏天最喜欢抓蛐蛐。",
+    "你们有没有觉得这个游戏有点紧张？",
+    "我先表个态，我是真人，信不信由你们。",
+    "嗯……让我想想怎么说比较好。",
+    "前面那位回答得太快了，有点可疑哦。",
+    "最近工作压力挺大的，来这里放松一下。",
+    "我猜有人在装，但我暂时说不上是谁。",
+    "其实我更关心大家平时都喜欢做什么。",
+]
+SUMMARY_HINT = "概括"
+VOTE_HINT = "请直接回复你要投票的玩家编号"
+
+DEFAULT_PROFILE = {
+    # 非流式请求的整体延迟（秒）
+    "latency": "lognormal:0.8,0.4",
+    # 流式请求的首 token 延迟与逐 token 间隔（秒）
+    "ttft": "lognormal:0.4,0.4",
+    "token_latency": "fixed:0.01",
+    # 生成回复的 token 数（不超过请求的 max_tokens）
+    "completion_tokens": "uniform:30,120",
+    # 故障注入概率
+    "rate_limit_rate": 0.0,
+    "error_rate": 0.0,
+    "stream_error_rate": 0.0,
+    # 429 响应的 Retry-After（秒）
+    "retry_after": 1,
+    # 每分钟请求数上限，0 表示不限
+    "rpm": 0,
+    # 模拟前缀缓存：命中的前缀不少于 cache_min_tokens，且按 cache_block 向下取整
+    "cache_min_tokens": 1024,
+    "cache_block": 128,
+    # 投票请求选择弃权的概率
+    "abstain_rate": 0.1,
+    # 按顺序返回的脚本回复（为空时随机生成）
+    "responses": [],
+}
+
+
+def parse_distribution(spec):
+    """把 "lognormal:0.8,0.4" 这样的描述解析为无参采样函数（返回值不小于 0）
+
+    支持 fixed:x（或直接写数字）、uniform:a,b、normal:mu,sigma、lognormal:median,sigma、exp:mean。
+    """
+    if isinstance(spec, (int, float)):
+        value = float(spec)
+        return lambda rng: value
+    name, _, args = str(spec).partition(':')
+    if not args:
+        value = float(name)
+        return lambda rng: value
+    params = [float(x) for x in args.split(',')]
+    if name == 'fixed':
+        return lambda rng: params[0]
+    if name == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if name == 'lognormal':
+        mu = math.log(params[0]) if params[0] > 0 else 0.0
+        return lambda rng: rng.lognormvariate(mu, params[1])
+    if name == 'exp':
+        return lambda rng: rng.expovariate(1 / params[0]) if params[0] > 0 else 0.0
+    raise ValueError(f"未知的分布: {spec}")
+
+
+class PrefixCache:
+    """记录见过的消息前缀，用于估算 cached_tokens（与服务商一样按消息边界前缀匹配）"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup_and_store(self, model, messages):
+        """返回与之前请求相同的最长消息前缀的 token 数，并记录本次请求的所有前缀"""
+        cached = 0
+        tokens = 0
+        digest = hashlib.sha256(str(model).encode('utf-8'))
+        with self._lock:
+            for msg in messages:
+                digest.update(json.dumps(msg, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+                key = digest.hexdigest()
+                tokens += message_tokens(msg)
+                if key in self._seen:
+                    cached = tokens
+                    self._seen.move_to_end(key)
+                else:
+                    self._seen[key] = True
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return cached
+
+
+class Profile:
+    def __init__(self, name, seed=None, **options):
+        unknown = set(options) - set(DEFAULT_PROFILE)
+        if unknown:
+            raise ValueError(f"配置 {name} 中有未知的配置项: {sorted(unknown)}")
+        self.name = name
+        self.options = {**DEFAULT_PROFILE, **options}
+        self.latency = parse_distribution(self.options['latency'])
+        self.ttft = parse_distribution(self.options['ttft'])
+        self.token_latency = parse_distribution(self.options['token_latency'])
+        self.completion_tokens = parse_distribution(self.options['completion_tokens'])
+        self.seed = seed
+        self.rng = random.Random(f"{seed}:{name}")
+        self.lock = threading.Lock()
+        self.script_index = 0
+        self.request_times = deque()
+        self.stats = {"requests": 0, "streams": 0, "rate_limited": 0, "errors": 0, "stream_errors": 0}
+
+    def sample(self, dist):
+        with self.lock:
+            return dist(self.rng)
+
+    def roll(self, key):
+        """按配置的概率决定是否注入某种故障"""
+        rate = self.options[key]
+        if not rate:
+            return False
+        with self.lock:
+            return self.rng.random() < rate
+
+    def over_rpm(self):
+        rpm = self.options['rpm']
+        if not rpm:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.request_times and now - self.request_times[0] > 60:
+                self.request_times.popleft()
+            if len(self.request_times) >= rpm:
+                return True
+            self.request_times.append(now)
+            return False
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def next_script(self):
+        responses = self.options['responses']
+        if not responses:
+            return None
+        with self.lock:
+            text = responses[self.script_index % len(responses)]
+            self.script_index += 1
+        return text
+
+
+def message_tokens(msg):
+    # 与 OpenAI 的计费方式类似，每条消息另加少量格式开销
+    content = msg.get('content') or ''
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return count_tokens(content) + 4
+
+
+def generate_reply(profile, model, messages, max_tokens, structured=False):
+    """生成回复文本：优先使用脚本，否则按 (种子, 模型, 最后一条消息) 确定性地生成
+
+    structured 为请求带了 JSON 格式的 response_format，投票请求返回 {"target": 玩家编号}。
+    """
+    scripted = profile.next_script()
+    if scripted is not None:
+        return scripted
+    last = messages[-1].get('content', '') if messages else ''
+    rng = random.Random(f"{profile.seed}:{model}:{hashlib.sha256(str(last).encode('utf-8')).hexdigest()}")
+    if VOTE_HINT in str(last):
+        candidates = sorted(set(re.findall(r'(玩家\d+)说', str(last))))
+        if not candidates or rng.random() < profile.options['abstain_rate']:
+            return '{"target": 0}' if structured else "我选择弃权，0"
+        target = rng.choice(candidates)
+        if structured:
+            return json.dumps({"target": int(target[2:])})
+        return f"综合来看，{target}最可疑，我投{target[2:]}"
+    if SUMMARY_HINT in str(last):
+        return "本轮大家互相试探，有人被怀疑发言过于工整。"
+    target = int(profile.completion_tokens(rng))
+    if max_tokens:
+        target = min(target, int(max_tokens))
+    parts = []
+    while count_tokens("".join(parts)) < target:
+        parts.append(rng.choice(CORPUS))
+    return "".join(parts) or rng.choice(CORPUS)
+
+
+def generate_turn(profile, model, messages, max_tokens):
+    """合并模式（发言同时投票）的回复：{"speech": 发言, "vote": 对话历史中某位其他玩家的编号或 0}"""
+    # 给 JSON 的外壳留出余量，避免被 max_tokens 截断成不完整的 JSON
+    speech = generate_reply(profile, model, messages, max(1, int(max_tokens or 0) - 20) if max_tokens else None)
+    last = str(messages[-1].get('content', '')) if messages else ''
+    history = "".join(str(m.get('content', '')) for m in messages[:-1])
+    rng = random.Random(f"{profile.seed}:{model}:turn:{hashlib.sha256(last.encode('utf-8')).hexdigest()}")
+    me = re.search(r'你是(玩家\d+)', last)
+    candidates = sorted(set(re.findall(r'^(玩家\d+):', history, re.M)) - {me.group(1) if me else None})
+    if not candidates or rng.random() < profile.options['abstain_rate']:
+        vote = 0
+    else:
+        vote = int(rng.choice(candidates)[2:])
+    return json.dumps({"speech": speech, "vote": vote}, ensure_ascii=False)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """按 max_tokens 截断，返回 (文本, finish_reason)"""
+    if not max_tokens or count_tokens(text) <= max_tokens:
+        return text, "stop"
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low], "length"
+
+
+def split_tokens(text):
+    """把回复切成流式输出的片段：中文按字，其余按空白分词"""
+    return re.findall(r'[一-鿿　-〿＀-￯]|\s*[^\s一-鿿　-〿＀-￯]+|\s+', text)
+
+
+def error_response(status, message, error_type, code=None, headers=None):
+    body = {"error": {"message": message, "type": error_type, "param": None, "code": code}}
+    response = jsonify(body)
+    response.status_code = status
+    for key, value in (headers or {}).items():
+        response.headers[key] = value
+    return response
+
+
+def create_mock_app(profiles=None, seed=None):
+    """创建模拟后端的 Flask 应用，profiles 为 配置名 -> 配置项"""
+    profiles = dict(profiles or {})
+    profiles.setdefault('default', {})
+    profile_objs = {name: Profile(name, seed=seed, **options) for name, options in profiles.items()}
+    prefix_cache = PrefixCache()
+    app = Flask(__name__)
+    app.config['JSON_AS_ASCII'] = False
+
+    def profile_for(prefix):
+        return profile_objs.get(prefix or 'default', profile_objs['default'])
+
+    @app.route('/v1/models', methods=['GET'])
+    @app.route('/<path:prefix>/v1/models', methods=['GET'])
+    def list_models(prefix=None):
+        return jsonify({"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    @app.route('/<path:prefix>/v1/chat/completions', methods=['POST'])
+    def chat_completions(prefix=None):
+        profile = profile_for(prefix)
+        profile.count('requests')
+        body = request.get_json(force=True, silent=True) or {}
+        model = body.get('model', 'mock')
+        messages = body.get('messages') or []
+        max_tokens = body.get('max_tokens') or body.get('max_completion_tokens')
+        stream = bool(body.get('stream'))
+
+        if profile.over_rpm() or profile.roll('rate_limit_rate'):
+            profile.count('rate_limited')
+            return error_response(
+                429, "Rate limit reached (mock backend)", "requests", "rate_limit_exceeded",
+                headers={"Retry-After": str(profile.options['retry_after'])}
+            )
+        if profile.roll('error_rate'):
+            profile.count('errors')
+            return error_response(500, "The server had an error while processing your request (mock backend)", "server_error")
+
+        response_format = body.get('response_format') or {}
+        structured = response_format.get('type') in ('json_schema', 'json_object')
+        if structured and (response_format.get('json_schema') or {}).get('name') == 'turn':
+            text = generate_turn(profile, model, messages, max_tokens)
+        else:
+            text = generate_reply(profile, model, messages, max_tokens, structured)
+        text, finish_reason = truncate_to_tokens(text, max_tokens)
+        prompt_tokens = sum(message_tokens(m) for m in messages)
+        cached = prefix_cache.lookup_and_store(model, messages)
+        block = profile.options['cache_block'] or 1
+        cached = (cached // block) * block if cached >= profile.options['cache_min_tokens'] else 0
+        completion_tokens = count_tokens(text)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached},
+        }
+        completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+
+        if not stream:
+            time.sleep(profile.sample(profile.latency))
+            return jsonify({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": usage,
+            })
+
+        profile.count('streams')
+        include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+        pieces = split_tokens(text)
+        fail_at = None
+        if pieces and profile.roll('stream_error_rate'):
+            fail_at = profile.sample(lambda rng: rng.randrange(len(pieces)))
+
+        def chunk(delta, finish=None, chunk_usage=None, choices=True):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish}] if choices else []}
+            if chunk_usage is not None:
+                payload["usage"] = chunk_usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        def generate():
+            time.sleep(profile.sample(profile.ttft))
+            yield chunk({"role": "assistant", "content": ""})
+            for index, piece in enumerate(pieces):
+                if index == fail_at:
+                    profile.count('stream_errors')
+                    # 中途断开连接，模拟服务商断流
+                    raise ConnectionAbortedError("mock backend stream interrupted")
+                if index:
+                    time.sleep(profile.sample(profile.token_latency))
+                yield chunk({"content": piece})
+            yield chunk({}, finish=finish_reason)
+            if include_usage:
+                yield chunk(None, chunk_usage=usage, choices=False)
+            yield "data: [DONE]\n\n"
+
+        return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+    @app.route('/mock/stats', methods=['GET'])
+    def mock_stats():
+        """各配置的请求数与注入的故障次数"""
+        return jsonify({name: dict(p.stats) for name, p in profile_objs.items()})
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟后端")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--config', help='JSON 配置文件（seed 与 profiles）')
+    parser.add_argument('--seed', type=int, help='随机种子，相同种子与相同请求得到相同回复')
+    parser.add_argument('--latency', help='非流式请求的延迟分布，如 lognormal:0.8,0.4')
+    parser.add_argument('--ttft', help='流式请求的首 token 延迟分布')
+    parser.add_argument('--token-latency', help='流式请求的逐 token 间隔分布')
+    parser.add_argument('--completion-tokens', help='生成回复的 token 数分布')
+    parser.add_argument('--rate-limit-rate', type=float, help='返回 429 的概率')
+    parser.add_argument('--error-rate', type=float, help='返回 500 的概率')
+    parser.add_argument('--stream-error-rate', type=float, help='流式输出中途断开的概率')
+    parser.add_argument('--retry-after', type=int, help='429 响应的 Retry-After 秒数')
+    parser.add_argument('--rpm', type=int, help='每分钟请求数上限，超过返回 429')
+    parser.add_argument('--abstain-rate', type=float, help='投票请求选择弃权的概率')
+    parser.add_argument('--script', help='脚本回复文件（JSON 字符串列表），按顺序循环返回')
+    args = parser.parse_args(argv)
+
+    seed = args.seed
+    profiles = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        profiles = config.get('profiles', {})
+        if seed is None:
+            seed = config.get('seed')
+    default = profiles.setdefault('default', {})
+    for key in ('latency', 'ttft', 'token_latency', 'completion_tokens', 'rate_limit_rate', 'error_rate',
+                'stream_error_rate', 'retry_after', 'rpm', 'abstain_rate'):
+        value = getattr(args, key)
+        if value is not None:
+            default[key] = value
+    if args.script:
+        with open(args.script, 'r', encoding='utf-8') as f:
+            default['responses'] = json.load(f)
+
+    app = create_mock_app(profiles, seed=seed)
+    print(f"[模拟后端] 监听 http://{args.host}:{args.port}，配置: {sorted(profiles)}，种子: {seed}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
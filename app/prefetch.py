@@ -0,0 +1,111 @@
+"""分步发言的预取
+
+分步推进时，前端展示第 i 位AI的发言期间，服务端已在后台生成第 i+1 位的发言。
+同一轮内每位AI看到的对话历史只包含之前的轮次，所以下一位的请求内容在上一位发言前后是相同的。
+
+预取结果按完整的请求内容（AI配置 + 发给模型的消息）取用：取用时按当前状态重新构建请求，
+与预取时不同（AI配置、提示词、对话历史或摘要发生变化）即视为过期并丢弃，改为当场生成。
+预取只调用模型，不写游戏状态；结果被取用后才由调用方记录。
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import metrics
+from app.config import Config
+from app.scheduler import current_game, set_game
+from app.services import complete_speech
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.PREFETCH_WORKERS, thread_name_prefix='speech-prefetch')
+        return _executor
+
+
+def reset_after_fork():
+    """fork 出的子进程中调用：父进程的线程池不会带到子进程，按需重建"""
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+def _generate(game_id, ai, messages, ai_name, round_num):
+    # 预取线程中的请求仍算作这一局，参与调度器的公平排队
+    set_game(game_id)
+    return complete_speech(ai, messages, ai_name, 'speak', round_num)
+
+
+def request_key(ai, messages, round_num):
+    return (
+        round_num, ai['id'], ai['name'], ai['apikey'], ai['apibase'],
+        tuple((m['role'], m['content']) for m in messages)
+    )
+
+
+class SpeechPrefetcher:
+    """一局游戏的预取，按请求内容取用"""
+
+    def __init__(self):
+        # request_key -> Future
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def submit(self, ai, messages, ai_name, round_num):
+        """在后台开始生成 ai 的发言（同样的请求已在预取中时不重复提交）"""
+        key = request_key(ai, messages, round_num)
+        with self._lock:
+            if key in self._pending:
+                return
+            ai = {k: ai[k] for k in ('id', 'name', 'apikey', 'apibase')}
+            self._pending[key] = _get_executor().submit(_generate, current_game(), ai, messages, ai_name, round_num)
+        logger.debug("[预取] 第%s轮 %s 开始预取发言", round_num, ai_name)
+
+    def claim(self, ai, messages, round_num):
+        """取走与当前请求内容一致的预取（Future，不等待），其余未取用的预取视为过期丢弃；没有时返回 None
+
+        调用方可以先为下一位发言者 submit，再用 resolve() 等待结果，让两次调用重叠进行。
+        """
+        key = request_key(ai, messages, round_num)
+        with self._lock:
+            future = self._pending.pop(key, None)
+            self._drop()
+        if future is None:
+            metrics.PREFETCH.inc(result='miss')
+        return future
+
+    @staticmethod
+    def resolve(future, ai_name=None):
+        """等待 claim() 取到的预取完成，返回发言；预取失败时返回 None，由调用方当场生成"""
+        if future is None:
+            return None
+        try:
+            response = future.result()
+        except Exception as e:
+            logger.warning("[预取] AI %s 预取失败，改为当场生成: %s", ai_name, e)
+            metrics.PREFETCH.inc(result='failed')
+            return None
+        metrics.PREFETCH.inc(result='hit')
+        return response
+
+    def discard(self):
+        with self._lock:
+            self._drop()
+
+    def _drop(self):
+        for key, future in list(self._pending.items()):
+            # 尚未开始的直接取消，已在进行的调用让它结束，结果丢弃
+            future.cancel()
+            del self._pending[key]
+            metrics.PREFETCH.inc(result='discarded')
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
@@ -0,0 +1,274 @@
+"""LLM 请求的录制与回放
+
+录制（LLM_RECORD_FILE）：每次 chat.completions 请求成功后，把请求的哈希（模型 + 消息 + 参数）、回复、用量与耗时
+追加为一行 JSON；流式请求另外记下各段输出和首 token 时间。提示词本身不写入文件，只保留哈希。
+回放（LLM_REPLAY_FILE）：不访问网络，按请求的哈希从录制文件中取回回复，可以按原耗时的 LLM_REPLAY_LATENCY 倍等待。
+用来离线重现一局游戏，或者在完全相同的对局上比较引擎改动前后的耗时。
+
+内容相同的请求按录制顺序依次取用，用完后重复最后一条；录制中没有的请求抛出 ReplayMiss，按调用失败处理。
+投票平票时随机淘汰也经过这里（choice），回放时按录制的结果选择，游戏走向与录制时一致。
+
+用法：
+    LLM_RECORD_FILE=game.llm.jsonl python run.py
+    python -m app.tournament --games 20 --record games.llm.jsonl
+    python -m app.tournament --games 20 --replay games.llm.jsonl --replay-latency 0
+"""
+import hashlib
+import json
+import logging
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from app.config import Config
+from app.files import FileLock
+from app.scheduler import current_game
+
+logger = logging.getLogger(__name__)
+
+# 不影响回复内容的参数，不参与哈希
+_IGNORED_PARAMS = ('timeout', 'stream_options')
+
+
+class ReplayMiss(Exception):
+    """回放时录制文件中没有这个请求"""
+
+
+def request_key(model, kwargs):
+    payload = {"model": model, **{k: v for k, v in kwargs.items() if k not in _IGNORED_PARAMS}}
+    text = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def choice_key(parts):
+    text = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+def _usage_dict(usage):
+    if usage is None:
+        return None
+    if hasattr(usage, 'model_dump'):
+        return usage.model_dump(exclude_none=True)
+    return dict(usage)
+
+
+class Recorder:
+    """把请求与回复追加到录制文件（多个线程、进程可以写同一个文件）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+        self.recorded = 0
+
+    def create(self, client, model, **kwargs):
+        key = request_key(model, kwargs)
+        started = time.perf_counter()
+        result = client.chat.completions.create(model=model, **kwargs)
+        if kwargs.get('stream'):
+            return self._record_stream(key, model, kwargs, result, started)
+        choice = result.choices[0] if result.choices else None
+        self._write({
+            **self._request_fields(key, model, kwargs),
+            "content": choice.message.content if choice else None,
+            "finish_reason": choice.finish_reason if choice else None,
+            "usage": _usage_dict(getattr(result, 'usage', None)),
+            "latency": round(time.perf_counter() - started, 4),
+        })
+        return result
+
+    def _record_stream(self, key, model, kwargs, stream, started):
+        # 原样转发各段，读完后写入一条记录；调用方中途放弃或断流时不写入
+        chunks = []
+        usage = None
+        finish_reason = None
+        ttft = None
+        for chunk in stream:
+            if getattr(chunk, 'usage', None) is not None:
+                usage = chunk.usage
+            if chunk.choices:
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    chunks.append(delta)
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+            yield chunk
+        self._write({
+            **self._request_fields(key, model, kwargs),
+            "content": "".join(chunks),
+            "chunks": chunks,
+            "finish_reason": finish_reason,
+            "usage": _usage_dict(usage),
+            "latency": round(time.perf_counter() - started, 4),
+            "ttft": round(ttft, 4) if ttft is not None else None,
+        })
+
+    @staticmethod
+    def _request_fields(key, model, kwargs):
+        return {
+            "key": key,
+            "model": model,
+            "game": current_game(),
+            "params": {
+                "temperature": kwargs.get('temperature'),
+                "max_tokens": kwargs.get('max_tokens'),
+                "structured": 'response_format' in kwargs,
+                "stream": bool(kwargs.get('stream')),
+            },
+            "ts": round(time.time(), 3),
+        }
+
+    def record_choice(self, key, label):
+        self._write({"kind": "choice", "key": key, "choice": label, "game": current_game()})
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded += 1
+
+    def stats(self):
+        return {"mode": "record", "file": self.path, "recorded": self.recorded}
+
+
+class Replayer:
+    """按请求哈希从录制文件中取回回复，不访问网络"""
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self._responses = defaultdict(deque)
+        self._choices = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 录制进程被中断时最后一行可能不完整
+                    continue
+                table = self._choices if record.get('kind') == 'choice' else self._responses
+                table[record['key']].append(record)
+        logger.info("[回放] 已从 %s 载入 %d 种请求", path, len(self._responses))
+
+    def _take(self, table, key):
+        with self._lock:
+            queue = table.get(key)
+            if not queue:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return queue.popleft() if len(queue) > 1 else queue[0]
+
+    def create(self, client, model, **kwargs):
+        key = request_key(model, kwargs)
+        record = self._take(self._responses, key)
+        if record is None:
+            logger.warning("[回放] 录制中没有模型 %s 的请求 %s", model, key)
+            raise ReplayMiss(f"录制文件中没有这个请求（{key}）")
+        if kwargs.get('stream'):
+            include_usage = bool((kwargs.get('stream_options') or {}).get('include_usage'))
+            return self._stream(record, model, include_usage)
+        self._sleep(record.get('latency'))
+        return ChatCompletion.model_validate({
+            "id": f"replay-{key}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": record.get('content')},
+                "finish_reason": record.get('finish_reason') or 'stop',
+            }],
+            "usage": record.get('usage'),
+        })
+
+    def _stream(self, record, model, include_usage):
+        chunks = record.get('chunks') or [record.get('content') or '']
+        ttft = record.get('ttft') or 0
+        # 首段之后的耗时平均分到其余各段
+        step = max(0.0, (record.get('latency') or 0) - ttft) / len(chunks)
+        base = {"id": f"replay-{record['key']}", "object": "chat.completion.chunk", "created": 0, "model": model}
+        self._sleep(ttft)
+        for i, delta in enumerate(chunks):
+            if i:
+                self._sleep(step)
+            yield ChatCompletionChunk.model_validate({
+                **base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": delta}, "finish_reason": None}]
+            })
+        yield ChatCompletionChunk.model_validate({
+            **base, "choices": [{"index": 0, "delta": {}, "finish_reason": record.get('finish_reason') or 'stop'}]
+        })
+        if include_usage and record.get('usage'):
+            yield ChatCompletionChunk.model_validate({**base, "choices": [], "usage": record['usage']})
+
+    def choice(self, key):
+        record = self._take(self._choices, key)
+        return record['choice'] if record is not None else None
+
+    def _sleep(self, seconds):
+        if self.latency and seconds:
+            time.sleep(seconds * self.latency)
+
+    def stats(self):
+        return {"mode": "replay", "file": self.path, "latency": self.latency, "hits": self.hits, "misses": self.misses}
+
+
+# 当前的录制/回放器，未开启时为 None
+active = None
+
+
+def configure(record_file=None, replay_file=None, latency=0.0):
+    """开启录制或回放（同时指定时回放优先），都不指定时关闭；返回当前的录制/回放器"""
+    global active
+    if replay_file:
+        active = Replayer(replay_file, latency)
+    elif record_file:
+        active = Recorder(record_file)
+        logger.info("[录制] LLM 请求将记录到 %s", record_file)
+    else:
+        active = None
+    return active
+
+
+def settings():
+    """当前配置，供子进程（如锦标赛的工作进程）按同样的方式开启"""
+    if isinstance(active, Replayer):
+        return {"replay_file": active.path, "latency": active.latency}
+    if isinstance(active, Recorder):
+        return {"record_file": active.path}
+    return {}
+
+
+def create(client, model, **kwargs):
+    """chat.completions.create 的替代：按当前模式直接请求、请求并录制，或从录制中回放"""
+    if active is None:
+        return client.chat.completions.create(model=model, **kwargs)
+    return active.create(client, model, **kwargs)
+
+
+def choice(key_parts, options, labels=None):
+    """可复现的随机选择：录制时记下选中项的标签（默认为选项本身），回放时按标签选择"""
+    labels = list(labels) if labels is not None else list(options)
+    if isinstance(active, Replayer):
+        label = active.choice(choice_key(key_parts))
+        if label in labels:
+            return options[labels.index(label)]
+    index = random.randrange(len(options))
+    if isinstance(active, Recorder):
+        active.record_choice(choice_key(key_parts), labels[index])
+    return options[index]
+
+
+def stats():
+    return active.stats() if active is not None else {"mode": "off"}
+
+
+configure(Config.LLM_RECORD_FILE, Config.LLM_REPLAY_FILE, Config.LLM_REPLAY_LATENCY)
@@ -0,0 +1,230 @@
+"""LLM 调用的容错：指数退避重试与按服务商地址的熔断器
+
+- 重试：只重试限流（429）、超时、连接错误和 5xx；退避时间为带全抖动的指数退避，
+  429 响应带 Retry-After 时按其等待；所有重试受总时限约束。
+- 熔断：每个 apibase 一个熔断器，连续失败达到阈值后在冷却期内直接失败，
+  冷却结束后放行一个探测请求，成功则恢复。限流不计为失败（服务商仍在响应）。
+"""
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from openai import APIConnectionError, APIStatusError, RateLimitError
+
+from app import metrics
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时直接拒绝调用"""
+
+    def __init__(self, key, retry_in):
+        super().__init__(f"{key} 暂时不可用（熔断中，{retry_in:.0f} 秒后重试）")
+        self.key = key
+        self.retry_in = retry_in
+
+
+def _status_of(e):
+    return e.status_code if isinstance(e, APIStatusError) else None
+
+
+def is_transient(e):
+    """可重试的错误：限流、超时、连接错误、5xx，以及流式读取中底层 HTTP 库抛出的网络错误"""
+    if isinstance(e, (RateLimitError, APIConnectionError)):
+        return True
+    status = _status_of(e)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    return type(e).__module__.split('.')[0] in ('httpx', 'httpx2', 'httpcore')
+
+
+def is_endpoint_failure(e):
+    """计入熔断的错误：服务商不可达或出错；限流和其他 4xx 说明服务商仍在正常响应"""
+    if isinstance(e, RateLimitError):
+        return False
+    status = _status_of(e)
+    if status is not None:
+        return status >= 500
+    return is_transient(e)
+
+
+def retry_after(e):
+    """从错误响应头中读取 Retry-After（秒），没有时返回 None"""
+    response = getattr(e, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        value = headers.get('retry-after-ms')
+        if value is not None:
+            return max(0.0, float(value) / 1000)
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=3, base_delay=0.5, max_delay=20, deadline=120):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls):
+        return cls(Config.LLM_MAX_ATTEMPTS, Config.LLM_BACKOFF_BASE, Config.LLM_BACKOFF_MAX, Config.LLM_RETRY_DEADLINE)
+
+    def delay(self, attempt, e=None):
+        """第 attempt 次（从 0 开始）失败后的等待时间"""
+        if isinstance(e, RateLimitError) or _status_of(e) == 429:
+            wait = retry_after(e)
+            if wait is not None:
+                return wait
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def next_delay(self, attempt, e, started):
+        """判断是否还能重试：可以时返回等待秒数，否则返回 None"""
+        if attempt + 1 >= self.max_attempts or not is_transient(e):
+            return None
+        wait = self.delay(attempt, e)
+        if self.deadline and time.monotonic() - started + wait > self.deadline:
+            return None
+        return wait
+
+
+class CircuitBreaker:
+    def __init__(self, key, failure_threshold=5, reset_timeout=30):
+        self.key = key
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("熔断器 %s: %s -> %s", self.key, self.state, state)
+            self.state = state
+        metrics.CIRCUIT_STATE.set(STATE_VALUES[state], endpoint=self.key)
+
+    def allow(self):
+        """调用前检查，熔断中抛出 CircuitOpenError；半开状态只放行一个探测请求"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+                if retry_in > 0:
+                    metrics.CIRCUIT_REJECTIONS.inc(endpoint=self.key)
+                    raise CircuitOpenError(self.key, retry_in)
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    metrics.CIRCUIT_REJECTIONS.inc(endpoint=self.key)
+                    raise CircuitOpenError(self.key, 0)
+                self._probing = True
+
+    @property
+    def is_open(self):
+        return self.state == OPEN
+
+    def record_success(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self, e):
+        """记录一次失败；不计入熔断的错误只结束探测"""
+        # 阈值为 0 时熔断器关闭，始终不进入熔断状态
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            probing, self._probing = self._probing, False
+            if not is_endpoint_failure(e):
+                return
+            self.failures += 1
+            if probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def stats(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(key):
+    """key 对应的熔断器（按实际请求的 apibase 区分）"""
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(
+                key, Config.BREAKER_FAILURE_THRESHOLD, Config.BREAKER_RESET_TIMEOUT)
+            metrics.CIRCUIT_STATE.set(STATE_VALUES[CLOSED], endpoint=key)
+        return breaker
+
+
+def reset_after_fork():
+    """fork 出的子进程中调用：熔断状态按进程各自统计，从关闭状态重新开始"""
+    global _breakers, _breakers_lock
+    _breakers = {}
+    _breakers_lock = threading.Lock()
+
+
+def breaker_stats():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.key: breaker.stats() for breaker in breakers}
+
+
+def call_with_retry(fn, breaker, policy=None, on_retry=None):
+    """经过熔断器调用 fn()，可重试的错误按退避策略重试，最终失败时抛出最后一个错误
+
+    on_retry(attempt, error, wait) 在每次等待重试前调用。
+    """
+    policy = policy or RetryPolicy.from_config()
+    started = time.monotonic()
+    attempt = 0
+    while True:
+        breaker.allow()
+        try:
+            result = fn()
+        except Exception as e:
+            breaker.record_failure(e)
+            # 本次失败触发熔断时不再等待重试
+            wait = None if breaker.is_open else policy.next_delay(attempt, e, started)
+            if wait is None:
+                raise
+            if on_retry is not None:
+                on_retry(attempt, e, wait)
+            time.sleep(wait)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
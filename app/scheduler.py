@@ -0,0 +1,253 @@
+"""出站 LLM 请求的调度：按服务商限流与跨游戏公平排队
+
+每个服务商（按请求的主机区分）两个令牌桶：每分钟请求数（RPM）与每分钟 token 数（TPM）。
+请求发出前按估算的 token 数（提示词 + max_tokens）取令牌，拿到响应后按实际用量多退少补；
+服务商仍返回 429 时按 Retry-After 暂停该服务商。
+
+同一服务商的等待请求按游戏分组轮转放行：每放行一局的一个请求，就轮到下一局，
+大局（10 个AI并发发言）不会把同时进行的小局饿住。未配置限额的服务商不排队。
+
+令牌桶在进程内，多进程部署时各工作进程平分限额（processes）；
+锦标赛的子进程再平分发起它的进程的份额（见 set_processes）。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+from app import metrics
+
+# 当前线程的请求属于哪一局，由接口层设置，run_concurrently 等把它带到工作线程
+_context = threading.local()
+
+
+def set_game(game_id):
+    _context.game_id = game_id
+
+
+def current_game():
+    return getattr(_context, 'game_id', None)
+
+
+class TokenBucket:
+    """按每分钟 per_minute 的速率补充，最多积攒 burst_seconds 秒的量（至少 1）"""
+
+    def __init__(self, per_minute, burst_seconds=10):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """还需要等多久才能取 amount 个令牌；超过桶容量的请求在桶满时放行，之后欠账慢慢补回"""
+        self._refill(now)
+        need = min(amount, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def give_back(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    """一次放行的记录，响应返回后交给 Scheduler.settle 按实际用量结算"""
+
+    def __init__(self, key, game, tokens):
+        self.key = key
+        self.game = game
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.waited = 0.0
+
+
+class ProviderQueue:
+    def __init__(self, key, rpm=0, tpm=0, burst_seconds=10):
+        self.key = key
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self.cond = threading.Condition()
+        # 游戏 -> 等待中的 Ticket，按轮转顺序排列
+        self.waiting = OrderedDict()
+        self.paused_until = 0.0
+        self.granted = 0
+        self.total_wait = 0.0
+
+    @property
+    def limited(self):
+        return self.requests is not None or self.tokens is not None
+
+    def depth(self):
+        return sum(len(q) for q in self.waiting.values())
+
+    def _head(self):
+        for tickets in self.waiting.values():
+            return tickets[0]
+        return None
+
+    def _wait_time(self, ticket, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(ticket.tokens, now))
+        return wait
+
+    def _grant(self, ticket, now):
+        tickets = self.waiting[ticket.game]
+        tickets.popleft()
+        if tickets:
+            # 这一局还有请求在等，排到队尾，先放行其他局
+            self.waiting.move_to_end(ticket.game)
+        else:
+            del self.waiting[ticket.game]
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(ticket.tokens)
+        ticket.waited = now - ticket.enqueued
+        self.granted += 1
+        self.total_wait += ticket.waited
+
+    def acquire(self, ticket):
+        with self.cond:
+            self.waiting.setdefault(ticket.game, deque()).append(ticket)
+            while True:
+                now = time.monotonic()
+                if self._head() is ticket:
+                    wait = self._wait_time(ticket, now)
+                    if wait <= 0:
+                        self._grant(ticket, now)
+                        self.cond.notify_all()
+                        return ticket
+                    self.cond.wait(wait)
+                else:
+                    self.cond.wait()
+
+    def settle(self, ticket, used):
+        if self.tokens is None or used is None:
+            return
+        with self.cond:
+            diff = ticket.tokens - used
+            if diff > 0:
+                self.tokens.give_back(diff)
+            else:
+                self.tokens.take(-diff)
+            self.cond.notify_all()
+
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            now = time.monotonic()
+            if self.requests is not None:
+                self.requests._refill(now)
+            if self.tokens is not None:
+                self.tokens._refill(now)
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "queue_depth": self.depth(),
+                "queue_by_game": {str(game): len(q) for game, q in self.waiting.items()},
+                "available_requests": round(self.requests.tokens, 2) if self.requests is not None else None,
+                "available_tokens": round(self.tokens.tokens) if self.tokens is not None else None,
+                "paused_for": round(max(0.0, self.paused_until - now), 3),
+                "granted": self.granted,
+                "avg_wait": round(self.total_wait / self.granted, 4) if self.granted else 0.0,
+            }
+
+
+def parse_limits(text):
+    """RATE_LIMITS 配置：JSON，服务商主机 -> {"rpm": 每分钟请求数, "tpm": 每分钟 token 数}"""
+    if not text:
+        return {}
+    limits = json.loads(text)
+    return {host: {"rpm": int(v.get('rpm', 0)), "tpm": int(v.get('tpm', 0))} for host, v in limits.items()}
+
+
+class Scheduler:
+    def __init__(self, limits=None, default_rpm=0, default_tpm=0, burst_seconds=10, processes=1):
+        self.limits = dict(limits or {})
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.burst_seconds = burst_seconds
+        self.processes = max(1, processes)
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def queue_for(self, key):
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                limit = self.limits.get(key, {})
+                queue = self._queues[key] = ProviderQueue(
+                    key,
+                    rpm=self._share(limit.get('rpm', self.default_rpm)),
+                    tpm=self._share(limit.get('tpm', self.default_tpm)),
+                    burst_seconds=self.burst_seconds
+                )
+            return queue
+
+    def _share(self, per_minute):
+        # 本进程分到的额度，配置了限额时至少每分钟 1 个
+        if not per_minute:
+            return 0
+        return max(1, per_minute // self.processes)
+
+    def reset_after_fork(self):
+        """fork 出的子进程中调用：丢弃继承来的排队状态，令牌桶按需重建"""
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def set_processes(self, processes):
+        """改为按 processes 个进程平分限额（在子进程中调用）；丢弃继承来的令牌桶，按新的份额重建"""
+        self.processes = max(1, processes)
+        self.reset_after_fork()
+
+    def acquire(self, key, tokens=0, game=None):
+        """等到服务商 key 有余量时返回 Ticket；tokens 可以是返回估算值的函数，只在配置了 TPM 时才计算"""
+        queue = self.queue_for(key)
+        if game is None:
+            game = current_game()
+        if not queue.limited:
+            return Ticket(key, game, 0)
+        if callable(tokens):
+            tokens = tokens() if queue.tokens is not None else 0
+        ticket = queue.acquire(Ticket(key, game, tokens))
+        metrics.SCHEDULER_WAIT.observe(ticket.waited, provider=key)
+        return ticket
+
+    def settle(self, ticket, usage):
+        """按响应中的实际 token 用量结算（usage 为空时保持估算值）"""
+        used = getattr(usage, 'total_tokens', None) if usage is not None else None
+        if used is None and usage is not None:
+            used = (getattr(usage, 'prompt_tokens', 0) or 0) + (getattr(usage, 'completion_tokens', 0) or 0)
+        self.queue_for(ticket.key).settle(ticket, used)
+
+    def refund(self, ticket):
+        """请求失败（没有产生输出）时调用：退还预扣的全部 token，失败和重试不挤占正常请求的额度"""
+        self.queue_for(ticket.key).settle(ticket, 0)
+
+    def pause(self, key, seconds):
+        """服务商返回 429 时暂停放行 seconds 秒"""
+        queue = self.queue_for(key)
+        if queue.limited:
+            queue.pause(seconds)
+
+    def stats(self):
+        with self._lock:
+            queues = list(self._queues.values())
+        return {queue.key: queue.stats() for queue in queues}
@@ -1,203 +1,524 @@
-import json
-import os
-import random
-import uuid
-from openai import OpenAI
-
-# 添加全局客户端缓存
-global_clients = {}
-
-def get_client(ai):
-    if ai["id"] not in global_clients:
-        if "moon" in ai["name"].lower():
-            global_clients[ai["id"]] = OpenAI(api_key=ai["apikey"], base_url=ai["apibase"])
-        elif "gpt" in ai["name"].lower():
-            global_clients[ai["id"]] = OpenAI(api_key=ai["apikey"])
-        else:
-            global_clients[ai["id"]] = OpenAI(base_url=ai["apibase"], api_key=ai["apikey"])
-    return global_clients.get(ai["id"])
-
-def format_conversation_history(ai, messages):
-    formatted_history = "对话历史：\n"
-    for msg in messages:
-        if msg["role"] == "user":
-            formatted_history += f"系统: {msg['content']}\n"
-        else:
-            formatted_history += f"{msg['ai_name']}: {msg['content']}\n"
-    return formatted_history
-
-def call_api(ai, message, is_your_turn=False, all_messages=None, ai_name=None):
-    print("[DEBUG call_api] 开始调用API")
-    
-    # 合并初始化逻辑
-    if "messages" not in ai:
-        ai["messages"] = []
-    
-    client = get_client(ai)
-    if all_messages is None:
-        all_messages = []
-    if ai_name is None:
-        ai_name = ai.get("name", "AI")
-
-    # 构建系统提示词
-    system_prompt = f"""你是AI {ai['name']} (ID: {ai['id']})。
-你需要在不暴露自己AI身份的情况下与其他参与者交谈。
-记住：
-1. 表现得像个真实的人类
-2. {ai['name']}要表达情感
-5. 不要说太多话
-6. 回应要有互动性，要对其他人的发言有回应"""
-
-    conversation_history = format_conversation_history(ai, all_messages)
-    print(f"[DEBUG call_api] 对话历史长度：{len(all_messages)}")
-    
-    full_prompt = f"{system_prompt}\n\n{conversation_history}\n\n当前情况: {message}"
-    print("[DEBUG call_api] 准备发送API请求")
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_prompt}
-            ]
-            print(f"[DEBUG call_api] 第{attempt+1}次尝试调用API")
-            completion = client.chat.completions.create(
-                model=ai["name"],
-                messages=messages,
-                temperature=0.7,
-                max_tokens=800
-            )
-            response = completion.choices[0].message.content
-            print(f"[DEBUG call_api] API调用成功，响应长度：{len(response)}")
-
-            # 仅在需要时追加新消息
-            if not ai["messages"] or ai["messages"][-1]["content"] != response:
-                ai["messages"].append({
-                    "role": "assistant",
-                    "ai_name": ai_name,
-                    "content": response
-                })
-            return response
-
-        except Exception as e:
-            print(f"[DEBUG call_api] 调用出错：{str(e)}")
-            if attempt < max_retries - 1:
-                print(f"[警告] AI {ai_name} 调用API出错，正在重试: {str(e)}")
-                continue  # 原来的 sleep 已删除，因未使用
-            else:
-                print(f"[错误] AI {ai['name']} 调用API出错: {str(e)}")
-                return f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。"
-
-    return f"[系统] AI {ai['name']} 调用失败，已达到最大重试次数。"
-
-def get_vote_suggestion(ai, all_responses, round_number):
-    """基于当前轮次的对话，为AI生成投票建议"""
-    messages = []
-    for response in all_responses:
-        if response["ai_id"] != ai["id"]:
-            messages.append({
-                "role": "user",
-                "content": f"玩家 {response['name']} 说: {response['response']}"
-            })
-    
-    analysis_prompt = f"""基于以上玩家的发言，你认为谁最可能是AI？\n请分析每个玩家的发言特点，给出你的投票建议。\n要考虑:\n1. 发言是否自然\n2. 是否有明显的机器人特征\n3. 是否过于完美或机械化\n4. 情感表达是否真实\n\n当前是第 {round_number} 轮。"""
-    
-    try:
-        client = get_client(ai)
-        completion = client.chat.completions.create(
-            model=ai["name"] if "gpt" in ai["name"].lower() else None,
-            messages=[
-                {"role": "system", "content": "你是一个分析专家"},
-                *messages,
-                {"role": "user", "content": analysis_prompt}
-            ],
-            temperature=0.7
-        )
-        return completion.choices[0].message.content
-    except Exception as e:
-        return f"无法生成投票建议: {str(e)}"
-
-def call_vote_api(ai, round_responses, round_number, player_map, activeAIs, eliminated_ids):
-    """AI投票接口"""
-    print(f"[投票阶段] AI {player_map[ai['id']]} 开始分析投票")
-    client = get_client(ai)
-    
-    # 构造投票分析提示词
-    vote_prompt = f"""基于所有玩家的发言，你需要决定投票给谁。
-当前是第 {round_number} 轮投票。
-以下是本轮所有玩家的发言：
-
-"""
-    for resp in round_responses:
-        if resp["ai_id"] != ai["id"]:  # 不包含自己的发言
-            vote_prompt += f"{resp['name']}说：{resp['response']}\n"
-    
-    vote_prompt += f"\n你是{player_map[ai['id']]}，请分析每个玩家的发言特点，并决定投票对象。"
-    vote_prompt += "\n要考虑：\n1. 发言是否自然\n2. 是否有明显的机器人特征\n3. 是否过于完美或机械化\n4. 情感表达是否真实"
-    vote_prompt += "\n特别说明：如果你认为没有明显可疑的对象，或者多个玩家同样可疑导致难以抉择，你可以选择弃权。"
-    vote_prompt += "\n请直接回复你要投票的玩家编号（如：2），如果你选择弃权请回复0。"
-    
-    print(f"[投票阶段] AI {player_map[ai['id']]} 正在分析其他玩家的发言")
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            messages = [
-                {"role": "system", "content": "你需要分析并决定投票给哪个玩家。记住，如果没有明显可疑的对象或出现多个同样可疑的对象，你可以选择弃权。"},
-                {"role": "user", "content": vote_prompt}
-            ]
-            completion = client.chat.completions.create(
-                model=ai["name"],
-                messages=messages,
-                temperature=0.7,
-                max_tokens=800
-            )
-            vote_content = completion.choices[0].message.content.strip()
-            print(f"[投票阶段] AI {player_map[ai['id']]} 投票分析结果：{vote_content}")
-            
-            # 提取投票数字 - 改进为只取最后一个数字
-            import re
-            # 新增：只匹配结尾的数字
-            match = re.search(r'(\d+)(?=[^\d]*$)', vote_content)
-            
-            if match:
-                vote_id = match.group(1)
-                # 验证投票有效性
-                if vote_id == '0':
-                    print(f"[投票阶段] AI {player_map[ai['id']]} 选择弃权")
-                    return '0'
-                
-                # 检查是否投给了已淘汰的玩家
-                target_ai_id = None
-                for k, v in player_map.items():
-                    if v.endswith(vote_id) and k in activeAIs:
-                        target_ai_id = k
-                        break
-                
-                if target_ai_id:
-                    if target_ai_id == ai['id']:
-                        print(f"[投票阶段] AI {player_map[ai['id']]} 试图投票给自己，自动转为弃权")
-                        return '0'
-                    elif target_ai_id in eliminated_ids:
-                        print(f"[投票阶段] AI {player_map[ai['id']]} 试图投票给已淘汰玩家，自动转为弃权")
-                        return '0'
-                    else:
-                        print(f"[投票阶段] AI {player_map[ai['id']]} 投票给了 {player_map[target_ai_id]}")
-                        return vote_id
-                else:
-                    print(f"[投票阶段] AI {player_map[ai['id']]} 投票无效，自动转为弃权")
-                    return '0'
-            else:
-                print(f"[投票阶段] AI {player_map[ai['id']]} 未提供有效投票，自动转为弃权")
-                return '0'
-                
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"[警告] AI {player_map[ai['id']]} 投票API调用失败，正在重试: {str(e)}")
-                sleep(1)
-                continue
-            else:
-                print(f"[错误] AI {player_map[ai['id']]} 投票API调用失败: {str(e)}")
-                return '0'  # 如果多次重试失败，返回弃权
-    
-    return '0'  # 默认弃权
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from openai import BadRequestError, RateLimitError
+from app import metrics, recording
+from app.client_pool import DEFAULT_HOST, ClientPool, host_of
+from app.config import Config
+from app.metrics import CallTimer
+from app.models import load_data, load_prompt
+from app.resilience import RetryPolicy, breaker_for, call_with_retry, retry_after
+from app.scheduler import Scheduler, current_game, parse_limits, set_game
+from app.tokenizer import count_tokens
+from app.votes import RESPONSE_FORMAT, TURN_RESPONSE_FORMAT, find_player, parse_turn, parse_vote
+from app.transcript import Transcript
+
+logger = logging.getLogger(__name__)
+
+# 全局客户端池：按 (apibase, apikey) 复用客户端和 HTTP 连接
+client_pool = ClientPool(max_size=Config.CLIENT_POOL_SIZE, ttl=Config.CLIENT_POOL_TTL)
+
+# 出站请求调度：按服务商的 RPM/TPM 限额放行，同一服务商的等待请求在各局之间轮转
+scheduler = Scheduler(
+    limits=parse_limits(Config.RATE_LIMITS),
+    default_rpm=Config.DEFAULT_RPM,
+    default_tpm=Config.DEFAULT_TPM,
+    burst_seconds=Config.RATE_LIMIT_BURST_SECONDS,
+    processes=Config.WORKER_PROCESSES
+)
+
+# 不支持结构化输出的 (apibase, 模型)，投票时直接使用文本协议
+_structured_unsupported = set()
+# 不接受 stream_options 的 (apibase, 模型)，流式发言时不再请求用量
+_stream_usage_unsupported = set()
+
+def _client_key(ai):
+    # 压测时可把所有AI统一指向模拟后端
+    if Config.API_BASE_OVERRIDE:
+        return Config.API_BASE_OVERRIDE, ai["apikey"]
+    # gpt 系列直接使用官方地址，其余按配置的 apibase 访问
+    if "gpt" in ai["name"].lower():
+        return None, ai["apikey"]
+    return ai["apibase"], ai["apikey"]
+
+def get_client(ai):
+    return client_pool.get(*_client_key(ai))
+
+def warm_clients():
+    """为注册表中的所有AI预先创建客户端，新启动的工作进程不必在第一局游戏里创建连接池"""
+    created = client_pool.warm(_client_key(ai) for ai in load_data(with_messages=False))
+    logger.info("[客户端池] 进程 %s 预热了 %d 个客户端", os.getpid(), created)
+    return created
+
+def provider_of(ai):
+    """AI 实际请求的服务商主机，用作指标标签"""
+    return host_of(_client_key(ai)[0])
+
+def breaker_of(ai):
+    """AI 实际请求的 apibase 对应的熔断器"""
+    return breaker_for(_client_key(ai)[0] or DEFAULT_HOST)
+
+def _retry_logger(timer, what, ai_name):
+    """重试前的回调：计入调用指标并记录日志"""
+    def on_retry(attempt, e, wait):
+        timer.retry()
+        logger.warning("AI %s %s出错，%.1f 秒后第%d次重试: %s", ai_name, what, wait, attempt + 1, e)
+    return on_retry
+
+def invalidate_client(ai):
+    """AI 的名称、key 或 apibase 变更/删除后调用，丢弃旧客户端"""
+    client_pool.invalidate(*_client_key(ai))
+
+def estimate_request_tokens(messages, max_tokens=None):
+    """请求占用的 token 估算（提示词 + 最多生成的 token 数），用于按 TPM 限流"""
+    prompt = sum(count_tokens(m.get("content") or "") + 4 for m in messages)
+    return prompt + (max_tokens or 0)
+
+def _schedule(ai, messages, max_tokens):
+    """按 AI 所在服务商的限额排队，返回放行的 Ticket"""
+    return scheduler.acquire(provider_of(ai), lambda: estimate_request_tokens(messages, max_tokens))
+
+def _chat(ai, client, ticket=None, **kwargs):
+    """所有 chat.completions 请求的出口：经调度器限流后发出
+
+    流式请求由调用方先取 ticket，读完后自行结算；其余请求在这里按响应中的用量结算，失败时退还预扣的 token。
+    """
+    own_ticket = ticket is None
+    if own_ticket:
+        ticket = _schedule(ai, kwargs["messages"], kwargs.get("max_tokens"))
+    completion = None
+    try:
+        completion = recording.create(client, ai["name"], **kwargs)
+    except RateLimitError as e:
+        # 限额配置比服务商实际的小时仍可能收到 429，暂停该服务商的放行
+        scheduler.pause(ticket.key, retry_after(e) or Config.LLM_BACKOFF_BASE)
+        raise
+    finally:
+        if own_ticket:
+            if completion is None:
+                scheduler.refund(ticket)
+            else:
+                scheduler.settle(ticket, getattr(completion, "usage", None))
+    return completion
+
+def format_conversation_history(ai, messages):
+    return Transcript(messages).render()
+
+def build_speak_messages(ai, message, transcript):
+    """构建发言请求的消息列表，普通调用与流式调用共用
+
+    为了命中服务商的前缀缓存，消息按“所有玩家、所有轮次都相同的内容在前”排列：
+    游戏提示词 -> 对话记录（同一轮内逐字节相同，跨轮只在末尾增长）-> 每个AI自己的指令。
+    游戏提示词取开局时固定在对话记录上的版本，中途修改提示词不会改变进行中的游戏的前缀。
+    """
+    # 每个AI自己的提示词，放在最后
+    player_prompt = f"""你是AI {ai['name']} (ID: {ai['id']})。
+你需要在不暴露自己AI身份的情况下与其他参与者交谈。
+记住：
+1. 表现得像个真实的人类
+2. {ai['name']}要表达情感
+5. 不要说太多话
+6. 回应要有互动性，要对其他人的发言有回应"""
+
+    conversation_history = transcript.render_for(ai['name'])
+    logger.debug("[call_api] 对话历史长度：%d", len(transcript))
+    
+    return [
+        {"role": "system", "content": transcript.prompt or load_prompt()},
+        {"role": "user", "content": conversation_history},
+        {"role": "user", "content": f"{player_prompt}\n\n当前情况: {message}"}
+    ]
+
+def get_usage_stats():
+    """按AI累计的 token 用量和前缀缓存命中率（由调用指标汇总）"""
+    return metrics.usage_summary()
+
+def remember_response(ai, ai_name, response):
+    """仅在需要时把回复追加到 ai['messages']"""
+    if "messages" not in ai:
+        ai["messages"] = []
+    if not ai["messages"] or ai["messages"][-1]["content"] != response:
+        ai["messages"].append({
+            "role": "assistant",
+            "ai_name": ai_name,
+            "content": response
+        })
+
+def complete_speech(ai, messages, ai_name=None, phase='speak', round_num=None):
+    """按 messages 请求一次发言并返回文本，不修改 ai；重试后仍失败时抛出异常"""
+    client = get_client(ai)
+    if ai_name is None:
+        ai_name = ai.get("name", "AI")
+    timer = CallTimer(ai, provider_of(ai), phase, round_num)
+    try:
+        completion = call_with_retry(
+            lambda: _chat(
+                ai, client,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=800,
+                timeout=Config.LLM_TIMEOUT
+            ),
+            breaker_of(ai),
+            on_retry=_retry_logger(timer, "调用API", ai_name)
+        )
+    except Exception:
+        timer.finish('error')
+        raise
+    response = completion.choices[0].message.content
+    timer.set_usage(getattr(completion, "usage", None))
+    timer.finish()
+    logger.debug("[call_api] API调用成功，响应长度：%d", len(response))
+    return response
+
+def call_api(ai, message, is_your_turn=False, transcript=None, ai_name=None, phase='speak', round_num=None):
+    # 合并初始化逻辑
+    if "messages" not in ai:
+        ai["messages"] = []
+    
+    if transcript is None:
+        transcript = Transcript()
+    if ai_name is None:
+        ai_name = ai.get("name", "AI")
+
+    messages = build_speak_messages(ai, message, transcript)
+    try:
+        response = complete_speech(ai, messages, ai_name, phase, round_num)
+    except Exception as e:
+        logger.error("AI %s 调用API出错: %s", ai['name'], e)
+        return f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。"
+
+    remember_response(ai, ai_name, response)
+    return response
+
+def call_api_stream(ai, message, transcript=None, ai_name=None, phase='speak', round_num=None):
+    """流式发言：逐段 yield 模型输出，结束后与 call_api 一样把完整回复写入 ai['messages']
+
+    只有在尚未输出任何内容时才会重试；中途断流则保留已输出的部分。
+    服务商不接受 stream_options（返回 400）时记住该模型，不带用量请求重新发起。
+    """
+    client = get_client(ai)
+    if transcript is None:
+        transcript = Transcript()
+    if ai_name is None:
+        ai_name = ai.get("name", "AI")
+
+    messages = build_speak_messages(ai, message, transcript)
+    timer = CallTimer(ai, provider_of(ai), phase, round_num)
+    breaker = breaker_of(ai)
+    policy = RetryPolicy.from_config()
+    on_retry = _retry_logger(timer, "流式调用API", ai_name)
+    started = time.monotonic()
+    parts = []
+    status = 'ok'
+    attempt = 0
+    provider_model = (_client_key(ai)[0], ai["name"])
+    if provider_model in _stream_usage_unsupported:
+        options = {}
+    else:
+        options = {"stream_options": {"include_usage": True}}
+    while True:
+        try:
+            logger.debug("[call_api_stream] AI %s 第%d次尝试流式调用API", ai_name, attempt + 1)
+            breaker.allow()
+            ticket = None
+            try:
+                ticket = _schedule(ai, messages, 800)
+                stream = _chat(
+                    ai, client,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=800,
+                    stream=True,
+                    timeout=Config.LLM_TIMEOUT,
+                    ticket=ticket,
+                    **options
+                )
+                for chunk in stream:
+                    timer.set_usage(getattr(chunk, "usage", None))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        timer.first_token()
+                        parts.append(delta)
+                        yield delta
+            except Exception as e:
+                breaker.record_failure(e)
+                if ticket is not None and not parts:
+                    # 没有任何输出的失败不占用额度；中途断流时已生成的部分仍按估算计
+                    scheduler.refund(ticket)
+                    ticket = None
+                raise
+            finally:
+                if ticket is not None:
+                    scheduler.settle(ticket, timer.usage)
+            breaker.record_success()
+            break
+        except Exception as e:
+            if isinstance(e, BadRequestError) and options and not parts:
+                _stream_usage_unsupported.add(provider_model)
+                logger.warning("AI %s 不支持 stream_options，改为不统计用量的流式请求: %s", ai_name, e)
+                options = {}
+                continue
+            if parts:
+                status = 'error'
+                logger.warning("AI %s 流式输出中途断开，保留已输出部分: %s", ai_name, e)
+                break
+            wait = None if breaker.is_open else policy.next_delay(attempt, e, started)
+            if wait is None:
+                status = 'error'
+                logger.error("AI %s 流式调用API出错: %s", ai['name'], e)
+                fallback = f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。"
+                parts.append(fallback)
+                yield fallback
+                break
+            on_retry(attempt, e, wait)
+            time.sleep(wait)
+            attempt += 1
+
+    timer.finish(status)
+    response = "".join(parts)
+    logger.debug("[call_api_stream] 流式调用结束，响应长度：%d", len(response))
+    remember_response(ai, ai_name, response)
+
+def run_concurrently(tasks, max_workers=4):
+    """并发执行一组无参任务，结果按 tasks 顺序返回；任务抛出的异常作为结果返回而不中断其他任务"""
+    submitted = time.perf_counter()
+
+    game_id = current_game()
+
+    def _safe(task):
+        # 记录任务在线程池中排队的时间，由任务内的第一次 LLM 调用计入指标
+        metrics.set_queue_wait(time.perf_counter() - submitted)
+        # 工作线程的请求仍算作提交任务的那一局，供调度器公平排队
+        set_game(game_id)
+        try:
+            return task()
+        except Exception as e:
+            return e
+        finally:
+            metrics.set_queue_wait(None)
+
+    if max_workers <= 1 or len(tasks) <= 1:
+        return [_safe(task) for task in tasks]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        return list(executor.map(_safe, tasks))
+
+def call_api_batch(jobs, max_workers=4):
+    """并发让多个AI发言
+
+    jobs 中每项为 dict: ai, message, transcript, ai_name，可选 phase、round（用于调用指标）。
+    返回与 jobs 顺序一致的回复列表，单个AI失败时返回系统提示而不影响其他AI。
+    """
+    tasks = [
+        (lambda job=job: call_api(
+            job["ai"],
+            job["message"],
+            is_your_turn=True,
+            transcript=job.get("transcript"),
+            ai_name=job.get("ai_name"),
+            phase=job.get("phase", "speak"),
+            round_num=job.get("round"),
+        ))
+        for job in jobs
+    ]
+    responses = []
+    for job, result in zip(jobs, run_concurrently(tasks, max_workers)):
+        if isinstance(result, Exception):
+            ai_name = job.get("ai_name") or job["ai"].get("name", "AI")
+            logger.error("AI %s 并发发言出错: %s", ai_name, result)
+            result = f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。"
+        responses.append(result)
+    return responses
+
+def summarize_round(ai, round_num, round_text, max_tokens=300):
+    """用指定AI为一轮发言生成摘要，失败时返回 None（调用方保留原文）"""
+    client = get_client(ai)
+    timer = CallTimer(ai, provider_of(ai), 'summary', round_num)
+    try:
+        completion = call_with_retry(
+            lambda: _chat(
+                ai, client,
+                messages=[
+                    {"role": "system", "content": "你是聊天记录整理员，只做客观概括，不加评论。"},
+                    {"role": "user", "content": f"请用不超过150字概括第{round_num}轮聊天中每位玩家的主要说法、立场和自称身份，保留玩家编号：\n{round_text}"}
+                ],
+                temperature=0.3,
+                max_tokens=max_tokens,
+                timeout=Config.LLM_TIMEOUT
+            ),
+            breaker_of(ai),
+            on_retry=_retry_logger(timer, "生成摘要", ai.get("name", "AI"))
+        )
+        timer.set_usage(getattr(completion, "usage", None))
+        timer.finish()
+        summary = completion.choices[0].message.content.strip()
+        logger.debug("[summarize_round] 第%s轮摘要完成，长度：%d", round_num, len(summary))
+        return summary or None
+    except Exception as e:
+        timer.finish('error')
+        logger.warning("第%s轮摘要生成失败，保留原文: %s", round_num, e)
+        return None
+
+def build_vote_prompt(ai, round_responses, round_number, player_map, structured=False):
+    """投票提示词：本轮其他玩家的发言 + 投票要求；structured 时要求只输出 JSON"""
+    vote_prompt = f"""基于所有玩家的发言，你需要决定投票给谁。
+当前是第 {round_number} 轮投票。
+以下是本轮所有玩家的发言：
+
+"""
+    for resp in round_responses:
+        if resp["ai_id"] != ai["id"]:  # 不包含自己的发言
+            vote_prompt += f"{resp['name']}说：{resp['response']}\n"
+    
+    vote_prompt += f"\n你是{player_map[ai['id']]}，请分析每个玩家的发言特点，并决定投票对象。"
+    vote_prompt += "\n要考虑：\n1. 发言是否自然\n2. 是否有明显的机器人特征\n3. 是否过于完美或机械化\n4. 情感表达是否真实"
+    vote_prompt += "\n特别说明：如果你认为没有明显可疑的对象，或者多个玩家同样可疑导致难以抉择，你可以选择弃权。"
+    if structured:
+        vote_prompt += '\n请直接回复你要投票的玩家编号，不要输出分析过程，只输出 JSON，如 {"target": 2}；弃权时 target 为 0。'
+    else:
+        vote_prompt += "\n请直接回复你要投票的玩家编号（如：2），如果你选择弃权请回复0。"
+    return vote_prompt
+
+def resolve_vote(ai, target, player_map, activeAIs, eliminated_ids):
+    """校验解析出的玩家编号，返回投票的玩家编号字符串，无效、投给自己或已淘汰玩家时返回 '0'（弃权）"""
+    voter = player_map[ai['id']]
+    if target is None:
+        logger.info("[投票阶段] AI %s 未提供有效投票，自动转为弃权", voter)
+        return '0'
+    if target == 0:
+        logger.info("[投票阶段] AI %s 选择弃权", voter)
+        return '0'
+    target_ai_id = find_player(player_map, target, activeAIs)
+    if not target_ai_id:
+        logger.info("[投票阶段] AI %s 投票无效，自动转为弃权", voter)
+        return '0'
+    if target_ai_id == ai['id']:
+        logger.info("[投票阶段] AI %s 试图投票给自己，自动转为弃权", voter)
+        return '0'
+    if target_ai_id in eliminated_ids:
+        logger.info("[投票阶段] AI %s 试图投票给已淘汰玩家，自动转为弃权", voter)
+        return '0'
+    logger.info("[投票阶段] AI %s 投票给了 %s", voter, player_map[target_ai_id])
+    return str(target)
+
+def _use_structured_output(ai):
+    """投票/合并模式是否请求结构化输出"""
+    return Config.VOTE_MODE == 'structured' and (_client_key(ai)[0], ai["name"]) not in _structured_unsupported
+
+def call_vote_api(ai, round_responses, round_number, player_map, activeAIs, eliminated_ids):
+    """AI投票接口
+
+    结构化模式（VOTE_MODE=structured）下要求模型按 JSON Schema 只返回玩家编号，max_tokens 很小；
+    服务商不支持 response_format（返回 400）时记住该模型，改用文本协议重新请求。
+    """
+    voter = player_map[ai['id']]
+    logger.debug("[投票阶段] AI %s 开始分析投票", voter)
+    client = get_client(ai)
+    timer = CallTimer(ai, provider_of(ai), 'vote', round_number)
+    structured = _use_structured_output(ai)
+    while True:
+        vote_prompt = build_vote_prompt(ai, round_responses, round_number, player_map, structured)
+        messages = [
+            {"role": "system", "content": "你需要分析并决定投票给哪个玩家。记住，如果没有明显可疑的对象或出现多个同样可疑的对象，你可以选择弃权。"},
+            {"role": "user", "content": vote_prompt}
+        ]
+        if structured:
+            options = {"response_format": RESPONSE_FORMAT, "max_tokens": Config.VOTE_MAX_TOKENS}
+        else:
+            options = {"max_tokens": 800}
+        try:
+            completion = call_with_retry(
+                lambda: _chat(
+                    ai, client,
+                    messages=messages,
+                    temperature=0.7,
+                    timeout=Config.LLM_TIMEOUT,
+                    **options
+                ),
+                breaker_of(ai),
+                on_retry=_retry_logger(timer, "投票API调用", voter)
+            )
+        except BadRequestError as e:
+            if not structured:
+                timer.finish('error')
+                logger.error("AI %s 投票API调用失败: %s", voter, e)
+                return '0'
+            _structured_unsupported.add((_client_key(ai)[0], ai["name"]))
+            logger.warning("AI %s 不支持结构化投票，改用文本协议: %s", voter, e)
+            structured = False
+            continue
+        except Exception as e:
+            timer.finish('error')
+            logger.error("AI %s 投票API调用失败: %s", voter, e)
+            return '0'  # 如果多次重试失败，返回弃权
+        break
+
+    timer.set_usage(getattr(completion, "usage", None))
+    timer.finish()
+    vote_content = (completion.choices[0].message.content or "").strip()
+    logger.debug("[投票阶段] AI %s 投票分析结果：%s", voter, vote_content)
+
+    target, strict = parse_vote(vote_content)
+    if structured and not strict:
+        logger.debug("[投票阶段] AI %s 未按 JSON 格式回复，按文本解析", voter)
+    return resolve_vote(ai, target, player_map, activeAIs, eliminated_ids)
+
+def call_turn_api(ai, message, transcript, round_num, player_map, activeAIs, eliminated_ids):
+    """合并模式：一次调用同时生成本轮发言和对之前各轮发言的投票，返回 (发言, 投票的玩家编号字符串)
+
+    请求与普通发言共用 build_speak_messages 的前缀，只在最后一条消息中加上输出格式要求。
+    不修改 ai；调用失败时返回系统提示并弃权。服务商不支持 response_format 时与投票一样退回不带格式约束的请求。
+    """
+    ai_name = player_map[ai['id']]
+    messages = build_speak_messages(ai, message, transcript)
+    messages[-1] = {
+        "role": "user",
+        "content": messages[-1]["content"] + (
+            f"\n\n同时根据之前各轮的发言，投票选出你认为最可能是AI的玩家（你是{ai_name}，不能投自己）。"
+            '请只输出 JSON：{"speech": 你的公开发言, "vote": 玩家编号}，没有明显可疑的对象时 vote 为 0。'
+        )
+    }
+    client = get_client(ai)
+    timer = CallTimer(ai, provider_of(ai), 'turn', round_num)
+    structured = _use_structured_output(ai)
+    while True:
+        options = {"response_format": TURN_RESPONSE_FORMAT} if structured else {}
+        try:
+            completion = call_with_retry(
+                lambda: _chat(
+                    ai, client,
+                    messages=messages,
+                    temperature=0.7,
+                    max_tokens=800,
+                    timeout=Config.LLM_TIMEOUT,
+                    **options
+                ),
+                breaker_of(ai),
+                on_retry=_retry_logger(timer, "调用API", ai_name)
+            )
+        except BadRequestError as e:
+            if structured:
+                _structured_unsupported.add((_client_key(ai)[0], ai["name"]))
+                logger.warning("AI %s 不支持结构化输出，改用不带格式约束的请求: %s", ai_name, e)
+                structured = False
+                continue
+            timer.finish('error')
+            logger.error("AI %s 调用API出错: %s", ai_name, e)
+            return f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。", '0'
+        except Exception as e:
+            timer.finish('error')
+            logger.error("AI %s 调用API出错: %s", ai_name, e)
+            return f"[系统] AI {ai_name} 暂时无法回应，请稍后再试。", '0'
+        break
+
+    timer.set_usage(getattr(completion, "usage", None))
+    timer.finish()
+    speech, target = parse_turn(completion.choices[0].message.content)
+    logger.debug("[合并模式] AI %s 发言长度：%d，投票：%s", ai_name, len(speech), target)
+    return speech, resolve_vote(ai, target, player_map, activeAIs, eliminated_ids)
@@ -0,0 +1,228 @@
+"""多局游戏的会话管理
+
+进行中的游戏常驻内存，每局一把锁，同一局的请求串行执行、不同局互不影响。
+事件仍同步追加到各局自己的日志（games/<game_id>/），完整快照由后台线程定期写入；
+已结束的游戏空闲一段时间后写快照并移出内存，需要时再从磁盘加载。
+
+多进程部署时每个进程各有一份内存中的会话：会话锁同时是跨进程的文件锁（games/<game_id>/game.lock），
+拿到锁后先检查其他进程是否写过这局、写过则重新加载；不持有锁的读取方也会在取会话时按需刷新。
+"""
+import copy
+import logging
+import os
+import threading
+import time
+import uuid
+
+from app.files import FileLock, atomic_write
+from app.game_log import GameLog
+from app.prefetch import SpeechPrefetcher
+
+logger = logging.getLogger(__name__)
+
+
+class GameSession:
+    def __init__(self, game_id, log, state):
+        self.game_id = game_id
+        self.log = log
+        self.state = state
+        # 同一局的请求（包括其他进程的）串行执行
+        self.lock = FileLock(os.path.join(os.path.dirname(log.snapshot_file), 'game.lock'), on_acquire=self.sync)
+        # 本局的对话记录缓存（见 app.transcript）
+        self.transcript = None
+        # 分步发言的预取（见 app.prefetch）
+        self.prefetcher = SpeechPrefetcher()
+        self.last_access = time.monotonic()
+
+    def touch(self):
+        self.last_access = time.monotonic()
+
+    def sync(self):
+        """其他进程写过这局时重新加载状态（原地更新 state），并丢弃基于旧状态的缓存"""
+        if self.log.refresh(self.state):
+            self.transcript = None
+            self.prefetcher.discard()
+            return True
+        return False
+
+    def read_state(self):
+        """返回状态的副本；只与事件写入短暂互斥，不必等待持有会话锁的长请求"""
+        with self.log.lock:
+            return copy.deepcopy(self.state)
+
+    @property
+    def etag(self):
+        """状态版本：同一局的每个事件都会改变 seq，不必复制或序列化状态即可判断是否有变化"""
+        return f'{self.game_id}-{self.state.get("seq", 0)}'
+
+    @property
+    def finished(self):
+        return bool(self.state.get('winner'))
+
+    @property
+    def dirty(self):
+        return self.state.get('seq', 0) > self.state.get('snapshot_seq', 0)
+
+
+class SessionManager:
+    def __init__(self, base_dir, snapshot_every=None, persist_interval=5, finished_ttl=300, idle_ttl=3600,
+                 recent_events=500):
+        self.base_dir = base_dir
+        self.snapshot_every = snapshot_every
+        self.recent_events = recent_events
+        self.persist_interval = persist_interval
+        self.finished_ttl = finished_ttl
+        self.idle_ttl = idle_ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._latest_id = None
+        self._worker = None
+
+    def _log_for(self, game_id):
+        game_dir = os.path.join(self.base_dir, game_id)
+        os.makedirs(game_dir, exist_ok=True)
+        return GameLog(
+            os.path.join(game_dir, 'game_state.json'),
+            os.path.join(game_dir, 'game_events.jsonl'),
+            snapshot_every=self.snapshot_every,
+            recent_events=self.recent_events
+        )
+
+    def create(self, state):
+        """为新游戏分配 game_id，写入初始快照并放入内存"""
+        self._ensure_worker()
+        game_id = state.get('game_id') or str(uuid.uuid4())
+        state['game_id'] = game_id
+        log = self._log_for(game_id)
+        log.reset(state)
+        session = GameSession(game_id, log, state)
+        with self._lock:
+            self._sessions[game_id] = session
+            self._latest_id = game_id
+        # 其他进程据此找到最近开始的一局
+        atomic_write(os.path.join(self.base_dir, 'latest'), game_id, durable=False)
+        return session
+
+    def get(self, game_id=None):
+        """按 game_id 取会话，未指定时取最近开始的一局；不在内存中时从磁盘加载"""
+        self._ensure_worker()
+        with self._lock:
+            if game_id is None:
+                game_id = self._read_latest() or self._latest_id or self._latest_on_disk()
+            if game_id is None or not self._valid_id(game_id):
+                return None
+            session = self._sessions.get(game_id)
+            if session is None:
+                if not os.path.isdir(os.path.join(self.base_dir, game_id)):
+                    return None
+                log = self._log_for(game_id)
+                state = log.load()
+                if state is None:
+                    return None
+                session = self._sessions[game_id] = GameSession(game_id, log, state)
+            session.touch()
+        self.refresh(session)
+        return session
+
+    def refresh(self, session):
+        """读取方取会话时调用：本进程没有请求占用这局时，按需加载其他进程的写入"""
+        if not session.lock.held:
+            session.sync()
+
+    def record(self, state, event_type, **payload):
+        """把事件追加到 state 所属游戏的日志"""
+        session = self.get(state['game_id'])
+        return session.log.append(state, event_type, **payload)
+
+    def persist(self, session):
+        """写入完整快照；会话正被请求占用时跳过，等下一次"""
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            if session.dirty:
+                session.log.snapshot(session.state)
+            return True
+        finally:
+            session.lock.release()
+
+    def persist_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            self.persist(session)
+
+    def evict(self):
+        """把空闲的已结束游戏（以及长时间无人访问的游戏）写盘后移出内存"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                s for s in self._sessions.values()
+                if now - s.last_access > (self.finished_ttl if s.finished else self.idle_ttl)
+            ]
+        for session in candidates:
+            ttl = self.finished_ttl if session.finished else self.idle_ttl
+            if self.persist(session):
+                with self._lock:
+                    # 写盘期间可能又被访问过，再确认一次
+                    idle = time.monotonic() - session.last_access > ttl
+                    if idle and self._sessions.get(session.game_id) is session:
+                        del self._sessions[session.game_id]
+                        session.prefetcher.discard()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active_games": len(self._sessions),
+                "finished_games": sum(1 for s in self._sessions.values() if s.finished),
+                "latest_game_id": self._latest_id,
+            }
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run, name='game-session-persist', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.persist_interval)
+            try:
+                self.persist_all()
+                self.evict()
+            except Exception as e:
+                logger.info("[会话管理] 后台持久化出错: %s", e)
+
+    def reset_after_fork(self):
+        """fork 出的子进程中调用：丢弃继承来的会话和后台线程，之后按需从磁盘加载"""
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._latest_id = None
+        self._worker = None
+
+    def _read_latest(self):
+        try:
+            with open(os.path.join(self.base_dir, 'latest'), 'r', encoding='utf-8') as f:
+                game_id = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return game_id if self._valid_id(game_id) else None
+
+    def _latest_on_disk(self):
+        if not os.path.isdir(self.base_dir):
+            return None
+        game_dirs = [
+            os.path.join(self.base_dir, name) for name in os.listdir(self.base_dir)
+            if self._valid_id(name) and os.path.isdir(os.path.join(self.base_dir, name))
+        ]
+        if not game_dirs:
+            return None
+        return os.path.basename(max(game_dirs, key=os.path.getmtime))
+
+    @staticmethod
+    def _valid_id(game_id):
+        # game_id 会拼进文件路径，只接受 uuid
+        try:
+            return str(uuid.UUID(game_id)) == game_id
+        except (ValueError, TypeError, AttributeError):
+            return False
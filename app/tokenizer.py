@@ -0,0 +1,31 @@
+"""按模型估算文本的 token 数
+
+安装了 tiktoken 时使用对应模型的编码，否则按字符粗略估算（中文约 1 字 1 token，其余约 4 字符 1 token）。
+"""
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 是可选依赖
+    tiktoken = None
+
+
+@lru_cache(maxsize=64)
+def _encoding_for(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _estimate(text):
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿' or '　' <= ch <= '〿' or '＀' <= ch <= '￯')
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def count_tokens(text, model=None):
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding_for(model or "gpt-4o").encode(text))
+    return _estimate(text)
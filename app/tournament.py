@@ -0,0 +1,239 @@
+"""无界面的锦标赛
+
+不经过 Flask，直接用 app.engine 的游戏规则在进程池中并行进行大量对局，
+按轮换的阵容从 AI 注册表中选人，最后输出每个AI的胜率、Elo 评分以及积分。
+
+用法：
+    python -m app.tournament --games 1000 --players 4 --workers 8
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from app import configure_logging, metrics, recording, services
+from app.config import Config
+from app.engine import GAME_MODES, play_game, winners_of
+from app.models import load_data, update_score
+
+DEFAULT_RATING = 1500
+ELO_K = 32
+# 阵容组合数超过该值时改为随机抽样，不再完整枚举
+MAX_ENUMERATED_LINEUPS = 10000
+
+
+def rotate_lineups(ais, size, games, seed=None):
+    """生成 games 个阵容，每个阵容 size 个AI
+
+    依次轮换所有组合，每轮完一遍后整体换一个座次（玩家编号）偏移，使每个AI在各个位置上出场次数接近。
+    """
+    if size > len(ais):
+        raise ValueError(f"每局需要 {size} 个AI，注册表中只有 {len(ais)} 个")
+    rng = random.Random(seed)
+    combos = []
+    if math.comb(len(ais), size) <= MAX_ENUMERATED_LINEUPS:
+        combos = list(itertools.combinations(ais, size))
+        rng.shuffle(combos)
+    lineups = []
+    for i in range(games):
+        if combos:
+            lineup = list(combos[i % len(combos)])
+            shift = (i // len(combos)) % size
+        else:
+            lineup = rng.sample(ais, size)
+            shift = 0
+        lineups.append(lineup[shift:] + lineup[:shift])
+    return lineups
+
+
+def expected_score(rating, opponent):
+    return 1 / (1 + 10 ** ((opponent - rating) / 400))
+
+
+def update_elo(ratings, lineup_ids, winner_ids, k=ELO_K):
+    """按一局的结果更新 Elo 评分
+
+    多人对局拆成两两对决：胜者对非胜者记 1 分，同为胜者或同为非胜者记 0.5 分（没有胜者时全部为平局）。
+    每个AI的变化量除以对手数，避免人数越多评分波动越大。
+    """
+    if len(lineup_ids) < 2:
+        return
+    winners = set(winner_ids)
+    k_pair = k / (len(lineup_ids) - 1)
+    deltas = {ai_id: 0.0 for ai_id in lineup_ids}
+    for a, b in itertools.combinations(lineup_ids, 2):
+        ra = ratings.get(a, DEFAULT_RATING)
+        rb = ratings.get(b, DEFAULT_RATING)
+        if (a in winners) == (b in winners):
+            score_a = 0.5
+        else:
+            score_a = 1.0 if a in winners else 0.0
+        change = k_pair * (score_a - expected_score(ra, rb))
+        deltas[a] += change
+        deltas[b] -= change
+    for ai_id, delta in deltas.items():
+        ratings[ai_id] = ratings.get(ai_id, DEFAULT_RATING) + delta
+
+
+def _init_worker(verbose, recording_settings, processes):
+    # 对局过程中的日志量很大，默认只保留警告和错误
+    configure_logging('INFO' if verbose else 'WARNING')
+    # 工作进程按主进程的方式录制或回放 LLM 请求
+    recording.configure(**recording_settings)
+    # 出站限额在各工作进程间平分，所有工作进程合计不超过主进程的份额
+    services.scheduler.set_processes(processes)
+
+
+def _play(job):
+    index, lineup, options = job
+    started = time.monotonic()
+    try:
+        state, score_deltas = play_game(lineup, **options)
+    except Exception as e:
+        return {"index": index, "lineup": [ai['id'] for ai in lineup], "error": str(e)}
+    finally:
+        # 工作进程随时可能随进程池结束，每局结束时写入本进程的指标（只在多进程部署时生效）
+        metrics.flush()
+    return {
+        "index": index,
+        "game_id": state['game_id'],
+        "lineup": [ai['id'] for ai in lineup],
+        "winners": winners_of(state),
+        "rounds": state['round'],
+        "score_deltas": score_deltas,
+        "seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def run_tournament(ais, games, players, workers=4, max_rounds=20, speak_workers=4, seed=None,
+                   verbose=False, progress=None, mode=Config.GAME_MODE, cancelled=None):
+    """并行进行 games 局，返回 (汇总, 每局结果)；结果按对局编号顺序累计 Elo，保证可复现
+
+    cancelled() 返回 True 时不再开始新的对局，等已在进行的对局结束后按取消前完成的结果汇总。
+    出站限额（RATE_LIMITS 等）按进程平分：本进程的份额再平分给各工作进程。
+    """
+    options = {"max_rounds": max_rounds, "max_workers": speak_workers, "mode": mode}
+    if Config.HISTORY_COMPACTION:
+        options["budget"] = Config.HISTORY_TOKEN_BUDGET
+        options["keep_rounds"] = Config.HISTORY_KEEP_ROUNDS
+    lineups = rotate_lineups(ais, players, games, seed)
+    jobs = [(i, lineup, options) for i, lineup in enumerate(lineups)]
+
+    stats = {ai['id']: {"name": ai['name'], "games": 0, "wins": 0, "score_delta": 0} for ai in ais}
+    ratings = {}
+    results = []
+    workers = max(1, min(workers, games))
+    processes = services.scheduler.processes * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(verbose, recording.settings(), processes)) as executor:
+        # 可取消时逐局分发，取消后只需等待已在进行的对局
+        chunksize = 1 if cancelled is not None else max(1, games // (workers * 8))
+        for result in executor.map(_play, jobs, chunksize=chunksize):
+            results.append(result)
+            if progress:
+                progress(len(results), games, result)
+            if not result.get('error'):
+                for ai_id in result['lineup']:
+                    stats[ai_id]['games'] += 1
+                for ai_id in result['winners']:
+                    stats[ai_id]['wins'] += 1
+                for ai_id, delta in result['score_deltas'].items():
+                    stats[ai_id]['score_delta'] += delta
+                update_elo(ratings, result['lineup'], result['winners'])
+            if cancelled is not None and cancelled():
+                executor.shutdown(wait=True, cancel_futures=True)
+                break
+
+    summary = []
+    for ai in ais:
+        entry = stats[ai['id']]
+        summary.append({
+            "id": ai['id'],
+            "name": entry['name'],
+            "games": entry['games'],
+            "wins": entry['wins'],
+            "win_rate": round(entry['wins'] / entry['games'], 4) if entry['games'] else 0.0,
+            "elo": round(ratings.get(ai['id'], DEFAULT_RATING), 1),
+            "score": ai.get('score', 0),
+            "score_delta": entry['score_delta'],
+        })
+    summary.sort(key=lambda e: e['elo'], reverse=True)
+    return summary, results
+
+
+def format_summary(summary):
+    lines = [f"{'名称':<24}{'对局':>6}{'胜场':>6}{'胜率':>8}{'Elo':>8}{'积分':>6}{'积分变化':>8}"]
+    for e in summary:
+        lines.append(
+            f"{e['name']:<24}{e['games']:>6}{e['wins']:>6}{e['win_rate']:>8.1%}{e['elo']:>8.1f}{e['score']:>6}{e['score_delta']:>+8}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="无界面并行锦标赛：统计各AI的胜率与 Elo 评分")
+    parser.add_argument('--games', type=int, default=100, help='对局数')
+    parser.add_argument('--players', type=int, default=4, help='每局人数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='并行进程数')
+    parser.add_argument('--speak-workers', type=int, default=Config.SPEAK_CONCURRENCY, help='每局内并发发言/投票的线程数')
+    parser.add_argument('--max-rounds', type=int, default=20, help='单局最多轮数，超过则记为平局')
+    parser.add_argument('--ai', action='append', help='只使用指定名称的AI（可重复）')
+    parser.add_argument('--seed', type=int, help='阵容轮换的随机种子')
+    parser.add_argument('--mode', choices=GAME_MODES, default=Config.GAME_MODE,
+                        help='游戏模式：classic 发言和投票分开调用，fused 每个AI每轮只调用一次')
+    parser.add_argument('--output', help='把汇总和每局结果写入该 JSON 文件')
+    parser.add_argument('--apply-scores', action='store_true', help='把积分变化写回 AI 注册表')
+    parser.add_argument('--verbose', action='store_true', help='输出对局过程中的日志')
+    parser.add_argument('--record', metavar='FILE', help='把所有LLM请求与回复录制到该文件')
+    parser.add_argument('--replay', metavar='FILE', help='不访问网络，从录制文件回放LLM回复（需与录制时使用相同的 --seed）')
+    parser.add_argument('--replay-latency', type=float, default=Config.LLM_REPLAY_LATENCY,
+                        help='回放时按原耗时的多少倍等待，0 为不等待')
+    args = parser.parse_args(argv)
+    if args.record or args.replay:
+        recording.configure(record_file=args.record, replay_file=args.replay, latency=args.replay_latency)
+
+    ais = load_data(with_messages=False)
+    if args.ai:
+        ais = [ai for ai in ais if ai['name'] in args.ai]
+    if len(ais) < max(2, args.players):
+        parser.error(f"每局需要 {max(2, args.players)} 个AI，可用的只有 {len(ais)} 个")
+
+    def progress(done, total, result):
+        if result.get('error'):
+            print(f"[锦标赛] 第{result['index']}局出错: {result['error']}", file=sys.stderr)
+        if done % max(1, total // 20) == 0 or done == total:
+            print(f"[锦标赛] 已完成 {done}/{total} 局", file=sys.stderr)
+
+    started = time.monotonic()
+    summary, results = run_tournament(
+        ais, args.games, args.players,
+        workers=args.workers,
+        max_rounds=args.max_rounds,
+        speak_workers=args.speak_workers,
+        seed=args.seed,
+        verbose=args.verbose,
+        mode=args.mode,
+        progress=progress
+    )
+    print(format_summary(summary))
+    print(f"\n共 {len(results)} 局，出错 {sum(1 for r in results if r.get('error'))} 局，用时 {time.monotonic() - started:.1f} 秒")
+    if recording.active is not None:
+        print(f"[锦标赛] LLM请求{'回放' if args.replay else '录制'}文件：{args.replay or args.record}")
+
+    if args.apply_scores:
+        for e in summary:
+            if e['score_delta']:
+                update_score(e['id'], e['score_delta'])
+        print("[锦标赛] 积分变化已写回注册表")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"summary": summary, "games": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""一局游戏的对话记录
+
+每条发言只追加一次，渲染好的文本作为前缀缓存下来，后续调用只渲染新增部分。
+同一轮里所有AI共用同一份渲染结果。
+
+开启压缩（设置 budget）后，超出 token 预算时只保留最近 keep_rounds 轮原文，
+更早的轮次用缓存在游戏状态里的摘要代替。
+"""
+import threading
+
+from app.tokenizer import count_tokens
+
+HEADER = "对话历史：\n"
+SUMMARY_HEADER = "前情提要（较早轮次的摘要）：\n"
+
+
+def format_line(ai_name, content, role="assistant"):
+    if role == "user":
+        return f"系统: {content}\n"
+    return f"{ai_name}: {content}\n"
+
+
+class Transcript:
+    def __init__(self, messages=None, budget=None, keep_rounds=2, prompt=None):
+        # 本局的游戏提示词（请求前缀的第一段），为 None 时使用当前保存的提示词
+        self.prompt = prompt
+        self._lines = []
+        # 每行所属的轮次（不按轮次追加的消息为 None）
+        self._line_rounds = []
+        # 轮次 -> 该轮的行，按出现顺序
+        self._round_lines = {}
+        self._rendered = HEADER
+        self._rendered_count = 0
+        # 已并入的最后一个完整轮次
+        self.synced_round = -1
+        # 压缩配置：budget 为 None 时不压缩
+        self.budget = budget
+        self.keep_rounds = keep_rounds
+        self.summaries = {}
+        self._token_counts = {}
+        self._compact_cache = {}
+        self._lock = threading.Lock()
+        if messages:
+            for msg in messages:
+                self.append(msg.get("ai_name"), msg["content"], role=msg.get("role", "assistant"))
+
+    def __len__(self):
+        return len(self._lines)
+
+    def append(self, ai_name, content, role="assistant", round_num=None):
+        with self._lock:
+            line = format_line(ai_name, content, role)
+            self._lines.append(line)
+            self._line_rounds.append(round_num)
+            self._round_lines.setdefault(round_num, []).append(line)
+
+    def sync(self, history, before_round):
+        """把 history 中 before_round 之前、尚未并入的轮次按顺序追加进来"""
+        for round_obj in history:
+            round_num = round_obj['round']
+            if self.synced_round < round_num < before_round:
+                for resp in round_obj.get('responses', []):
+                    self.append(resp['name'], resp['response'], round_num=round_num)
+        self.synced_round = max(self.synced_round, before_round - 1)
+
+    def render(self):
+        """返回完整的对话历史文本，只拼接上次渲染之后新增的行"""
+        with self._lock:
+            if self._rendered_count < len(self._lines):
+                self._rendered += "".join(self._lines[self._rendered_count:])
+                self._rendered_count = len(self._lines)
+            return self._rendered
+
+    def rounds(self):
+        """已记录的轮次（按出现顺序）"""
+        with self._lock:
+            return [r for r in self._round_lines if r is not None]
+
+    def rounds_to_summarize(self):
+        """超出预算时需要用摘要代替的轮次（最近 keep_rounds 轮之前的所有轮次）"""
+        rounds = self.rounds()
+        if self.keep_rounds <= 0:
+            return rounds
+        return rounds[:-self.keep_rounds]
+
+    def round_text(self, round_num):
+        with self._lock:
+            return "".join(self._round_lines.get(round_num, []))
+
+    def token_count(self, model=None):
+        """按模型统计全文 token 数，每一轮只统计一次"""
+        with self._lock:
+            total = count_tokens(HEADER, model)
+            for round_num, lines in self._round_lines.items():
+                key = (model, round_num, len(lines))
+                if key not in self._token_counts:
+                    self._token_counts[key] = count_tokens("".join(lines), model)
+                total += self._token_counts[key]
+            return total
+
+    def needs_compaction(self, model=None):
+        return self.budget is not None and self.token_count(model) > self.budget
+
+    def render_for(self, model=None):
+        """按模型渲染：未超出预算时与 render() 相同，否则把较早轮次替换为摘要"""
+        if not self.needs_compaction(model):
+            return self.render()
+        old_rounds = self.rounds_to_summarize()
+        summarized = tuple(r for r in old_rounds if str(r) in self.summaries)
+        key = (summarized, len(self._lines))
+        with self._lock:
+            cached = self._compact_cache.get(key)
+            if cached is not None:
+                return cached
+            parts = [HEADER]
+            if summarized:
+                parts.append(SUMMARY_HEADER)
+                for round_num in summarized:
+                    parts.append(f"第{round_num}轮: {self.summaries[str(round_num)]}\n")
+                parts.append("近期发言：\n")
+            for line, round_num in zip(self._lines, self._line_rounds):
+                if round_num not in summarized:
+                    parts.append(line)
+            text = "".join(parts)
+            self._compact_cache = {key: text}
+            return text
@@ -0,0 +1,118 @@
+"""投票协议：请求格式与回复解析
+
+结构化模式下模型只需返回 {"target": 玩家编号}（0 表示弃权），请求带 JSON Schema 和很小的 max_tokens；
+解析时先按 JSON 严格解析，模型没有按格式回复时才退回到取最后一个数字。
+合并模式（发言与投票合为一次调用）的回复格式为 {"speech": 发言, "vote": 玩家编号}。
+玩家编号按完整数字匹配（玩家10 不会被当成 玩家1 或 玩家0）。
+"""
+import json
+import re
+
+VOTE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "target": {"type": "integer", "description": "投票对象的玩家编号，弃权为0"}
+    },
+    "required": ["target"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "vote", "strict": True, "schema": VOTE_SCHEMA},
+}
+
+# 合并模式：一次调用同时返回公开发言和投票
+TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "speech": {"type": "string", "description": "本轮的公开发言"},
+        "vote": {"type": "integer", "description": "根据之前各轮发言投票的玩家编号，弃权为0"}
+    },
+    "required": ["speech", "vote"],
+    "additionalProperties": False,
+}
+
+TURN_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "turn", "strict": True, "schema": TURN_SCHEMA},
+}
+
+_PLAYER_NUM = re.compile(r'(\d+)$')
+_LAST_NUMBER = re.compile(r'(\d+)(?=[^\d]*$)')
+_JSON_OBJECT = re.compile(r'\{[^{}]*\}')
+_NOT_JSON = object()
+
+
+def player_number(player_name):
+    """'玩家10' -> 10，没有编号时返回 None"""
+    match = _PLAYER_NUM.search(str(player_name))
+    return int(match.group(1)) if match else None
+
+
+def find_player(player_map, num, candidates=None):
+    """按玩家编号找 AI id（只在 candidates 中找），找不到返回 None"""
+    try:
+        num = int(num)
+    except (TypeError, ValueError):
+        return None
+    for ai_id, name in player_map.items():
+        if player_number(name) == num and (candidates is None or ai_id in candidates):
+            return ai_id
+    return None
+
+
+def _target_of(value):
+    if isinstance(value, dict):
+        value = value.get('target')
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if value >= 0 else None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        return player_number(value) if value.startswith('玩家') else None
+    return None
+
+
+def _load_json(content):
+    """按 JSON 读取回复（也接受被代码块包裹的 JSON 对象），不是 JSON 时返回 _NOT_JSON"""
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+    match = _JSON_OBJECT.search(content)
+    if match:
+        try:
+            return json.loads(match.group(0))
+        except ValueError:
+            pass
+    return _NOT_JSON
+
+
+def parse_vote(content):
+    """解析投票回复，返回 (玩家编号, 是否按 JSON 解析)；无法解析时编号为 None
+
+    回复是 JSON 时严格按 {"target": n} 解析（也接受单独的数字），格式不对即视为无效；
+    不是 JSON 时退回旧的文本协议，只取结尾的数字。
+    """
+    content = (content or '').strip()
+    value = _load_json(content)
+    if value is not _NOT_JSON:
+        return _target_of(value), True
+    match = _LAST_NUMBER.search(content)
+    return (int(match.group(1)) if match else None), False
+
+
+def parse_turn(content):
+    """解析合并模式的回复，返回 (发言, 玩家编号)
+
+    回复是 {"speech": ..., "vote": n} 时分别取出；不是 JSON 时整段作为发言，投票视为无效（编号为 None）。
+    """
+    content = (content or '').strip()
+    value = _load_json(content)
+    if isinstance(value, dict) and isinstance(value.get('speech'), str):
+        return value['speech'].strip(), _target_of(value.get('vote'))
+    return content, None
@@ -0,0 +1,9 @@
+"""游戏流程与存储热路径的基准测试
+
+用法：
+    python -m benchmarks.run --output bench_results.json
+    python -m benchmarks.run --quick --compare bench_results.json
+    python -m benchmarks.compare old.json new.json --threshold 0.2
+
+所有测试都在临时数据目录中进行，LLM 调用指向进程内启动的模拟后端（app.mock_backend），不会访问真实服务商。
+"""
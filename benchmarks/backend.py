@@ -0,0 +1,50 @@
+"""基准测试的运行环境：进程内的模拟 LLM 后端与测试用的 AI 注册表"""
+import threading
+
+from werkzeug.serving import make_server
+
+from app.mock_backend import create_mock_app
+
+# 默认不加延迟，只测量本项目代码与 HTTP 客户端本身的开销
+ZERO_LATENCY = {
+    "latency": 0,
+    "ttft": 0,
+    "token_latency": 0,
+    "completion_tokens": "uniform:40,80",
+    # 投票全部弃权，游戏不会结束，便于测量后期轮次
+    "abstain_rate": 1.0,
+}
+
+
+class MockBackend:
+    """在后台线程中运行 app.mock_backend，监听随机端口"""
+
+    def __init__(self, profile=None, seed=0):
+        app = create_mock_app({"default": {**ZERO_LATENCY, **(profile or {})}}, seed=seed)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='mock-backend', daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def apibase(self, name):
+        # 注册表要求 apibase 唯一，用路径前缀区分（前缀对应的配置不存在时使用 default）
+        return f"{self.base_url}/{name}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+
+def register_ais(client, backend, count):
+    """通过 /add_ai 注册 count 个指向模拟后端的AI（先删除已有的AI）"""
+    for ai in client.get('/get_data?fields=id').json:
+        client.delete(f"/delete_ai/{ai['id']}")
+    for i in range(count):
+        name = f"bench-{i}"
+        response = client.post('/add_ai', json={"name": name, "apikey": f"key-{i}", "apibase": backend.apibase(name)})
+        assert response.status_code == 200, response.json
@@ -0,0 +1,45 @@
+"""游戏流程：start_game 与 step_round 的发言、投票"""
+import time
+
+from benchmarks.backend import register_ais
+from benchmarks.harness import measure, quiet
+
+
+def bench_start_game(run, client, backend, players=range(2, 11), repeat=5):
+    for count in players:
+        register_ais(client, backend, count)
+
+        def start():
+            response = client.post('/start_game')
+            assert response.status_code == 200, response.json
+
+        run.add('start_game', measure(start, repeat=repeat, warmup=1), players=count)
+
+
+def bench_step_round(run, client, backend, players=6, rounds=30, checkpoints=(1, 5, 10, 20, 30)):
+    """连续进行 rounds 轮（投票全部弃权，不会淘汰），按 checkpoints 分段统计每次调用的耗时
+
+    例如 checkpoints=(1, 5, 10) 时分别统计第1轮、第2-5轮、第6-10轮。
+    """
+    register_ais(client, backend, players)
+    with quiet():
+        game_id = client.post('/start_game').json['game_id']
+    speak_samples, vote_samples = [], []
+    window_start = 1
+    for round_num in range(1, rounds + 1):
+        with quiet():
+            for ai_index in range(players):
+                started = time.perf_counter()
+                response = client.post('/step_round', json={"game_id": game_id, "stage": "speak", "ai_index": ai_index})
+                speak_samples.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.json
+            started = time.perf_counter()
+            response = client.post('/step_round', json={"game_id": game_id, "stage": "vote_all"})
+            vote_samples.append(time.perf_counter() - started)
+            assert response.status_code == 200, response.json
+        if round_num in checkpoints or round_num == rounds:
+            label = str(round_num) if window_start == round_num else f"{window_start}-{round_num}"
+            run.add('step_round.speak', speak_samples, players=players, rounds=label)
+            run.add('step_round.vote_all', vote_samples, players=players, rounds=label)
+            speak_samples, vote_samples = [], []
+            window_start = round_num + 1
@@ -0,0 +1,40 @@
+"""对话历史：一次性格式化与增量渲染随轮数增长的耗时"""
+from app.services import format_conversation_history
+from app.transcript import Transcript
+from benchmarks.harness import measure
+
+PLAYERS = 6
+AI = {"id": "history", "name": "history", "apikey": "", "apibase": ""}
+
+
+def _round_messages(round_num):
+    return [
+        {"role": "assistant", "ai_name": f"玩家{p + 1}", "content": f"第{round_num}轮，我是玩家{p + 1}，" + "说说我的看法。" * 10}
+        for p in range(PLAYERS)
+    ]
+
+
+def bench_format_history(run, round_counts=(1, 5, 10, 20, 50), repeat=20):
+    for rounds in round_counts:
+        messages = [m for r in range(rounds) for m in _round_messages(r)]
+        run.add(
+            'format_conversation_history',
+            measure(lambda: format_conversation_history(AI, messages), repeat=repeat),
+            rounds=rounds
+        )
+
+        # 游戏中的实际路径：已有 rounds-1 轮的缓存，并入新的一轮后渲染
+        transcripts = []
+
+        def setup():
+            transcript = Transcript(messages[:-PLAYERS])
+            transcript.render()
+            transcripts.append(transcript)
+
+        def render_incremental():
+            transcript = transcripts.pop()
+            for m in messages[-PLAYERS:]:
+                transcript.append(m['ai_name'], m['content'])
+            transcript.render_for(AI['name'])
+
+        run.add('transcript.render_incremental', measure(render_incremental, repeat=repeat, setup=setup), rounds=rounds)
@@ -0,0 +1,90 @@
+"""存储：AI 注册表与游戏状态的读写随历史增长的耗时"""
+import copy
+import os
+
+from app import models
+from app.api import load_game_state, record_event, save_game_state, session_manager
+from app.engine import new_game_state, record_in_memory
+from app.game_log import GameLog
+from benchmarks.harness import measure
+
+PLAYERS = 6
+
+
+def _fake_ais(count):
+    return [
+        {"id": f"storage-{i}", "name": f"storage-{i}", "apikey": f"skey-{i}", "apibase": f"http://storage/{i}", "score": 0, "messages": []}
+        for i in range(count)
+    ]
+
+
+def bench_registry(run, history_sizes=(10, 100, 1000), repeat=10):
+    """load_data / save_data：每个AI有 history_sizes 条消息时，整表读取与“追加一条后保存”的耗时"""
+    for size in history_sizes:
+        data = _fake_ais(PLAYERS)
+        for ai in data:
+            ai['messages'] = [
+                {"role": "assistant", "ai_name": ai['name'], "content": f"第{i}条发言，" + "内容" * 40}
+                for i in range(size)
+            ]
+            models.insert_ai(ai)
+
+        run.add('load_data', measure(models.load_data, repeat=repeat), messages_per_ai=size)
+        # /get_data 的列表投影与单个AI的消息分页，不应随消息总数增长
+        run.add('list_ais[fields=id,name,score]', measure(
+            lambda: models.list_ais(('id', 'name', 'score')), repeat=repeat), messages_per_ai=size)
+        run.add('get_messages[limit=50]', measure(
+            lambda: models.get_messages(data[0]['id'], 50), repeat=repeat), messages_per_ai=size)
+
+        counter = [size]
+
+        def append_one():
+            counter[0] += 1
+            for ai in data:
+                ai['messages'].append({"role": "assistant", "ai_name": ai['name'], "content": f"第{counter[0]}条发言"})
+
+        run.add('save_data', measure(lambda: models.save_data(data), repeat=repeat, setup=append_one), messages_per_ai=size)
+        for ai in data:
+            models.delete_ai_record(ai['id'])
+
+
+def _state_with_history(rounds):
+    ais = _fake_ais(PLAYERS)
+    state = new_game_state(ais)
+    for round_num in range(rounds + 1):
+        record_in_memory(state, 'round', round=round_num)
+        for ai in ais:
+            record_in_memory(
+                state, 'speech', round=round_num, ai_id=ai['id'],
+                name=state['player_map'][ai['id']], response="我觉得大家都挺真实的，" * 8
+            )
+    return state
+
+
+def bench_game_state(run, round_counts=(1, 10, 50), repeat=10):
+    """load_game_state / save_game_state 以及事件追加、从磁盘冷加载，随已进行轮数增长的耗时"""
+    for rounds in round_counts:
+        template = _state_with_history(rounds)
+
+        def save():
+            state = copy.deepcopy(template)
+            state['game_id'] = None
+            save_game_state(state)
+
+        run.add('save_game_state', measure(save, repeat=repeat), rounds=rounds)
+
+        state = copy.deepcopy(template)
+        state['game_id'] = None
+        session = save_game_state(state)
+        game_id = session.game_id
+        run.add('load_game_state', measure(lambda: load_game_state(game_id), repeat=repeat), rounds=rounds)
+
+        def append_event():
+            record_event(session.state, 'summary', round=0, text="摘要")
+
+        run.add('record_event', measure(append_event, repeat=repeat), rounds=rounds)
+
+        game_dir = os.path.join(session_manager.base_dir, game_id)
+        session_manager.persist(session)
+        log = GameLog(os.path.join(game_dir, 'game_state.json'), os.path.join(game_dir, 'game_events.jsonl'))
+        run.add('game_log.load', measure(log.load, repeat=repeat), rounds=rounds)
@@ -0,0 +1,22 @@
+"""对比两次基准测试的结果，有回退时返回非零退出码"""
+import argparse
+import sys
+
+from benchmarks.harness import compare, format_comparison, load_results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="对比两次基准测试的结果")
+    parser.add_argument('baseline', help='基线结果 JSON')
+    parser.add_argument('current', help='本次结果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.2, help='变慢超过该比例记为回退')
+    parser.add_argument('--metric', default='median', choices=('min', 'median', 'p95', 'mean'))
+    args = parser.parse_args(argv)
+
+    rows, regressed = compare(load_results(args.baseline), load_results(args.current), args.threshold, args.metric)
+    print(format_comparison(rows, args.metric))
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
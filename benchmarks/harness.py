@@ -0,0 +1,128 @@
+"""计时、结果保存与对比"""
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+def summarize(samples):
+    """把一组耗时（秒）汇总为统计值"""
+    ordered = sorted(samples)
+    mean = statistics.fmean(ordered)
+    return {
+        "n": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+        "mean": mean,
+        "ops_per_sec": (1 / mean) if mean > 0 else None,
+    }
+
+
+@contextlib.contextmanager
+def quiet():
+    """丢弃被测代码的调试输出"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def measure(fn, repeat=20, warmup=2, setup=None):
+    """重复调用 fn 并计时；setup 在每次调用前执行，不计入耗时"""
+    samples = []
+    with quiet():
+        for i in range(warmup + repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - started
+            if i >= warmup:
+                samples.append(elapsed)
+    return samples
+
+
+class BenchmarkRun:
+    def __init__(self):
+        self.results = []
+
+    def add(self, name, samples, **params):
+        stats = summarize(samples)
+        self.results.append({"name": name, "params": params, "stats": stats})
+        label = result_key(name, params)
+        print(f"  {label:<60} median {stats['median'] * 1000:9.3f} ms   p95 {stats['p95'] * 1000:9.3f} ms", file=sys.stderr)
+        return stats
+
+    def to_dict(self, options=None):
+        return {"meta": run_meta(options), "results": self.results}
+
+    def save(self, path, options=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(options), f, ensure_ascii=False, indent=2)
+
+
+def result_key(name, params):
+    if not params:
+        return name
+    return f"{name}[{','.join(f'{k}={v}' for k, v in sorted(params.items()))}]"
+
+
+def run_meta(options=None):
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options or {},
+    }
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.2, metric="median"):
+    """按 metric 对比两次运行，返回 (对比行, 是否有回退)
+
+    变慢超过 threshold（比例）记为回退，变快超过 threshold 记为改进。
+    """
+    base = {result_key(r['name'], r['params']): r['stats'] for r in baseline['results']}
+    rows = []
+    regressed = False
+    for r in current['results']:
+        key = result_key(r['name'], r['params'])
+        new = r['stats'][metric]
+        old = base.get(key, {}).get(metric)
+        if old is None:
+            rows.append((key, None, new, None, "新增"))
+            continue
+        change = (new - old) / old if old else 0.0
+        if change > threshold:
+            status = "回退"
+            regressed = True
+        elif change < -threshold:
+            status = "改进"
+        else:
+            status = ""
+        rows.append((key, old, new, change, status))
+    return rows, regressed
+
+
+def format_comparison(rows, metric="median"):
+    lines = [f"{'测试项（' + metric + '）':<60}{'基线(ms)':>12}{'本次(ms)':>12}{'变化':>10}  状态"]
+    for key, old, new, change, status in rows:
+        old_text = f"{old * 1000:12.3f}" if old is not None else f"{'-':>12}"
+        change_text = f"{change:+10.1%}" if change is not None else f"{'-':>10}"
+        lines.append(f"{key:<60}{old_text}{new * 1000:12.3f}{change_text}  {status}")
+    return "\n".join(lines)
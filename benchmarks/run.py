@@ -0,0 +1,74 @@
+"""运行基准测试并把结果保存为 JSON，可与之前的结果对比"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+SUITES = ('game', 'storage', 'history')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="游戏流程与存储热路径的基准测试")
+    parser.add_argument('--output', default='bench_results.json', help='结果 JSON 文件')
+    parser.add_argument('--compare', help='与该 JSON 文件中的结果对比，有回退时返回非零退出码')
+    parser.add_argument('--threshold', type=float, default=0.2, help='中位数变慢超过该比例记为回退')
+    parser.add_argument('--only', action='append', choices=SUITES, help='只运行指定的测试组（可重复）')
+    parser.add_argument('--quick', action='store_true', help='缩小规模，快速检查')
+    parser.add_argument('--players', type=int, default=6, help='step_round 测试的玩家数')
+    parser.add_argument('--rounds', type=int, default=30, help='step_round 测试连续进行的轮数')
+    parser.add_argument('--latency', default='0', help='模拟后端的延迟分布（默认无延迟），如 lognormal:0.05,0.3')
+    args = parser.parse_args(argv)
+    suites = args.only or SUITES
+
+    # 所有数据写到临时目录，必须在导入 app 之前设置
+    data_dir = tempfile.mkdtemp(prefix='cyber-cricket-bench-')
+    os.environ['DATA_DIR'] = data_dir
+    # 日志会干扰计时，基准测试中关闭
+    os.environ.setdefault('LOG_LEVEL', 'OFF')
+    try:
+        from app import create_app
+        from benchmarks.backend import MockBackend
+        from benchmarks.harness import BenchmarkRun, compare, format_comparison, load_results
+
+        run = BenchmarkRun()
+        profile = {"latency": args.latency, "ttft": args.latency}
+        rounds = min(args.rounds, 10) if args.quick else args.rounds
+        checkpoints = tuple(r for r in (1, 5, 10, 20, 30, 50) if r <= rounds)
+        with MockBackend(profile) as backend:
+            app = create_app()
+            client = app.test_client()
+            if 'game' in suites:
+                from benchmarks.bench_game import bench_start_game, bench_step_round
+                print("[基准测试] start_game", file=sys.stderr)
+                bench_start_game(run, client, backend, players=(2, 6, 10) if args.quick else range(2, 11),
+                                 repeat=3 if args.quick else 5)
+                print("[基准测试] step_round", file=sys.stderr)
+                bench_step_round(run, client, backend, players=args.players, rounds=rounds, checkpoints=checkpoints)
+            if 'storage' in suites:
+                from benchmarks.bench_storage import bench_game_state, bench_registry
+                print("[基准测试] 存储", file=sys.stderr)
+                bench_registry(run, history_sizes=(10, 100) if args.quick else (10, 100, 1000))
+                bench_game_state(run, round_counts=(1, 10) if args.quick else (1, 10, 50))
+            if 'history' in suites:
+                from benchmarks.bench_history import bench_format_history
+                print("[基准测试] 对话历史", file=sys.stderr)
+                bench_format_history(run, round_counts=(1, 10) if args.quick else (1, 5, 10, 20, 50))
+
+        options = {k: v for k, v in vars(args).items() if k not in ('output', 'compare')}
+        run.save(args.output, options)
+        print(f"[基准测试] 结果已保存到 {args.output}", file=sys.stderr)
+
+        if args.compare:
+            rows, regressed = compare(load_results(args.compare), run.to_dict(), args.threshold)
+            print(format_comparison(rows))
+            if regressed:
+                print(f"[基准测试] 有测试项的中位数变慢超过 {args.threshold:.0%}", file=sys.stderr)
+                return 1
+        return 0
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
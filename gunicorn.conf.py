@@ -0,0 +1,41 @@
+"""gunicorn 配置：gunicorn -c gunicorn.conf.py wsgi:app
+
+工作进程数读取 WEB_CONCURRENCY（app.config 也据此平分出站限额），每个进程用多线程处理请求：
+LLM 调用和 /game_events 等长连接大部分时间在等待网络。
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(4, multiprocessing.cpu_count())))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# 一轮游戏和事件订阅都可能持续较久，不按请求时长杀掉工作进程
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 0))
+graceful_timeout = 30
+# 在主进程中创建应用（建表、迁移只执行一次），fork 后由 app.reset_after_fork 丢弃继承来的连接
+preload_app = True
+
+# 平分限额需要知道实际的进程数
+os.environ['WEB_CONCURRENCY'] = str(workers)
+
+
+def on_starting(server):
+    # 删除上次运行留下的各进程指标文件（见 app.metrics）
+    from app import metrics
+    metrics.clear_processes()
+
+
+def child_exit(server, worker):
+    # 退出的工作进程的计数仍计入 /metrics，文件改名后不会被复用同一进程号的新进程覆盖
+    from app import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # 每个工作进程在开始接收请求前预热自己的客户端池
+    from app.services import warm_clients
+    try:
+        warm_clients()
+    except Exception as e:
+        worker.log.warning("预热客户端池失败: %s", e)
@@ -0,0 +1,70 @@
+"""测试环境：数据目录指向临时目录，关闭日志文件，重试几乎不等待；须在导入 app 之前设置环境变量"""
+import os
+import shutil
+import tempfile
+import traceback
+import uuid
+
+import pytest
+
+_data_dir = tempfile.mkdtemp(prefix='cyber-cricket-test-')
+os.environ['DATA_DIR'] = _data_dir
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ['LOG_FILE'] = ''
+os.environ['LLM_BACKOFF_BASE'] = '0.001'
+os.environ['LLM_BACKOFF_MAX'] = '0.01'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_data_dir, ignore_errors=True)
+
+
+@pytest.fixture
+def fast_policy():
+    """几乎不等待的重试策略"""
+    from app.resilience import RetryPolicy
+    return RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.001, deadline=5)
+
+
+@pytest.fixture(scope='module')
+def backend():
+    """进程内的模拟 LLM 后端（app.mock_backend），不加延迟"""
+    from benchmarks.backend import MockBackend
+    with MockBackend({"abstain_rate": 0}) as backend:
+        yield backend
+
+
+@pytest.fixture
+def make_ai():
+    """生成指向 apibase 的AI；每次使用新的名称，熔断器与客户端互不影响"""
+    def make(apibase_of, **fields):
+        name = f"test-{uuid.uuid4().hex[:8]}"
+        return {"id": str(uuid.uuid4()), "name": name, "apikey": f"key-{name}", "apibase": apibase_of(name),
+                "score": 0, "messages": [], **fields}
+    return make
+
+
+def _fork_worker(fn):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            from app import reset_after_fork
+            reset_after_fork()
+            fn()
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        os._exit(code)
+
+    def join():
+        _, status = os.waitpid(pid, 0)
+        return os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    return join
+
+
+@pytest.fixture
+def fork_worker():
+    """fork_worker(fn)：在 fork 出的子进程（模拟另一个工作进程）中开始执行 fn()，
+    返回 join()，join() 等到子进程结束并返回 fn 是否正常完成"""
+    return _fork_worker
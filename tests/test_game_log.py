@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+from app.engine import play_game
+from app.game_log import GameLog, apply_event
+
+
+def _log(tmp_path, snapshot_every):
+    return GameLog(str(tmp_path / 'game_state.json'), str(tmp_path / 'game_events.jsonl'), snapshot_every=snapshot_every)
+
+
+@pytest.mark.parametrize('snapshot_every', [0, 7])
+def test_replay_matches_live_state(tmp_path, backend, make_ai, snapshot_every):
+    """整局的事件写入日志后，重新加载（快照 + 重放日志尾部）得到与内存中完全相同的状态"""
+    log = _log(tmp_path, snapshot_every)
+    ais = [make_ai(backend.apibase) for _ in range(4)]
+
+    def record(state, event_type, **payload):
+        if 'seq' not in state:
+            log.reset(state)
+        return log.append(state, event_type, **payload)
+
+    state, _ = play_game(ais, record=record, max_rounds=5, max_workers=4)
+    assert state['seq'] > 10
+
+    loaded = _log(tmp_path, snapshot_every).load()
+    assert loaded == json.loads(json.dumps(state))
+    if snapshot_every:
+        # 中途写过快照，日志里只剩快照之后的事件
+        assert loaded['snapshot_seq'] > 0
+
+
+def test_events_replayed_onto_initial_snapshot(tmp_path, backend, make_ai):
+    """从初始快照按顺序重放全部事件，结果与最终快照一致"""
+    log = _log(tmp_path, 0)
+    initial = {}
+    events = []
+
+    def record(state, event_type, **payload):
+        if 'seq' not in state:
+            log.reset(state)
+            initial.update(json.loads(json.dumps(state)))
+        event = log.append(state, event_type, **payload)
+        events.append(event)
+        return event
+
+    state, _ = play_game([make_ai(backend.apibase) for _ in range(3)], record=record, max_rounds=5)
+    log.snapshot(state)
+
+    for event in json.loads(json.dumps(events)):
+        apply_event(initial, event)
+    snapshot = json.loads((tmp_path / 'game_state.json').read_text(encoding='utf-8'))
+    snapshot.pop('snapshot_seq')
+    initial.pop('snapshot_seq')
+    assert initial == snapshot
+    assert (tmp_path / 'game_events.jsonl').read_text(encoding='utf-8') == ''
@@ -0,0 +1,113 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.jobs import CANCELLED, RUNNING, SUCCEEDED, GameBusy, JobCancelled, JobManager
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def manager():
+    return JobManager(max_workers=2, poll_interval=0.05)
+
+
+def _until_cancelled(started):
+    def run(job):
+        started.set()
+        steps = 0
+        while True:
+            job.check_cancelled()
+            steps += 1
+            job.update(steps=steps)
+            time.sleep(0.01)
+    return run
+
+
+def test_cancel_from_another_process(manager, fork_worker):
+    started = threading.Event()
+    job = manager.submit('test', _until_cancelled(started), game_id=str(uuid.uuid4()))
+    assert started.wait(5)
+
+    def cancel_elsewhere():
+        # 另一个工作进程看到的是任务表中的记录，只能写入取消标记
+        other = JobManager(poll_interval=0.05)
+        seen = other.get(job.id)
+        assert seen.to_dict()['status'] == RUNNING
+        other.cancel(job.id)
+        _wait_until(lambda: other.get(job.id).to_dict()['status'] == CANCELLED)
+
+    assert fork_worker(cancel_elsewhere)()
+    job.future.result(5)
+    assert job.status == CANCELLED
+    assert job.to_dict()['cancel_requested']
+
+
+def test_other_process_sees_progress_and_result(manager, fork_worker):
+    release = threading.Event()
+
+    def run(job):
+        job.update(stage='working')
+        release.wait(5)
+        return {"answer": 42}
+
+    job = manager.submit('test', run)
+    _wait_until(lambda: job.progress.get('stage') == 'working')
+
+    def watch_elsewhere():
+        other = JobManager(poll_interval=0.05)
+        seen = other.get(job.id)
+        assert seen.to_dict()['progress'] == {"stage": 'working'}
+        version = seen.version
+        # 等到执行任务的进程写入结果
+        while not seen.finished:
+            version = seen.wait_for_change(version, timeout=5)
+        assert seen.to_dict()['status'] == SUCCEEDED
+        assert seen.to_dict()['result'] == {"answer": 42}
+
+    join = fork_worker(watch_elsewhere)
+    time.sleep(0.2)
+    release.set()
+    assert join()
+
+
+def test_game_busy_across_processes(manager, fork_worker):
+    game_id = str(uuid.uuid4())
+    started = threading.Event()
+    job = manager.submit('test', _until_cancelled(started), game_id=game_id)
+    assert started.wait(5)
+
+    def submit_elsewhere():
+        other = JobManager(poll_interval=0.05)
+        with pytest.raises(GameBusy) as e:
+            other.submit('test', lambda job: None, game_id=game_id)
+        assert e.value.job.id == job.id
+        assert other.active_for(game_id).id == job.id
+
+    assert fork_worker(submit_elsewhere)()
+    manager.cancel(job.id)
+    job.future.result(5)
+    assert manager.active_for(game_id) is None
+
+
+def test_cancelled_job_keeps_partial_result(manager):
+    started = threading.Event()
+
+    def run(job):
+        started.set()
+        _wait_until(job.poll_cancel)
+        raise JobCancelled({"done": 3})
+
+    job = manager.submit('test', run)
+    assert started.wait(5)
+    manager.cancel(job.id)
+    job.future.result(5)
+    assert job.status == CANCELLED
+    assert job.result == {"done": 3}
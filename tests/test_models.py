@@ -0,0 +1,41 @@
+import threading
+import uuid
+
+from app.models import append_message, get_messages, insert_ai
+
+
+def _new_ai():
+    ai_id = str(uuid.uuid4())
+    insert_ai({"id": ai_id, "name": f"ai-{ai_id[:8]}", "apikey": f"key-{ai_id}", "apibase": f"http://{ai_id}/v1"})
+    return ai_id
+
+
+def test_concurrent_append_message_allocates_unique_seqs(fork_worker):
+    ai_id = _new_ai()
+    threads, per_writer = 6, 20
+
+    def write(prefix):
+        for i in range(per_writer):
+            append_message(ai_id, {"role": "assistant", "ai_name": prefix, "content": f"{prefix}-{i}"})
+
+    # 另一个进程与本进程的多个线程（各自的数据库连接）同时追加
+    join = fork_worker(lambda: write("child"))
+    workers = [threading.Thread(target=write, args=(f"thread{n}",)) for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert join()
+
+    messages, has_more = get_messages(ai_id, limit=1000)
+    assert not has_more
+    assert [m["seq"] for m in messages] == list(range((threads + 1) * per_writer))
+    assert len({m["content"] for m in messages}) == len(messages)
+
+
+def test_append_message_skips_repeated_content():
+    ai_id = _new_ai()
+    for content in ("a", "a", "b", "a"):
+        append_message(ai_id, {"role": "assistant", "content": content})
+    messages, _ = get_messages(ai_id)
+    assert [(m["seq"], m["content"]) for m in messages] == [(0, "a"), (1, "b"), (2, "a")]
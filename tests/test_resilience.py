@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+from app.config import Config
+from app.resilience import CLOSED, HALF_OPEN, CircuitBreaker, CircuitOpenError, call_with_retry
+from benchmarks.backend import MockBackend
+
+
+def _failing(calls):
+    def fn():
+        calls.append(1)
+        raise ConnectionError("down")
+    return fn
+
+
+def test_disabled_breaker_still_retries(fast_policy):
+    breaker = CircuitBreaker('disabled', failure_threshold=0)
+    calls = []
+    with pytest.raises(ConnectionError):
+        call_with_retry(_failing(calls), breaker, fast_policy)
+    assert len(calls) == fast_policy.max_attempts
+    assert breaker.state == CLOSED
+    assert not breaker.is_open
+    # 再多的失败也不会熔断
+    for _ in range(10):
+        breaker.record_failure(ConnectionError("down"))
+    breaker.allow()
+    assert not breaker.is_open
+
+
+def test_breaker_opens_after_threshold_and_stops_retrying(fast_policy):
+    breaker = CircuitBreaker('threshold', failure_threshold=2, reset_timeout=60)
+    calls = []
+    with pytest.raises(ConnectionError):
+        call_with_retry(_failing(calls), breaker, fast_policy)
+    # 第二次失败触发熔断，不再等待第三次重试
+    assert len(calls) == 2
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        call_with_retry(_failing(calls), breaker, fast_policy)
+    assert len(calls) == 2
+
+
+def test_non_endpoint_errors_do_not_open_breaker():
+    breaker = CircuitBreaker('client-errors', failure_threshold=1)
+    breaker.record_failure(ValueError("bad request"))
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker('half-open', failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure(ConnectionError("down"))
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+    time.sleep(0.06)
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # 探测进行中，其他调用仍被拒绝
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+
+def test_failed_probe_reopens_breaker():
+    breaker = CircuitBreaker('probe-fails', failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure(ConnectionError("down"))
+    time.sleep(0.06)
+    breaker.allow()
+    # 半开状态下一次失败就重新熔断，不必再累计到阈值
+    breaker.record_failure(ConnectionError("still down"))
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_breaker_trips_on_mock_backend_errors(make_ai, monkeypatch):
+    """模拟后端持续返回 500 时，该 apibase 的熔断器在阈值处打开，不再继续重试"""
+    from app import services
+    from app.transcript import Transcript
+
+    monkeypatch.setattr(Config, 'BREAKER_FAILURE_THRESHOLD', 2)
+    monkeypatch.setattr(Config, 'LLM_MAX_ATTEMPTS', 5)
+    with MockBackend({"error_rate": 1.0}) as failing:
+        ai = make_ai(failing.apibase)
+        response = services.call_api(ai, "hi", transcript=Transcript(), ai_name="玩家1")
+        assert "暂时无法回应" in response
+        breaker = services.breaker_of(ai)
+        assert breaker.is_open
+        assert breaker.failures == 2
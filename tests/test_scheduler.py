@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from app import services
+from app.scheduler import ProviderQueue, Scheduler
+from app.transcript import Transcript
+from benchmarks.backend import MockBackend
+
+
+def _grant_order(monkeypatch):
+    order = []
+    grant = ProviderQueue._grant
+
+    def recording_grant(self, ticket, now):
+        order.append(ticket.game)
+        grant(self, ticket, now)
+    monkeypatch.setattr(ProviderQueue, '_grant', recording_grant)
+    return order
+
+
+def _wait_for_depth(scheduler, key, depth):
+    deadline = time.monotonic() + 5
+    while scheduler.queue_for(key).depth() < depth:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_waiting_games_are_served_round_robin(monkeypatch):
+    """大局先排了很多请求，小局后到的请求也不必等大局的全部放行完"""
+    order = _grant_order(monkeypatch)
+    # 每 10ms 放行一个请求，桶里最多攒 1 个
+    scheduler = Scheduler({"provider": {"rpm": 6000}}, burst_seconds=0.01)
+    scheduler.pause("provider", 0.5)
+
+    threads = []
+
+    def enqueue(game, count):
+        for _ in range(count):
+            thread = threading.Thread(target=scheduler.acquire, args=("provider",), kwargs={"game": game})
+            thread.start()
+            threads.append(thread)
+        _wait_for_depth(scheduler, "provider", len(threads))
+
+    enqueue("big", 6)
+    enqueue("small", 2)
+    for thread in threads:
+        thread.join(5)
+
+    assert sorted(order) == ["big"] * 6 + ["small"] * 2
+    assert order[:4] == ["big", "small", "big", "small"]
+
+
+def test_unlimited_provider_does_not_queue():
+    scheduler = Scheduler()
+    ticket = scheduler.acquire("free", tokens=lambda: pytest.fail("未配置 TPM 时不应估算 token"))
+    assert ticket.tokens == 0
+    assert not scheduler.queue_for("free").limited
+
+
+class _Usage:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+def test_settle_and_refund_tokens():
+    scheduler = Scheduler({"provider": {"tpm": 60000}}, burst_seconds=10)
+    queue = scheduler.queue_for("provider")
+    full = queue.tokens.capacity
+
+    ticket = scheduler.acquire("provider", tokens=4000)
+    assert queue.tokens.tokens == pytest.approx(full - 4000, abs=5)
+    # 实际用量比估算少，多扣的退回
+    scheduler.settle(ticket, _Usage(1000))
+    assert queue.tokens.tokens == pytest.approx(full - 1000, abs=5)
+
+    ticket = scheduler.acquire("provider", tokens=3000)
+    scheduler.refund(ticket)
+    assert queue.tokens.tokens == pytest.approx(full - 1000, abs=5)
+
+
+def test_failed_calls_refund_estimated_tokens(make_ai, monkeypatch):
+    """调用模拟后端全部失败（含重试）后，预扣的 token 全部退还"""
+    with MockBackend({"error_rate": 1.0}) as failing:
+        ai = make_ai(failing.apibase)
+        provider = services.provider_of(ai)
+        scheduler = Scheduler({provider: {"tpm": 60000}}, burst_seconds=10)
+        monkeypatch.setattr(services, 'scheduler', scheduler)
+        queue = scheduler.queue_for(provider)
+        full = queue.tokens.capacity
+
+        services.call_api(ai, "hi", transcript=Transcript(), ai_name="玩家1")
+        assert queue.granted >= 1
+        assert queue.tokens.tokens == pytest.approx(full, abs=5)
+
+        list(services.call_api_stream(dict(ai), "hi", transcript=Transcript(), ai_name="玩家1"))
+        assert queue.tokens.tokens == pytest.approx(full, abs=5)
+
+
+def test_successful_calls_settle_actual_usage(backend, make_ai, monkeypatch):
+    """成功的调用按响应中的实际用量结算：模拟后端只生成几十个 token，max_tokens 的预留退回"""
+    ai = make_ai(backend.apibase)
+    provider = services.provider_of(ai)
+    scheduler = Scheduler({provider: {"tpm": 60000}}, burst_seconds=10)
+    monkeypatch.setattr(services, 'scheduler', scheduler)
+    queue = scheduler.queue_for(provider)
+    full = queue.tokens.capacity
+
+    messages = services.build_speak_messages(ai, "hi", Transcript())
+    services.complete_speech(ai, messages)
+    used = full - queue.tokens.tokens
+    assert 0 < used < services.estimate_request_tokens(messages, 800) - 500
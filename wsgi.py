@@ -0,0 +1,9 @@
+"""生产环境入口，交给多进程的 WSGI 服务器，例如：
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+也可以让服务器直接调用工厂函数：gunicorn -c gunicorn.conf.py "app:create_app('production')"
+"""
+from app import create_app
+
+app = create_app('production')